@@ -1,27 +1,88 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import torch
 import os
+import time
+import threading
 import uvicorn
 from contextlib import asynccontextmanager
 
-from model_loader import load_model
+from engines import create_engine, warm_up
+import inference
+import metrics
 from inference import run_inference
+from batch_inference import run_batch_inference
+from mask_encoding import result_to_geojson, panels_to_geojson
+from region_scan import RegionScan, region_polygon, count_region_tiles, REGION_SCAN_MAX_TILES
+from utils.tile_cache import get_tile_cache
+from utils.imagery_scheduler import ImageryDeferred, get_imagery_scheduler
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, model_fingerprint
+from jobs import JobManager
+from artifact_writer import get_artifact_writer
+from scheduler import InferenceScheduler, QueueFullError, SCHEDULER_ENABLED, SCHEDULER_WORKERS
+
+# Configuration
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), "models", "antigravity_model.pt"))
+# Load and warm up the model on a background thread: the server accepts connections right away
+# and /health answers 503 "starting" until the model is ready
+BACKGROUND_MODEL_LOAD = os.getenv("BACKGROUND_MODEL_LOAD", "1") == "1"
 
 # Global State
-MODEL = None
+MODEL = None       # engine for interactive requests (scheduler view or engine, see engines.py)
+BULK_MODEL = None  # engine for /batch_infer and jobs; waits for queue room instead of failing
+SCHEDULER = None
+JOB_MANAGER = None
+RESULT_CACHE = None  # stored verdicts by location, buffer and model (see result_cache.py)
 DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+STARTUP = {"status": "starting", "load_seconds": None, "warmup_seconds": None, "ready_seconds": None, "error": None}
+
+def load_models():
+    """
+    Builds the engine (or the model worker processes), warms it up, then publishes it.
+    MODEL stays None until the warm-up pass is done, so /infer answers 503 until then.
+    """
+    global MODEL, BULK_MODEL, SCHEDULER, JOB_MANAGER, RESULT_CACHE
+    start = time.perf_counter()
+    try:
+        # With model worker processes the engines live (and warm up) in the workers, not here
+        engine = create_engine(MODEL_PATH, DEVICE) if not (SCHEDULER_ENABLED and SCHEDULER_WORKERS > 0) else None
+        STARTUP["load_seconds"] = round(time.perf_counter() - start, 3)
+        if engine is not None:
+            STARTUP["warmup_seconds"] = round(warm_up(engine), 3)
+        if SCHEDULER_ENABLED:
+            SCHEDULER = InferenceScheduler(engine=engine, model_path=MODEL_PATH, device=DEVICE).start()
+            MODEL, BULK_MODEL = SCHEDULER.view(block=False), SCHEDULER.view(block=True)
+        else:
+            MODEL = BULK_MODEL = engine
+        if RESULT_CACHE_ENABLED:
+            RESULT_CACHE = ResultCache(model_fingerprint(MODEL_PATH))
+        JOB_MANAGER = JobManager(
+            lambda locations: run_batch_inference(BULK_MODEL, locations, DEVICE, 1200, cache=RESULT_CACHE)[0])
+        JOB_MANAGER.start()
+    except Exception as e:
+        print(f"Model loading failed: {e}")
+        STARTUP.update(status="error", error=str(e))
+        return
+    STARTUP.update(status="ok", ready_seconds=round(time.perf_counter() - start, 3))
+    print(f"Model ready in {STARTUP['ready_seconds']}s")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global MODEL
-    model_path = os.path.join(os.path.dirname(__file__), "models", "antigravity_model.pt")
-    MODEL = load_model(model_path, DEVICE)
+    loader = threading.Thread(target=load_models, name="model-loader", daemon=True)
+    loader.start()
+    if not BACKGROUND_MODEL_LOAD:
+        loader.join()
     yield
     # Shutdown
     print("Shutting down...")
+    loader.join()
+    if JOB_MANAGER is not None:
+        JOB_MANAGER.stop()
+    if SCHEDULER is not None:
+        SCHEDULER.stop()
+    get_artifact_writer().flush()
 
 app = FastAPI(title="Antigravity API", version="1.0", lifespan=lifespan)
 
@@ -35,33 +96,84 @@ app.add_middleware(
 )
 
 # Static Files
-artifacts_dir = os.path.join(os.path.dirname(__file__), "artifacts")
-if not os.path.exists(artifacts_dir):
-    os.makedirs(artifacts_dir)
-app.mount("/static", StaticFiles(directory=artifacts_dir), name="static")
+# Artifacts are written in the background (see artifact_writer.py), so requests for a
+# file that is still queued trigger the write instead of returning 404.
+@app.get("/static/{filename}")
+def static_artifact(filename: str):
+    path = get_artifact_writer().ensure(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return FileResponse(path)
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "device": str(DEVICE)}
+    if STARTUP["status"] != "ok":
+        # Not ready yet (or loading failed): load balancers shouldn't route traffic here
+        return JSONResponse(status_code=503, content={"status": STARTUP["status"], "device": str(DEVICE), "startup": STARTUP})
+    cache = get_tile_cache()
+    if SCHEDULER is not None and not SCHEDULER.healthy:
+        # Every model worker gave up restarting: requests would only fail here
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "device": str(DEVICE),
+                                                      "scheduler": SCHEDULER.stats()})
+    return {
+        "status": "ok",
+        "device": str(DEVICE),
+        "startup": STARTUP,
+        "tile_cache": cache.stats() if cache is not None else None,
+        "result_cache": RESULT_CACHE.stats() if RESULT_CACHE is not None else None,
+        "inference_stages": dict(inference.STAGE_COUNTS),
+        "scheduler": SCHEDULER.stats() if SCHEDULER is not None else None,
+        "imagery": get_imagery_scheduler().stats()
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus scrape endpoint: stage latency histograms and pipeline counters.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/infer")
 def infer(
     lat: float = Query(..., description="Latitude"),
     lon: float = Query(..., description="Longitude"),
-    buffer_sqft: int = Query(1200, description="Area buffer in sqft (1200 or 2400)")
+    buffer_sqft: int = Query(1200, description="Area buffer in sqft (1200 or 2400)"),
+    debug: bool = Query(metrics.DEBUG_TIMINGS, description="Include per-stage timings_ms in the response"),
+    cache: bool = Query(True, description="Return the stored result for this location if there is one; false re-runs and refreshes it"),
+    format: str = Query("json", description="json, or geojson for a FeatureCollection of the location and its detected panels")
 ):
     try:
         if MODEL is None:
             raise HTTPException(status_code=503, detail="Model not loaded")
+        if format not in ("json", "geojson"):
+            raise HTTPException(status_code=422, detail="format must be 'json' or 'geojson'")
             
-        result = run_inference(MODEL, lat, lon, buffer_sqft, DEVICE)
+        with metrics.trace() as timings:
+            result = RESULT_CACHE.get(lat, lon, buffer_sqft) if RESULT_CACHE is not None and cache else None
+            if result is None:
+                result = run_inference(MODEL, lat, lon, buffer_sqft, DEVICE)
+                if RESULT_CACHE is not None:
+                    RESULT_CACHE.put(lat, lon, buffer_sqft, result)
+        if debug:
+            result["timings_ms"] = metrics.timings_ms(timings)
+        if format == "geojson":
+            return JSONResponse(result_to_geojson(result), media_type="application/geo+json")
         return result
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        metrics.ERRORS.inc(kind="rejected")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except ImageryDeferred as e:
+        # Imagery quota used up: say when to come back instead of answering from a mock tile
+        return JSONResponse(status_code=503, content=e.to_dict(), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Inference error: {e}")
+        metrics.ERRORS.inc(kind="infer")
         raise HTTPException(status_code=500, detail=str(e))
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class Coordinate(BaseModel):
     id: str
@@ -72,29 +184,91 @@ class BatchRequest(BaseModel):
     locations: List[Coordinate]
 
 @app.post("/batch_infer")
-def batch_infer(request: BatchRequest):
+def batch_infer(
+    request: BatchRequest,
+    cache: bool = Query(True, description="Return stored results where available; false re-runs and refreshes them")
+):
     if MODEL is None:
          raise HTTPException(status_code=503, detail="Model not loaded")
     
-    results = []
-    for loc in request.locations:
-        try:
-            # Reusing the existing run_inference logic
-            # Note: sequential processing for simplicity. Parallelizing might be needed for scale.
-            res = run_inference(MODEL, loc.lat, loc.lon, 1200, DEVICE)
-            # Inject the original ID back so user can track it
-            res['user_id'] = loc.id
-            results.append(res)
-        except Exception as e:
-            print(f"Error processing {loc.id}: {e}")
-            results.append({
-                "user_id": loc.id,
-                "error": str(e),
-                "solar_present": False, # Default fallbacks
-                "solar_area_m2": 0.0
-            })
+    locations = [(loc.id, loc.lat, loc.lon) for loc in request.locations]
+    results, _ = run_batch_inference(BULK_MODEL, locations, DEVICE, 1200, cache=RESULT_CACHE, lookup=cache)
             
     return {"results": results}
 
+class RegionRequest(BaseModel):
+    bbox: Optional[List[float]] = None            # [min_lon, min_lat, max_lon, max_lat]
+    polygon: Optional[List[List[float]]] = None   # [[lon, lat], ...]
+
+@app.post("/region_scan")
+def region_scan(
+    request: RegionRequest,
+    stream: bool = Query(False, description="Stream NDJSON: one panel per line as it is found, then a summary line"),
+    format: str = Query("json", description="json, or geojson for a FeatureCollection of the panels (ignored when streaming)")
+):
+    """
+    Finds every panel inside a bounding box or polygon (see region_scan.py).
+    """
+    if MODEL is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if format not in ("json", "geojson"):
+        raise HTTPException(status_code=422, detail="format must be 'json' or 'geojson'")
+    try:
+        region = region_polygon(request.bbox, request.polygon)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if count_region_tiles(region, limit=REGION_SCAN_MAX_TILES) > REGION_SCAN_MAX_TILES:
+        raise HTTPException(status_code=413, detail=f"Region needs more than {REGION_SCAN_MAX_TILES} tiles; "
+                                                    f"split it or use region_scan.py")
+    scan = RegionScan(BULK_MODEL, region, DEVICE)
+    if stream:
+        return StreamingResponse(scan.ndjson(), media_type="application/x-ndjson")
+    panels = list(scan)
+    if format == "geojson":
+        return JSONResponse(panels_to_geojson(panels, scan.summary()), media_type="application/geo+json")
+    return {**scan.summary(), "panels": panels}
+
+@app.post("/jobs")
+def submit_job(request: BatchRequest):
+    """
+    Queues a batch for background processing and returns immediately with a job id.
+    """
+    if JOB_MANAGER is None:
+        raise HTTPException(status_code=503, detail="Job manager not running")
+
+    locations = [(loc.id, loc.lat, loc.lon) for loc in request.locations]
+    job_id = JOB_MANAGER.submit(locations)
+    return JOB_MANAGER.store.progress(job_id)
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    progress = JOB_MANAGER.store.progress(job_id) if JOB_MANAGER else None
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+@app.get("/jobs/{job_id}/results")
+def job_results(
+    request: Request,
+    job_id: str,
+    format: str = Query("ndjson", description="ndjson or sse"),
+    after: int = Query(0, description="Only results after this sequence number")
+):
+    """
+    Streams results while they complete, as NDJSON or Server-Sent Events.
+    """
+    if JOB_MANAGER is None or JOB_MANAGER.store.progress(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=422, detail="format must be 'ndjson' or 'sse'")
+
+    # EventSource sends Last-Event-ID when it reconnects
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(JOB_MANAGER.stream_results(job_id, format, after), media_type=media_type)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,168 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# Configuration
+ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), "artifacts")
+ARTIFACT_MODE = os.getenv("ARTIFACT_MODE", "async")               # async | lazy | sync
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "png").lower()     # png | webp | jpeg
+ARTIFACT_QUALITY = int(os.getenv("ARTIFACT_QUALITY", "80"))       # webp / jpeg quality
+ARTIFACT_PNG_COMPRESS_LEVEL = int(os.getenv("ARTIFACT_PNG_COMPRESS_LEVEL", "1"))  # 0-9, PIL default is 6
+ARTIFACT_SAVE_ORIGINAL = os.getenv("ARTIFACT_SAVE_ORIGINAL", "1") == "1"
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_WORKERS", "1"))
+ARTIFACT_QUEUE_SIZE = int(os.getenv("ARTIFACT_QUEUE_SIZE", "256"))
+ARTIFACT_LAZY_ITEMS = int(os.getenv("ARTIFACT_LAZY_ITEMS", "256"))  # renders kept in memory in lazy mode
+
+EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg", "jpg": "jpg"}
+
+class ArtifactWriter:
+    """
+    Encodes and saves result images off the request hot path.
+
+    submit() returns the /static paths immediately. The images are then:
+    - async: written by background threads through a bounded queue;
+    - lazy:  kept in memory and only encoded when /static asks for them
+             (the oldest are flushed to the background queue past ARTIFACT_LAZY_ITEMS);
+    - sync:  written before submit() returns (previous behaviour).
+    ensure() lets the /static route serve a file whose write hasn't happened yet.
+    """
+    def __init__(self, directory: str = ARTIFACTS_DIR, mode: str = ARTIFACT_MODE, fmt: str = ARTIFACT_FORMAT,
+                 quality: int = ARTIFACT_QUALITY, save_original: bool = ARTIFACT_SAVE_ORIGINAL,
+                 workers: int = ARTIFACT_WORKERS):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unsupported ARTIFACT_FORMAT '{fmt}', expected one of {sorted(EXTENSIONS)}")
+        if mode not in ("async", "lazy", "sync"):
+            raise ValueError(f"Unsupported ARTIFACT_MODE '{mode}', expected async, lazy or sync")
+        self.directory = directory
+        self.mode = mode
+        self.fmt = "jpeg" if fmt == "jpg" else fmt
+        self.ext = EXTENSIONS[fmt]
+        self.quality = quality
+        self.save_original = save_original
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending = {}             # filename -> PIL image or HxWx3 uint8 array, queued for writing
+        self._lazy = OrderedDict()     # same, but only written on demand (lazy mode)
+        self._writing = {}             # filename -> Event set once the file is on disk
+        self._queue = queue.Queue(maxsize=ARTIFACT_QUEUE_SIZE)
+        self._threads = []
+        if mode != "sync":
+            for n in range(max(1, workers)):
+                t = threading.Thread(target=self._worker, name=f"artifact-writer-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, sample_id: str, original, overlay) -> dict:
+        """
+        Schedules the original tile (PIL image) and the overlay (numpy array or PIL image)
+        and returns their /static paths, valid right away.
+        """
+        images = {"overlay": overlay}
+        if self.save_original:
+            images["original"] = original
+
+        paths = {"original": None, "overlay": None}
+        for kind, image in images.items():
+            filename = f"{kind}_{sample_id}.{self.ext}"
+            paths[kind] = f"/static/{filename}"
+            if self.mode == "sync":
+                self._save(filename, image)
+                continue
+            if self.mode == "async":
+                with self._lock:
+                    self._pending[filename] = image
+                self._queue.put(filename)
+            else:
+                with self._lock:
+                    self._lazy[filename] = image
+                self._trim_lazy()
+        return paths
+
+    def ensure(self, filename: str):
+        """
+        Returns the on-disk path of an artifact, writing it now if it is still pending.
+        Returns None for unknown files.
+        """
+        filename = os.path.basename(filename)
+        path = os.path.join(self.directory, filename)
+        self._write(filename)
+        return path if os.path.exists(path) else None
+
+    def flush(self):
+        """
+        Writes everything still pending (used on shutdown).
+        """
+        with self._lock:
+            filenames = list(self._pending) + list(self._lazy)
+        for filename in filenames:
+            self._write(filename)
+
+    def _trim_lazy(self):
+        # Bound memory: the oldest lazy renders are handed to the background writers
+        overflow = []
+        with self._lock:
+            while len(self._lazy) > ARTIFACT_LAZY_ITEMS:
+                filename, image = self._lazy.popitem(last=False)
+                self._pending[filename] = image
+                overflow.append(filename)
+        for filename in overflow:
+            self._queue.put(filename)
+
+    def _worker(self):
+        while True:
+            filename = self._queue.get()
+            try:
+                self._write(filename)
+            except Exception as e:
+                print(f"Failed to write artifact {filename}: {e}")
+
+    def _write(self, filename: str, timeout: float = 30.0):
+        with self._lock:
+            image = self._pending.pop(filename, None)
+            if image is None:
+                image = self._lazy.pop(filename, None)
+            if image is None:
+                # Either already written, unknown, or another thread is writing it right now
+                event = self._writing.get(filename)
+            else:
+                event = self._writing[filename] = threading.Event()
+        if image is None:
+            if event is not None:
+                event.wait(timeout)
+            return
+        try:
+            self._save(filename, image)
+        finally:
+            with self._lock:
+                self._writing.pop(filename).set()
+
+    def _save(self, filename: str, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if self.fmt == "png":
+            options = {"compress_level": ARTIFACT_PNG_COMPRESS_LEVEL}
+        elif self.fmt == "webp":
+            options = {"quality": self.quality, "method": 0}
+        else:
+            options = {"quality": self.quality}
+        path = os.path.join(self.directory, filename)
+        # Write under a temp name so /static never serves a half-written file
+        tmp_path = f"{path}.tmp"
+        image.save(tmp_path, format=self.fmt.upper(), **options)
+        os.replace(tmp_path, path)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_artifact_writer() -> ArtifactWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ArtifactWriter()
+    return _writer
@@ -0,0 +1,176 @@
+import os
+import time
+
+import inference
+import metrics
+from inference import fetch_for_buffer, predict_batch, build_result, build_two_buffer_result
+from batch_planner import BATCH_PLANNER_ENABLED, plan_tiles, single_tiles
+from utils.tile_prefetcher import prefetch_map
+from utils.imagery_scheduler import BULK, ImageryDeferred
+
+# Configuration
+BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+
+def run_batch_inference(model, locations, device, buffer_sqft: int = 1200, batch_size: int = BATCH_SIZE,
+                        plan: bool = BATCH_PLANNER_ENABLED, cache=None, lookup: bool = True):
+    """
+    Batched version of run_inference for many locations.
+    locations: list of (user_id, lat, lon) tuples.
+
+    With plan=True, nearby locations share one tile (see batch_planner.py) and each
+    location's result only counts detections reaching into its own buffer footprint.
+    Tiles are fetched concurrently (see utils/tile_prefetcher.py) and grouped into
+    mini-batches so that every batch costs one model() call instead of one call per
+    coordinate. Locations with no solar in the 1200 sqft pass are re-batched for the
+    2400 sqft pass, same as run_inference.
+    Tiles are requested in the imagery scheduler's bulk lane; locations whose tile is
+    deferred by the imagery quota get {"status": "deferred", "retry_after_s": ...}.
+    cache: optional ResultCache (see result_cache.py). Stored verdicts are returned without
+    running anything (unless lookup=False) and new ones are stored.
+    Returns (results, stats); results keep the input order.
+    """
+    batch_size = max(1, batch_size)
+    results = [None] * len(locations)
+    stats = {"batches": 0, "images": 0, "model_seconds": 0.0, "batch_latencies": [],
+             "locations_planned": 0, "tiles": 0, "fetches_saved": 0, "forward_passes_saved": 0, "cache_hits": 0}
+
+    pending = list(range(len(locations)))
+    if cache is not None and lookup:
+        stored = cache.get_many([(lat, lon) for _, lat, lon in locations], buffer_sqft)
+        for i, result in enumerate(stored):
+            if result is not None:
+                result["user_id"] = locations[i][0]
+                results[i] = result
+        pending = [i for i in pending if results[i] is None]
+        stats["cache_hits"] = len(locations) - len(pending)
+    computed = pending
+    current_buffer = buffer_sqft
+    postprocess = _build_result
+    if inference.SINGLE_FETCH_BUFFERS and buffer_sqft == 1200:
+        # One zoom-19 tile per location covers both buffers, so there is no retry pass
+        current_buffer = 2400
+        postprocess = lambda prediction, image, is_mock, lat, lon, _, zoom, center: build_two_buffer_result(
+            prediction, image, is_mock, lat, lon, zoom, center=center)
+    while pending:
+        groups = _plan(locations, pending, current_buffer, plan, stats)
+        retry = []
+        # Tiles for the next batches keep downloading while the current batch is in the model
+        fetch = lambda group, buf=current_buffer: fetch_for_buffer(group.lat, group.lon, buf, BULK)
+        fetched = []
+        for group, tile, error in prefetch_map(fetch, groups):
+            if isinstance(error, ImageryDeferred):
+                for i in group.members:
+                    results[i] = _deferred_result(locations[i][0], error)
+            elif error is not None:
+                for i in group.members:
+                    print(f"Error processing {locations[i][0]}: {error}")
+                    results[i] = _error_result(locations[i][0], error)
+            else:
+                fetched.append((group, tile))
+            if len(fetched) == batch_size:
+                _run_chunk(model, locations, fetched, current_buffer, device, results, stats, postprocess)
+                retry.extend(_needs_retry(fetched, current_buffer, results))
+                fetched = []
+        if fetched:
+            _run_chunk(model, locations, fetched, current_buffer, device, results, stats, postprocess)
+            retry.extend(_needs_retry(fetched, current_buffer, results))
+
+        if not retry:
+            break
+        print(f"No solar found for {len(retry)} locations in 1200 sqft buffer, expanding to 2400 sqft...")
+        metrics.BUFFER_FALLBACKS.inc(len(retry))
+        pending = sorted(retry)
+        current_buffer = 2400
+
+    if cache is not None:
+        cache.put_many([(locations[i][1], locations[i][2], results[i]) for i in computed], buffer_sqft)
+    if stats["model_seconds"] > 0:
+        stats["images_per_sec"] = round(stats["images"] / stats["model_seconds"], 2)
+    else:
+        stats["images_per_sec"] = 0.0
+    print(f"Batch inference done: {stats['images']} images in {stats['batches']} batches "
+          f"({stats['images_per_sec']} img/s)")
+    return results, stats
+
+def _plan(locations, pending, buffer_sqft, plan, stats):
+    """
+    TileGroups for one buffer pass, with members mapped back to location indices.
+    """
+    points = [(locations[i][1], locations[i][2]) for i in pending]
+    groups = plan_tiles(points, buffer_sqft) if plan else single_tiles(points, buffer_sqft)
+    for group in groups:
+        group.members = [pending[m] for m in group.members]
+
+    # One tile per group means one fetch and one image in the forward batch per group
+    saved = len(points) - len(groups)
+    stats["locations_planned"] += len(points)
+    stats["tiles"] += len(groups)
+    stats["fetches_saved"] += saved
+    stats["forward_passes_saved"] += saved
+    if saved:
+        metrics.PLANNER_TILES_SAVED.inc(saved)
+        print(f"Batch planner: {len(points)} locations share {len(groups)} tiles at {buffer_sqft} sqft "
+              f"({saved} fetches and forward passes saved)")
+    return groups
+
+def _build_result(prediction, image_pil, is_mock, lat, lon, buffer_sqft, zoom_level, center):
+    # In a shared tile build_result counts only detections in this location's own footprint
+    return build_result(prediction, image_pil, is_mock, lat, lon, buffer_sqft, zoom_level, center=center)
+
+def _needs_retry(fetched, buffer_sqft, results):
+    # Two-step buffer logic: expand to 2400 sqft if nothing was found at 1200 sqft
+    if buffer_sqft != 1200:
+        return []
+    return [i for group, _ in fetched for i in group.members
+            if "error" not in results[i] and not results[i]["solar_present"]]
+
+def _run_chunk(model, locations, fetched, buffer_sqft, device, results, stats, postprocess):
+    """
+    One batched forward pass + per-location post-processing for one mini-batch of fetched tiles.
+    fetched: list of (TileGroup, (image_pil, is_mock, zoom_level)).
+    Failures are recorded per location so one bad coordinate doesn't sink the batch.
+    """
+    # 1. Predict (single model() call for the whole batch)
+    start = time.perf_counter()
+    try:
+        predictions = predict_batch(model, [image for _, (image, _, _) in fetched], device)
+    except Exception as e:
+        print(f"Batch prediction failed: {e}")
+        for group, _ in fetched:
+            for i in group.members:
+                results[i] = _error_result(locations[i][0], e)
+        return
+    elapsed = time.perf_counter() - start
+
+    stats["batches"] += 1
+    stats["images"] += len(fetched)
+    stats["model_seconds"] += elapsed
+    stats["batch_latencies"].append(round(elapsed, 4))
+    print(f"Batch {stats['batches']}: {len(fetched)} images in {elapsed:.3f}s "
+          f"({len(fetched) / elapsed:.2f} img/s)")
+
+    # 2. Post-process each output, once per location sharing the tile
+    for (group, (image_pil, is_mock, zoom_level)), prediction in zip(fetched, predictions):
+        for i in group.members:
+            user_id, lat, lon = locations[i]
+            try:
+                res = postprocess(prediction, image_pil, is_mock, lat, lon, buffer_sqft, zoom_level, group.center)
+                # Inject the original ID back so user can track it
+                res['user_id'] = user_id
+                results[i] = res
+            except Exception as e:
+                print(f"Error processing {user_id}: {e}")
+                results[i] = _error_result(user_id, e)
+
+def _error_result(user_id, error):
+    metrics.ERRORS.inc(kind="batch_item")
+    return {
+        "user_id": user_id,
+        "error": str(error),
+        "solar_present": False, # Default fallbacks
+        "solar_area_m2": 0.0
+    }
+
+def _deferred_result(user_id, deferred):
+    # No tile yet, so no verdict either: retry the location after retry_after_s
+    return {"user_id": user_id, **deferred.to_dict(), "solar_present": None, "solar_area_m2": None}
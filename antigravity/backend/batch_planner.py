@@ -0,0 +1,98 @@
+import os
+import math
+
+import numpy as np
+
+from utils.geo_utils import (get_zoom_level_for_box, get_buffer_footprint_pixels, world_to_latlon,
+                             bounding_boxes_for_area, latlon_to_world_array)
+from utils.image_fetcher import tile_center
+
+# Configuration
+# Off by default: a location in a shared tile only counts detections in its own footprint,
+# so its verdict can differ from /infer, which counts the whole tile
+BATCH_PLANNER_ENABLED = os.getenv("BATCH_PLANNER_ENABLED", "0") == "1"
+# Pixels kept clear at the tile edges: detections cut by the border are less reliable
+PLANNER_EDGE_MARGIN = int(os.getenv("PLANNER_EDGE_MARGIN", "64"))
+
+class TileGroup:
+    """
+    Locations served by one satellite tile and one forward pass.
+    members: indices into the planned points. center: (lat, lon) of the shared tile,
+    or None for a single location, whose tile stays centered on the location itself.
+    """
+    def __init__(self, members, lat: float, lon: float, zoom: int, shared: bool):
+        self.members = members
+        self.lat = lat
+        self.lon = lon
+        self.zoom = zoom
+        self.center = (lat, lon) if shared else None
+
+    def footprint(self, lat: float, lon: float, buffer_sqft: int, image_size: int = 640):
+        """
+        Pixel rectangle of a member's buffer in the shared tile as fetched (snapped like
+        every tile); None for single locations, which count every detection in their tile.
+        """
+        if self.center is None:
+            return None
+        return get_buffer_footprint_pixels(lat, lon, buffer_sqft, self.zoom, image_size, tile_center(*self.center))
+
+def plan_tiles(points, buffer_sqft: int, image_size: int = 640, margin: int = PLANNER_EDGE_MARGIN):
+    """
+    Groups (lat, lon) points whose buffer footprints fit together in one image_size tile
+    (less margin on every side) at the zoom level used for buffer_sqft.
+
+    Points are bucketed on a grid of usable-tile-sized cells, so each seed only looks at
+    the 3x3 cells around it. Groups grow greedily from the seed, nearest first, while the
+    bounding box of all their footprints still fits; the tile is centered on that box.
+    Returns TileGroups covering every point exactly once, in input order of their seeds.
+    """
+    span = image_size - 2 * margin
+    if not points:
+        return []
+    lat, lon = np.asarray(points, dtype=np.float64).T
+    # Same zoom as an unplanned tile of this buffer
+    zooms = np.full(len(lat), get_zoom_level_for_box(float(lat[0]), buffer_sqft, image_size))
+    min_lon, min_lat, max_lon, max_lat = bounding_boxes_for_area(lat, lon, buffer_sqft)
+    xs0, ys0 = latlon_to_world_array(max_lat, min_lon, zooms)
+    xs1, ys1 = latlon_to_world_array(min_lat, max_lon, zooms)
+    cell_x = ((xs0 + xs1) / 2 // span).astype(np.int64)
+    cell_y = ((ys0 + ys1) / 2 // span).astype(np.int64)
+    boxes = list(zip(zooms.tolist(), xs0.tolist(), ys0.tolist(), xs1.tolist(), ys1.tolist()))
+    cells = {}
+    for i, cell in enumerate(zip(zooms.tolist(), cell_x.tolist(), cell_y.tolist())):
+        cells.setdefault(cell, []).append(i)
+
+    assigned = [False] * len(points)
+    groups = []
+    for seed, (zoom, x0, y0, x1, y1) in enumerate(boxes):
+        if assigned[seed]:
+            continue
+        assigned[seed] = True
+        members = [seed]
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        candidates = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                      for j in cells.get((zoom, int(cx // span) + dx, int(cy // span) + dy), ())
+                      if not assigned[j]]
+        candidates.sort(key=lambda j: math.hypot((boxes[j][1] + boxes[j][3]) / 2 - cx, (boxes[j][2] + boxes[j][4]) / 2 - cy))
+        for j in candidates:
+            _, jx0, jy0, jx1, jy1 = boxes[j]
+            nx0, ny0, nx1, ny1 = min(x0, jx0), min(y0, jy0), max(x1, jx1), max(y1, jy1)
+            if nx1 - nx0 <= span and ny1 - ny0 <= span:
+                x0, y0, x1, y1 = nx0, ny0, nx1, ny1
+                assigned[j] = True
+                members.append(j)
+
+        if len(members) == 1:
+            lat, lon = points[seed]
+            groups.append(TileGroup(members, lat, lon, zoom, shared=False))
+        else:
+            lat, lon = world_to_latlon((x0 + x1) / 2, (y0 + y1) / 2, zoom)
+            groups.append(TileGroup(sorted(members), lat, lon, zoom, shared=True))
+    return groups
+
+def single_tiles(points, buffer_sqft: int, image_size: int = 640):
+    """
+    One tile per point (planning disabled).
+    """
+    return [TileGroup([i], lat, lon, get_zoom_level_for_box(lat, buffer_sqft, image_size), shared=False)
+            for i, (lat, lon) in enumerate(points)]
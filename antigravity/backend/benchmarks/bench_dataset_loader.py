@@ -0,0 +1,123 @@
+"""
+Training data loader throughput: SolarDataset (decode + parse + rasterize per sample)
+vs. CachedSolarDataset (memory-mapped pixels + bit-packed masks), in samples/sec.
+
+Runs on a real dataset directory or, by default, on a synthetic one with random
+polygon labels written to a temp dir:
+
+    python benchmarks/bench_dataset_loader.py --images 200 --polygons 8
+    python benchmarks/bench_dataset_loader.py --data ../../dataset_train --workers 0 2 4
+Also checks that both datasets yield identical samples.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "training"))
+import numpy as np
+import torch
+from PIL import Image
+
+from dataset_preprocess import SolarDataset, CachedSolarDataset, build_cache
+
+def write_synthetic_dataset(root, n_images, polygons, size=640, seed=0):
+    """
+    Noise JPEG tiles with 0..polygons random convex-ish polygons each, in YOLO polygon format.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(root, "images"), exist_ok=True)
+    os.makedirs(os.path.join(root, "labels"), exist_ok=True)
+    for i in range(n_images):
+        pixels = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(root, "images", f"tile{i:05d}.jpg"), quality=90)
+        lines = []
+        for _ in range(rng.integers(0, polygons + 1)):
+            cx, cy = rng.uniform(0.1, 0.9, 2)
+            radius = rng.uniform(0.02, 0.1)
+            angles = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(4, 12)))
+            xs = np.clip(cx + radius * np.cos(angles), 0, 1)
+            ys = np.clip(cy + radius * np.sin(angles), 0, 1)
+            lines.append("0 " + " ".join(f"{x:.6f} {y:.6f}" for x, y in zip(xs, ys)))
+        with open(os.path.join(root, "labels", f"tile{i:05d}.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+def collate(batch):
+    return tuple(zip(*batch))
+
+def to_tensor(img):
+    # Same as T.ToTensor(), without importing torchvision
+    return torch.from_numpy(np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0)
+
+def measure(dataset, workers, batch_size, epochs):
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers,
+                                         collate_fn=collate, persistent_workers=workers > 0)
+    rates = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        count = sum(len(images) for images, _ in loader)
+        rates.append(count / (time.perf_counter() - start))
+    # The first epoch includes worker start-up (and a cold page cache for the memory maps)
+    return {"first_epoch": round(rates[0], 1), "steady": round(max(rates[1:] or rates), 1)}
+
+def check_identical(plain, cached, limit):
+    for idx in range(min(limit, len(plain))):
+        (img_a, tgt_a), (img_b, tgt_b) = plain[idx], cached[idx]
+        if not torch.equal(img_a, img_b):
+            raise AssertionError(f"Sample {idx}: images differ")
+        for key in tgt_a:
+            if not torch.equal(tgt_a[key], tgt_b[key]):
+                raise AssertionError(f"Sample {idx}: target '{key}' differs")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=None, help="Dataset directory with images/ and labels/ (default: synthetic)")
+    parser.add_argument("--images", type=int, default=200, help="Synthetic dataset size")
+    parser.add_argument("--polygons", type=int, default=8, help="Max polygons per synthetic image")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_dataset_")
+    try:
+        root = args.data
+        if root is None:
+            root = os.path.join(tmp, "dataset")
+            print(f"Writing {args.images} synthetic images to {root}...")
+            write_synthetic_dataset(root, args.images, args.polygons)
+
+        cache_dir = os.path.join(tmp, "cache")
+        start = time.perf_counter()
+        build_cache(root, cache_dir)
+        build_seconds = time.perf_counter() - start
+        cache_mb = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir)) / 1e6
+
+        plain = SolarDataset(root, to_tensor)
+        cached = CachedSolarDataset(cache_dir, to_tensor)
+        check_identical(plain, cached, limit=20)
+        print("First 20 samples identical")
+
+        results = {"images": len(plain), "cache_build_seconds": round(build_seconds, 2),
+                   "cache_mb": round(cache_mb, 1), "loaders": []}
+        print(f"\n{'dataset':<10}{'workers':>8}{'1st epoch/s':>14}{'steady/s':>12}")
+        for workers in args.workers:
+            for name, dataset in (("plain", plain), ("cached", cached)):
+                rate = measure(dataset, workers, args.batch_size, args.epochs)
+                results["loaders"].append({"dataset": name, "workers": workers, **rate})
+                print(f"{name:<10}{workers:>8}{rate['first_epoch']:>14}{rate['steady']:>12}")
+        print(f"\nCache build: {build_seconds:.1f}s, {cache_mb:.0f} MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+CPU latency / throughput of the torch and ONNX Runtime inference engines.
+
+    python benchmarks/bench_engines.py --engines torch onnx --runs 10 --ort-threads 4
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import torch
+
+from engines import TorchEngine, OnnxEngine, ONNX_MODEL_PATH
+from model_loader import load_model
+from utils.image_fetcher import generate_mock_satellite_image
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--onnx", default=ONNX_MODEL_PATH)
+    parser.add_argument("--engines", nargs="+", default=["torch", "onnx"], choices=["torch", "onnx"])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--ort-threads", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    image = generate_mock_satellite_image("640x640")
+    report = {"torch_threads": torch.get_num_threads(), "results": []}
+
+    for name in args.engines:
+        start = time.perf_counter()
+        if name == "torch":
+            engine = TorchEngine(load_model(args.model, device, variant="eager"), device)
+        else:
+            engine = OnnxEngine(args.onnx, args.ort_threads)
+        load_s = time.perf_counter() - start
+
+        for _ in range(args.warmup):
+            engine.predict([image])
+        latencies = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            engine.predict([image])
+            latencies.append(time.perf_counter() - t0)
+
+        row = {
+            "engine": name,
+            "load_s": round(load_s, 2),
+            "median_s": round(statistics.median(latencies), 4),
+            "p95_s": round(sorted(latencies)[math.ceil(0.95 * len(latencies)) - 1], 4),
+            "images_per_sec": round(1 / statistics.median(latencies), 2),
+        }
+        print(row)
+        report["results"].append(row)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
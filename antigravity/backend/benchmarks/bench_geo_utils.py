@@ -0,0 +1,148 @@
+"""
+Vectorized geo utilities (utils/geo_utils.py *_array functions) against the scalar
+originals: first checks they agree on random coordinates, then measures points/sec.
+
+    python benchmarks/bench_geo_utils.py --points 1000000
+Exits with status 1 if any vectorized result differs from the scalar one.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import numpy as np
+
+from utils.geo_utils import (
+    get_meters_per_pixel, get_bounding_box_for_area, get_buffer_footprint_pixels, SQFT_TO_SQM, MAX_ZOOM,
+    latlon_to_world, world_to_latlon, latlon_to_pixel,
+    meters_per_pixel_array, bounding_boxes_for_area, zoom_levels_for_boxes, buffer_footprints_pixels,
+    latlon_to_world_array, world_to_latlon_array, latlon_to_pixel_array, pixel_to_latlon_array,
+    row_meters_per_pixel, mask_area_m2,
+)
+
+def fitting_zoom(lat, area_sqft, image_size=640):
+    """
+    Scalar reference for zoom_levels_for_boxes: zoom out from MAX_ZOOM until the buffer
+    box side fits in the image at this latitude.
+    """
+    side = math.sqrt(area_sqft * SQFT_TO_SQM)
+    zoom = MAX_ZOOM
+    while zoom > 0 and side / get_meters_per_pixel(lat, zoom) > image_size:
+        zoom -= 1
+    return zoom
+
+def random_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(-70, 70, n)
+    lon = rng.uniform(-180, 180, n)
+    area = rng.choice([600, 1200, 2400, 5000], n)
+    zoom = rng.choice([18, 19, 20], n)
+    return lat, lon, area, zoom
+
+def check_parity(n, seed=0, rtol=1e-9):
+    """
+    Max relative error of every vectorized function against its scalar version on n points,
+    and the number of footprint / zoom mismatches (must be 0).
+    """
+    lat, lon, area, zoom = random_points(n, seed)
+    # Shared tile centers a few hundred pixels away, as the batch planner produces
+    center_lat, center_lon = lat + 0.0004, lon - 0.0003
+    # Buffers from a shed to a county, so that every zoom level is picked somewhere
+    rng = np.random.default_rng(seed + 1)
+    zoom_lat = rng.uniform(-85, 85, n)
+    zoom_area = np.exp(rng.uniform(np.log(100), np.log(1e11), n))
+    rel = lambda a, b: float(np.max(np.abs(np.asarray(a) - np.asarray(b)) / np.maximum(np.abs(np.asarray(b)), 1e-12)))
+
+    scalar = {
+        "mpp": [get_meters_per_pixel(*p) for p in zip(lat, zoom)],
+        "world": [latlon_to_world(*p) for p in zip(lat, lon, zoom)],
+        "pixel": [latlon_to_pixel(*p) for p in zip(lat, lon, center_lat, center_lon, zoom)],
+        "bbox": [get_bounding_box_for_area(*p) for p in zip(lat, lon, area)],
+        "zoom": [fitting_zoom(*p) for p in zip(zoom_lat, zoom_area)],
+        "footprint": [get_buffer_footprint_pixels(a, b, c, d, 640, (e, f))
+                      for a, b, c, d, e, f in zip(lat, lon, area, zoom, center_lat, center_lon)],
+    }
+    world = np.stack(latlon_to_world_array(lat, lon, zoom), axis=1)
+    pixel = np.stack(latlon_to_pixel_array(lat, lon, center_lat, center_lon, zoom), axis=1)
+    back_lat, back_lon = world_to_latlon_array(world[:, 0], world[:, 1], zoom)
+    scalar_back = np.array([world_to_latlon(x, y, z) for (x, y), z in zip(scalar["world"], zoom)])
+    pix_lat, pix_lon = pixel_to_latlon_array(pixel[:, 0], pixel[:, 1], center_lat, center_lon, zoom)
+    footprints = buffer_footprints_pixels(lat, lon, area, zoom, 640, center_lat, center_lon)
+
+    errors = {
+        "meters_per_pixel": rel(meters_per_pixel_array(lat, zoom), scalar["mpp"]),
+        "latlon_to_world": rel(world, scalar["world"]),
+        "world_to_latlon": rel(np.stack([back_lat, back_lon], axis=1), scalar_back),
+        "latlon_to_pixel": float(np.max(np.abs(pixel - np.array(scalar["pixel"])))) / 640,
+        "pixel_to_latlon": rel(np.stack([pix_lat, pix_lon], axis=1), np.stack([lat, lon], axis=1)),
+        "bounding_box": rel(np.stack(bounding_boxes_for_area(lat, lon, area), axis=1), scalar["bbox"]),
+    }
+    mismatches = {
+        "zoom_level": int(np.sum(zoom_levels_for_boxes(zoom_lat, zoom_area) != np.array(scalar["zoom"]))),
+        "footprint": int(np.sum(np.any(footprints != np.array(scalar["footprint"]), axis=1))),
+    }
+
+    # Per-row area against the center-latitude approximation on a full tile: they only
+    # differ by the change of scale across the tile (tiny at zoom 20)
+    full = np.ones((640, 640), dtype=bool)
+    center_area = full.sum() * get_meters_per_pixel(45.0, 20) ** 2
+    errors["mask_area_vs_center"] = abs(mask_area_m2(full, 45.0, 20) - center_area) / center_area
+    rows = row_meters_per_pixel(45.0, 20)
+    ok = all(v <= rtol for k, v in errors.items() if k != "mask_area_vs_center") \
+        and errors["mask_area_vs_center"] < 1e-3 and rows[0] < rows[-1] and not any(mismatches.values())
+    return ok, errors, mismatches
+
+def rate(fn, n, repeat=3):
+    best = min(_timed(fn) for _ in range(repeat))
+    return n / best
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=1_000_000, help="Points per vectorized call")
+    parser.add_argument("--scalar-points", type=int, default=100_000, help="Points timed with the scalar loop")
+    parser.add_argument("--parity-points", type=int, default=20_000)
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    ok, errors, mismatches = check_parity(args.parity_points)
+    print(f"Parity on {args.parity_points} points: {'OK' if ok else 'FAILED'}")
+    for name, value in errors.items():
+        print(f"  {name:<22} max rel. error {value:.2e}")
+    for name, value in mismatches.items():
+        print(f"  {name:<22} mismatches {value}")
+
+    lat, lon, area, zoom = random_points(args.points, seed=1)
+    s_lat, s_lon, s_area, s_zoom = (v[:args.scalar_points] for v in (lat, lon, area, zoom))
+    cases = {
+        "latlon_to_world": (lambda: [latlon_to_world(*p) for p in zip(s_lat.tolist(), s_lon.tolist(), s_zoom.tolist())],
+                            lambda: latlon_to_world_array(lat, lon, zoom)),
+        "bounding_box": (lambda: [get_bounding_box_for_area(*p) for p in zip(s_lat.tolist(), s_lon.tolist(), s_area.tolist())],
+                         lambda: bounding_boxes_for_area(lat, lon, area)),
+        "zoom_level": (lambda: [fitting_zoom(*p) for p in zip(s_lat.tolist(), s_area.tolist())],
+                       lambda: zoom_levels_for_boxes(lat, area)),
+        "footprint": (lambda: [get_buffer_footprint_pixels(*p) for p in zip(s_lat.tolist(), s_lon.tolist(), s_area.tolist(), s_zoom.tolist())],
+                      lambda: buffer_footprints_pixels(lat, lon, area, zoom)),
+    }
+    results = {"parity_ok": ok, "errors": errors, "mismatches": mismatches, "points_per_sec": {}}
+    print(f"\n{'function':<18}{'scalar pts/s':>16}{'vector pts/s':>16}{'speedup':>10}")
+    for name, (scalar_fn, vector_fn) in cases.items():
+        scalar_rate = rate(scalar_fn, len(s_lat), repeat=1)
+        vector_rate = rate(vector_fn, len(lat))
+        results["points_per_sec"][name] = {"scalar": round(scalar_rate), "vectorized": round(vector_rate)}
+        print(f"{name:<18}{scalar_rate:>16,.0f}{vector_rate:>16,.0f}{vector_rate / scalar_rate:>9.0f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
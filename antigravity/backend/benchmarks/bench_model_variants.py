@@ -0,0 +1,67 @@
+"""
+Latency / throughput of the model variants from model_loader.optimize_model.
+
+    python benchmarks/bench_model_variants.py --variants eager dynamic_quant torchscript --batch-size 1 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import torch
+
+from model_loader import load_model, MODEL_VARIANTS
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--variants", nargs="+", default=["eager", "dynamic_quant", "torchscript"], choices=MODEL_VARIANTS)
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    torch.manual_seed(0)
+
+    report = {"threads": torch.get_num_threads(), "results": []}
+    for variant in args.variants:
+        start = time.perf_counter()
+        model = load_model(args.model, device, variant=variant)
+        load_s = time.perf_counter() - start
+
+        for batch_size in args.batch_size:
+            images = [torch.rand(3, 640, 640) for _ in range(batch_size)]
+            with torch.no_grad():
+                for _ in range(args.warmup):
+                    model(images)
+                latencies = []
+                for _ in range(args.runs):
+                    t0 = time.perf_counter()
+                    model(images)
+                    latencies.append(time.perf_counter() - t0)
+
+            row = {
+                "variant": variant,
+                "batch_size": batch_size,
+                "load_s": round(load_s, 2),
+                "median_batch_s": round(statistics.median(latencies), 4),
+                "images_per_sec": round(batch_size / statistics.median(latencies), 2),
+            }
+            print(row)
+            report["results"].append(row)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Cold-start time of the API: spawns a fresh uvicorn process per run and measures
+- listen_s:  until the server answers HTTP at all (/health, 503 while loading);
+- ready_s:   until /health returns 200 (model loaded and warmed up);
+- first_infer_ms: latency of the first /infer after ready;
+plus the load / warm-up split the app reports under /health "startup" and the
+server's peak RSS (Linux).
+
+    python benchmarks/bench_startup.py --runs 3
+    python benchmarks/bench_startup.py --runs 3 --env MODEL_VARIANT=torchscript --env WARMUP_RUNS=0
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import statistics
+import subprocess
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:  # not Linux
+        return None
+
+def measure(env, timeout):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    run = {"listen_s": None, "ready_s": None}
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server exited with status {proc.returncode}")
+            try:
+                response = requests.get(f"{base_url}/health", timeout=5)
+            except requests.ConnectionError:
+                time.sleep(0.02)
+                continue
+            elapsed = time.perf_counter() - start
+            if run["listen_s"] is None:
+                run["listen_s"] = round(elapsed, 3)
+            if response.status_code == 200:
+                run["ready_s"] = round(elapsed, 3)
+                run["startup"] = response.json()["startup"]
+                break
+            if response.json().get("status") == "error":
+                raise RuntimeError(f"Model failed to load: {response.json()['startup']['error']}")
+            time.sleep(0.02)
+        else:
+            raise RuntimeError(f"Not ready after {timeout}s")
+
+        t0 = time.perf_counter()
+        response = requests.get(f"{base_url}/infer", params={"lat": 34.161187, "lon": -118.4684985}, timeout=timeout)
+        run["first_infer_ms"] = round(1000 * (time.perf_counter() - t0), 1) if response.status_code == 200 else None
+        run["peak_rss_mb"] = peak_rss_mb(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE set for the server process (repeatable)")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update(item.split("=", 1) for item in args.env)
+    # Without an API key the tile fetch is the mock generator, so no network is needed
+    env.setdefault("SOLAR_API_KEY", "")
+
+    runs = []
+    for i in range(args.runs):
+        run = measure(env, args.timeout)
+        print(f"Run {i + 1}: {json.dumps(run)}")
+        runs.append(run)
+
+    report = {"env": args.env, "runs": runs}
+    for field in ("listen_s", "ready_s", "first_infer_ms", "peak_rss_mb"):
+        values = [r[field] for r in runs if r.get(field) is not None]
+        if values:
+            report[f"median_{field}"] = round(statistics.median(values), 3)
+    print(json.dumps({k: v for k, v in report.items() if k != "runs"}, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
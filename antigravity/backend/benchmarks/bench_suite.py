@@ -0,0 +1,423 @@
+"""
+End-to-end benchmark suite for the inference paths:
+
+    run_inference   direct calls to inference.run_inference
+    infer           GET /infer against a local uvicorn server, at each --concurrency
+    batch_infer     POST /batch_infer, for every --batch-sizes x --concurrency
+    offline         training/generate_predictions.py over a folder of images
+
+Tiles come from a local stand-in for Google Static Maps (tile_server.py, optionally
+serving recorded tiles from --tiles-dir with --fetch-latency) or from the built-in
+mock generator (--tiles mock). Every scenario runs in its own process so peak RSS is
+per scenario. Reports p50/p95/p99 latency, throughput and peak RSS as JSON:
+
+    python benchmarks/bench_suite.py --requests 40 --concurrency 1 4 --batch-sizes 8 32 \\
+        --output bench-results/$(git rev-parse --short HEAD).json
+    python benchmarks/bench_suite.py ... --compare bench-results/<baseline>.json --max-regression 10
+
+The pipeline is configured as usual through the environment (INFERENCE_ENGINE,
+MODEL_VARIANT, SCHEDULER_*, SCREEN_ENABLED, ...), which is recorded in the report.
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import socket
+import argparse
+import platform
+import datetime
+import tempfile
+import threading
+import subprocess
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+REPO_DIR = os.path.join(BACKEND_DIR, "..", "..")
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ["run_inference", "infer", "batch_infer", "offline"]
+# Environment knobs that change what is being measured
+CONFIG_ENV_PREFIXES = ("INFERENCE_", "MODEL_", "SCHEDULER_", "SCREEN_", "SINGLE_FETCH_BUFFERS", "ARTIFACT_",
+                       "POSTPROCESS_", "ORT_", "FETCH_", "TILE_CACHE_", "OMP_NUM_THREADS")
+
+# Measurement helpers
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile (q in 0-100).
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def peak_rss_mb(who=None):
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def summarize(latencies, wall_s, items, errors):
+    ok = len(latencies)
+    summary = {
+        "requests": ok + errors,
+        "errors": errors,
+        "wall_s": round(wall_s, 3),
+        "throughput_per_s": round(items / wall_s, 3) if wall_s > 0 else 0.0,
+    }
+    if latencies:
+        summary.update({
+            "mean_ms": round(1000 * statistics.mean(latencies), 2),
+            "p50_ms": round(1000 * percentile(latencies, 50), 2),
+            "p95_ms": round(1000 * percentile(latencies, 95), 2),
+            "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        })
+    return summary
+
+def run_concurrently(fn, work, concurrency):
+    """
+    Calls fn(item) for every item from `concurrency` threads.
+    fn returns True on success. Returns (latencies of successful calls, errors, wall seconds).
+    """
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def call(item):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = fn(item)
+        except Exception as e:
+            print(f"Request failed: {e}")
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        list(pool.map(call, work))
+    return latencies, errors, time.perf_counter() - start
+
+def load_locations(path, count):
+    """
+    Coordinates from a CSV with latitude/longitude columns, cycled and nudged ~10 m
+    per repetition so every request is a distinct tile (no cache hits across requests).
+    """
+    with open(path, newline="") as f:
+        base = [(float(row["latitude"]), float(row["longitude"])) for row in csv.DictReader(f)]
+    return [(f"loc-{i}", base[i % len(base)][0] + (i // len(base)) * 1e-4, base[i % len(base)][1])
+            for i in range(count)]
+
+# Scenario setup (runs inside the scenario process)
+
+def setup_tiles(args):
+    # Benchmarks measure the cold path unless asked otherwise
+    os.environ["TILE_CACHE_ENABLED"] = "1" if args.tile_cache else "0"
+    from utils import image_fetcher
+
+    if args.tiles == "mock":
+        image_fetcher.GOOGLE_API_KEY = None
+        return None
+    from tile_server import TileServer
+    server = TileServer(port=0, tiles_dir=args.tiles_dir, latency=args.fetch_latency).start()
+    image_fetcher.GOOGLE_API_KEY = "benchmark"
+    image_fetcher.STATIC_MAPS_URL = server.url
+    return server
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api(args):
+    os.environ["MODEL_PATH"] = os.path.abspath(args.model)
+    import uvicorn
+    import app as api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=free_port(), log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    base_url = f"http://{server.config.host}:{server.config.port}"
+    wait_until_ready(base_url)
+    return server, thread, base_url
+
+def wait_until_ready(base_url, timeout=600):
+    """
+    Polls /health until the model is loaded and warmed up (200) or loading failed.
+    """
+    import requests
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.get(f"{base_url}/health", timeout=5)
+            if response.status_code == 200:
+                return
+            if response.json().get("status") == "error":
+                raise RuntimeError(f"Model failed to load: {response.json()['startup']['error']}")
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"API not ready after {timeout}s")
+
+def http_session():
+    import requests
+    local = threading.local()
+
+    def get():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+    return get
+
+# Scenarios
+
+def bench_run_inference(args, spec):
+    import torch
+    import inference
+    from engines import create_engine
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    engine = create_engine(args.model, device)
+    locations = load_locations(args.locations, args.warmup + args.requests)
+    for _, lat, lon in locations[:args.warmup]:
+        inference.run_inference(engine, lat, lon, 1200, device)
+
+    def call(location):
+        inference.run_inference(engine, location[1], location[2], 1200, device)
+        return True
+
+    latencies, errors, wall = run_concurrently(call, locations[args.warmup:], 1)
+    return summarize(latencies, wall, len(latencies), errors)
+
+def bench_infer(args, spec):
+    server, thread, base_url = start_api(args)
+    session = http_session()
+    locations = load_locations(args.locations, args.warmup + args.requests)
+
+    def call(location):
+        response = session().get(f"{base_url}/infer", params={"lat": location[1], "lon": location[2]}, timeout=600)
+        return response.status_code == 200
+
+    try:
+        for location in locations[:args.warmup]:
+            call(location)
+        latencies, errors, wall = run_concurrently(call, locations[args.warmup:], spec["concurrency"])
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+    return summarize(latencies, wall, len(latencies), errors)
+
+def bench_batch_infer(args, spec):
+    server, thread, base_url = start_api(args)
+    session = http_session()
+    batch_size = spec["batch_size"]
+    locations = load_locations(args.locations, (args.warmup + args.requests) * batch_size)
+    batches = [locations[i:i + batch_size] for i in range(0, len(locations), batch_size)]
+
+    def call(batch):
+        body = {"locations": [{"id": user_id, "lat": lat, "lon": lon} for user_id, lat, lon in batch]}
+        response = session().post(f"{base_url}/batch_infer", json=body, timeout=3600)
+        return response.status_code == 200 and not any("error" in r for r in response.json()["results"])
+
+    try:
+        for batch in batches[:args.warmup]:
+            call(batch)
+        latencies, errors, wall = run_concurrently(call, batches[args.warmup:], spec["concurrency"])
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+    summary = summarize(latencies, wall, len(latencies) * batch_size, errors)
+    summary["throughput_unit"] = "locations/s"
+    return summary
+
+def bench_offline(args, spec):
+    import torch
+    sys.path.insert(0, os.path.join(REPO_DIR, "antigravity", "training"))
+    import generate_predictions
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    model = generate_predictions.load_model(args.model, device)
+    paths = [os.path.join(args.images, f) for f in generate_predictions.list_images(args.images)]
+    if not paths:
+        raise RuntimeError(f"No images found in {args.images}")
+    paths = [paths[i % len(paths)] for i in range(args.warmup + args.requests)]
+    for path in paths[:args.warmup]:
+        generate_predictions.predict_image(model, path, device)
+
+    def call(path):
+        generate_predictions.predict_image(model, path, device)
+        return True
+
+    latencies, errors, wall = run_concurrently(call, paths[args.warmup:], 1)
+    return summarize(latencies, wall, len(latencies), errors)
+
+BENCHMARKS = {
+    "run_inference": bench_run_inference,
+    "infer": bench_infer,
+    "batch_infer": bench_batch_infer,
+    "offline": bench_offline,
+}
+
+def run_child(spec_json):
+    """
+    Scenario process: runs one spec and writes its result to spec["result_file"].
+    """
+    spec = json.loads(spec_json)
+    args = argparse.Namespace(**spec["args"])
+    tile_server = setup_tiles(args) if spec["scenario"] != "offline" else None
+    try:
+        result = BENCHMARKS[spec["scenario"]](args, spec)
+    finally:
+        if tile_server is not None:
+            tile_server.stop()
+    result["peak_rss_mb"] = peak_rss_mb()
+    try:
+        import resource
+        # Model worker processes (SCHEDULER_WORKERS > 0) are separate processes
+        result["children_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    except ImportError:
+        pass
+    with open(spec["result_file"], "w") as f:
+        json.dump(result, f)
+
+# Driver
+
+def expand_scenarios(args):
+    specs = []
+    for scenario in args.scenarios:
+        if scenario == "infer":
+            specs += [{"scenario": scenario, "concurrency": c} for c in args.concurrency]
+        elif scenario == "batch_infer":
+            specs += [{"scenario": scenario, "concurrency": c, "batch_size": b}
+                      for b in args.batch_sizes for c in args.concurrency]
+        else:
+            specs.append({"scenario": scenario, "concurrency": 1})
+    return specs
+
+def spec_key(spec):
+    return "/".join(f"{k}={spec[k]}" for k in ("scenario", "concurrency", "batch_size") if k in spec)
+
+def run_spec(args, spec):
+    with tempfile.TemporaryDirectory() as tmp:
+        child_spec = dict(spec, args=vars(args), result_file=os.path.join(tmp, "result.json"))
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", json.dumps(child_spec)],
+            cwd=BACKEND_DIR, capture_output=not args.verbose, text=True,
+        )
+        if proc.returncode != 0 or not os.path.exists(child_spec["result_file"]):
+            tail = (proc.stderr or "")[-2000:] if not args.verbose else ""
+            print(f"{spec_key(spec)} failed (exit {proc.returncode})\n{tail}")
+            return dict(spec, failed=True)
+        with open(child_spec["result_file"]) as f:
+            return dict(spec, **json.load(f))
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "") if commit else None
+    except OSError:
+        return None
+
+def compare(report, baseline_path, max_regression):
+    """
+    Prints the change against a previous report. Returns False when p95 latency or
+    throughput of any scenario regressed by more than max_regression percent.
+    """
+    with open(baseline_path) as f:
+        baseline = {spec_key(r): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    ok = True
+    for result in report["results"]:
+        old = baseline.get(spec_key(result))
+        if old is None or result.get("failed") or old.get("failed"):
+            continue
+        changes = []
+        for field, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True),
+                                       ("throughput_per_s", False), ("peak_rss_mb", True)):
+            if not old.get(field) or result.get(field) is None:
+                continue
+            delta = 100 * (result[field] - old[field]) / old[field]
+            changes.append(f"{field} {old[field]} -> {result[field]} ({delta:+.1f}%)")
+            regression = delta if higher_is_worse else -delta
+            if max_regression is not None and field in ("p95_ms", "throughput_per_s") and regression > max_regression:
+                ok = False
+        print(f"  {spec_key(result)}: " + ", ".join(changes))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--model", default=os.path.join(BACKEND_DIR, "models", "antigravity_model.pt"))
+    parser.add_argument("--requests", type=int, default=20, help="Measured requests (batches for batch_infer) per scenario")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="Client threads for the HTTP scenarios")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8], help="Locations per /batch_infer request")
+    parser.add_argument("--tiles", choices=["server", "mock"], default="server",
+                        help="Local tile server (real fetch path) or the built-in mock generator")
+    parser.add_argument("--tiles-dir", default=None, help="Recorded tiles served by the local tile server")
+    parser.add_argument("--fetch-latency", type=float, default=0.0, help="Simulated seconds per tile request")
+    parser.add_argument("--tile-cache", action="store_true", help="Leave the tile cache on (off by default)")
+    parser.add_argument("--locations", default=os.path.join(REPO_DIR, "batch_test.csv"))
+    parser.add_argument("--images", default=os.path.join(REPO_DIR, "test", "images"), help="Images for the offline scenario")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    parser.add_argument("--compare", default=None, help="Previous report to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit with status 1 if p95 or throughput regressed by more than this many percent")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the scenario processes")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+    args.model = os.path.abspath(args.model)
+    args.locations = os.path.abspath(args.locations)
+    args.images = os.path.abspath(args.images)
+    if args.tiles_dir:
+        args.tiles_dir = os.path.abspath(args.tiles_dir)
+
+    import torch
+    report = {
+        "commit": git_revision(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpu_count": os.cpu_count(),
+                 "torch": torch.__version__, "torch_threads": torch.get_num_threads()},
+        "config": {k: v for k, v in sorted(os.environ.items()) if k.startswith(CONFIG_ENV_PREFIXES)},
+        "args": {k: v for k, v in vars(args).items() if k not in ("child", "output", "compare", "verbose")},
+        "results": [],
+    }
+    for spec in expand_scenarios(args):
+        print(f"Running {spec_key(spec)}...")
+        result = run_spec(args, spec)
+        print(json.dumps(result))
+        report["results"].append(result)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare and not compare(report, args.compare, args.max_regression):
+        print(f"Regression above {args.max_regression}%")
+        sys.exit(1)
+    if any(r.get("failed") for r in report["results"]):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
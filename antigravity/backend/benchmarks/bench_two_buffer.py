@@ -0,0 +1,69 @@
+"""
+Negative-site latency: classic two-step buffer path vs. SINGLE_FETCH_BUFFERS mode.
+
+Negative sites are the expensive case for the classic path (1200 sqft pass, then a
+second fetch + forward pass at 2400 sqft). Tiles are blank rooftops served with a
+simulated fetch latency, and the confidence threshold is raised so every site is
+judged negative regardless of the weights being benchmarked.
+
+    python benchmarks/bench_two_buffer.py --runs 10 --fetch-latency 0.15
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import torch
+from PIL import Image
+
+import inference
+from model_loader import load_model
+
+def blank_tile(lat, lon, zoom=20, size="640x640"):
+    width, height = map(int, size.split("x"))
+    return Image.new("RGB", (width, height), color=(120, 110, 100)), False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--fetch-latency", type=float, default=0.15, help="Simulated seconds per tile fetch")
+    args = parser.parse_args()
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    model = load_model(args.model, device)
+
+    fetches = {"count": 0}
+    def slow_fetch(lat, lon, zoom=20, size="640x640", **kwargs):
+        fetches["count"] += 1
+        time.sleep(args.fetch_latency)
+        return blank_tile(lat, lon, zoom, size)
+
+    inference.fetch_satellite_image = slow_fetch
+    inference.CONFIDENCE_THRESHOLD = 1.0  # force the negative path
+
+    report = {}
+    for mode, single_fetch in (("two_step", False), ("single_fetch", True)):
+        inference.SINGLE_FETCH_BUFFERS = single_fetch
+        inference.run_inference(model, 34.1612, -118.4685, 1200, device)  # warm-up
+        fetches["count"] = 0
+        latencies = []
+        for i in range(args.runs):
+            start = time.perf_counter()
+            result = inference.run_inference(model, 34.1612 + i * 1e-4, -118.4685, 1200, device)
+            latencies.append(time.perf_counter() - start)
+            assert not result["solar_present"]
+        report[mode] = {
+            "mean_s": round(statistics.mean(latencies), 4),
+            "median_s": round(statistics.median(latencies), 4),
+            "fetches_per_site": fetches["count"] / args.runs,
+        }
+
+    report["speedup"] = round(report["two_step"]["mean_s"] / report["single_fetch"]["mean_s"], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
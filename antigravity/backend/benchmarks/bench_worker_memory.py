@@ -0,0 +1,110 @@
+"""
+Per-worker memory of N model-serving processes, with and without memory-mapped,
+shared weights (MODEL_MMAP). Each worker loads the model, runs one forward pass and
+reports, while all workers are alive:
+- rss_mb: resident set, counting shared pages in full in every process;
+- pss_mb: proportional set, shared pages split between the processes mapping them
+          (the sum over workers is what the node actually spends);
+- uss_mb: private pages only, i.e. what one more worker would add.
+Linux only (reads /proc/self/smaps_rollup).
+
+    python benchmarks/bench_worker_memory.py --workers 4
+    python benchmarks/bench_worker_memory.py --workers 4 --start-method fork
+"""
+import os
+import sys
+import json
+import argparse
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def memory_mb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(fields["Rss"], 1),
+        "pss_mb": round(fields["Pss"], 1),
+        "uss_mb": round(fields["Private_Clean"] + fields["Private_Dirty"], 1),
+    }
+
+def load(model_path, mmap):
+    import torch
+    import model_loader
+    model_loader.MODEL_MMAP = mmap
+    return model_loader.load_model(model_path, torch.device("cpu"), variant="eager")
+
+def worker(model_path, mmap, model, barrier, results):
+    import torch
+    from PIL import Image
+    from engines import TorchEngine
+
+    torch.set_num_threads(1)
+    if model is None:
+        model = load(model_path, mmap)
+    TorchEngine(model, torch.device("cpu")).predict([Image.new("RGB", (640, 640), (120, 110, 100))])
+    barrier.wait()  # measure once every worker holds its model
+    results.put(memory_mb())
+    barrier.wait()  # stay alive until everyone has measured, so shared pages are counted as shared
+
+def run(args, mmap):
+    ctx = mp.get_context(args.start_method)
+    # fork: the parent loads once and the workers inherit the model copy-on-write
+    model = load(args.model, mmap) if args.start_method == "fork" else None
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(args.model, mmap, model, barrier, results)) for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    workers = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return {
+        "mmap": mmap,
+        "workers": workers,
+        "mean_rss_mb": round(sum(w["rss_mb"] for w in workers) / len(workers), 1),
+        "mean_uss_mb": round(sum(w["uss_mb"] for w in workers) / len(workers), 1),
+        "total_pss_mb": round(sum(w["pss_mb"] for w in workers), 1),
+    }
+
+def run_in_fresh_process(args, mmap, queue):
+    queue.put(run(args, mmap))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--start-method", choices=["spawn", "fork"], default="spawn",
+                        help="spawn = independent processes like uvicorn --workers; fork = preloaded parent")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+    if not os.path.exists(args.model):
+        sys.exit(f"Model not found at {args.model}")
+
+    report = {"workers": args.workers, "start_method": args.start_method,
+              "checkpoint_mb": round(os.path.getsize(args.model) / 2 ** 20, 1), "results": []}
+    for mmap in (False, True):
+        # Each configuration starts from a fresh parent, so one run's heap can't inflate the other's
+        ctx = mp.get_context("spawn")
+        queue = ctx.Queue()
+        parent = ctx.Process(target=run_in_fresh_process, args=(args, mmap, queue))
+        parent.start()
+        result = queue.get()
+        parent.join()
+        print(json.dumps({k: v for k, v in result.items() if k != "workers"}))
+        report["results"].append(result)
+    before, after = report["results"]
+    report["uss_saved_per_worker_mb"] = round(before["mean_uss_mb"] - after["mean_uss_mb"], 1)
+    report["pss_saved_total_mb"] = round(before["total_pss_mb"] - after["total_pss_mb"], 1)
+    print(json.dumps({k: v for k, v in report.items() if k != "results"}, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Imagery scheduler (utils/imagery_scheduler.py) against the local Static Maps stand-in
+answering 429s (tile_server.py --rate-limit / --quota):
+
+    python benchmarks/check_imagery_scheduler.py --bulk 120 --interactive 12 --provider-qps 20
+
+- dedupe:      concurrent requests for one tile reach the provider once;
+- rate_limit:  a bulk batch plus interactive requests against a provider allowing fewer
+               requests per second than the scheduler sends: no placeholder tiles, and
+               interactive requests overtake the bulk queue;
+- budget:      bulk stops at its share of the daily budget, interactive requests use the
+               rest, then both are deferred;
+- quota:       once the provider's quota is used up, requests are deferred with its
+               Retry-After instead of answered from a mock tile.
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Every distinct tile should be a provider request
+os.environ["TILE_CACHE_ENABLED"] = "0"
+
+from tile_server import TileServer
+from utils import image_fetcher, imagery_scheduler
+from utils.imagery_scheduler import ImageryScheduler, SpendBudget, ImageryDeferred, INTERACTIVE, BULK
+
+def use_scheduler(workdir, name, qps=0.0, burst=10, daily=0.0, cost_per_1000=2.0, bulk_share=0.9,
+                  interactive_wait=5.0, bulk_wait=120.0):
+    # Fresh scheduler (and usage file) per scenario, installed as the process-wide one
+    budget = SpendBudget(os.path.join(workdir, f"{name}.db"), cost_per_1000, daily, 0.0, bulk_share)
+    scheduler = ImageryScheduler(qps, burst, budget, interactive_wait, bulk_wait)
+    imagery_scheduler._scheduler = scheduler
+    return scheduler
+
+def serve(**kwargs):
+    server = TileServer(port=0, **kwargs)
+    image_fetcher.STATIC_MAPS_URL = server.url
+    return server
+
+def fetch(lat, lon, lane):
+    """
+    (outcome, seconds): outcome is tile, mock or deferred:<reason>.
+    """
+    start = time.perf_counter()
+    try:
+        _, is_mock = image_fetcher.fetch_satellite_image(lat, lon, 20, "64x64", lane=lane)
+        outcome = "mock" if is_mock else "tile"
+    except ImageryDeferred as e:
+        outcome = f"deferred:{e.reason}"
+    return outcome, time.perf_counter() - start
+
+def percentiles(seconds):
+    ordered = sorted(seconds)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(ordered[-1] * 1000, 1)}
+
+def check_dedupe(workdir, callers=16):
+    scheduler = use_scheduler(workdir, "dedupe")
+    barrier = threading.Barrier(callers)
+
+    def call(i):
+        barrier.wait()
+        return fetch(40.0, -100.0, INTERACTIVE if i % 2 else BULK)[0]
+
+    with serve(latency=0.2) as server, ThreadPoolExecutor(callers) as pool:
+        outcomes = list(pool.map(call, range(callers)))
+    report = {"callers": callers, "provider_requests": server.request_count,
+              "deduplicated": scheduler.counters["deduplicated"]}
+    return server.request_count == 1 and outcomes.count("tile") == callers, report
+
+def check_rate_limit(workdir, bulk, interactive, provider_qps):
+    # The scheduler sends 50% more than the provider accepts, so the provider answers 429s
+    scheduler = use_scheduler(workdir, "rate_limit", qps=provider_qps * 1.5, burst=10)
+    with serve(latency=0.02, rate_limit=provider_qps, burst=5) as server, ThreadPoolExecutor(8) as pool:
+        start = time.perf_counter()
+        bulk_runs = [pool.submit(fetch, 41.0 + i * 1e-3, -100.0, BULK) for i in range(bulk)]
+        time.sleep(0.5)  # let the bulk queue build up
+        interactive_runs = []
+        for i in range(interactive):
+            interactive_runs.append(fetch(42.0 + i * 1e-3, -100.0, INTERACTIVE))
+            time.sleep(0.1)
+        bulk_runs = [run.result() for run in bulk_runs]
+        elapsed = time.perf_counter() - start
+
+    outcomes = [o for o, _ in bulk_runs + interactive_runs]
+    report = {
+        "outcomes": {o: outcomes.count(o) for o in sorted(set(outcomes))},
+        "provider_429s": server.throttled_count,
+        "tiles_per_sec": round(outcomes.count("tile") / elapsed, 2),
+        "interactive": percentiles([s for _, s in interactive_runs]),
+        "bulk": percentiles([s for _, s in bulk_runs]),
+        "scheduler": scheduler.stats()["requests"],
+    }
+    ok = ("mock" not in outcomes and outcomes.count("tile") == len(outcomes)
+          and report["interactive"]["p95_ms"] < report["bulk"]["p95_ms"])
+    return ok, report
+
+def check_budget(workdir, daily_requests=20, bulk_share=0.5):
+    # $1 per request makes the daily budget a request count
+    scheduler = use_scheduler(workdir, "budget", daily=float(daily_requests), cost_per_1000=1000.0, bulk_share=bulk_share)
+    with serve() as server:
+        bulk = [fetch(43.0 + i * 1e-3, -100.0, BULK)[0] for i in range(daily_requests)]
+        interactive = [fetch(44.0 + i * 1e-3, -100.0, INTERACTIVE)[0] for i in range(daily_requests)]
+    bulk_allowed = int(daily_requests * bulk_share)
+    expected_bulk = ["tile"] * bulk_allowed + ["deferred:daily_budget"] * (daily_requests - bulk_allowed)
+    expected_interactive = ["tile"] * (daily_requests - bulk_allowed) + ["deferred:daily_budget"] * bulk_allowed
+    usage = scheduler.budget.usage()["day"]
+    report = {"bulk_tiles": bulk.count("tile"), "interactive_tiles": interactive.count("tile"),
+              "provider_requests": server.request_count, "usage": usage}
+    ok = bulk == expected_bulk and interactive == expected_interactive and usage["requests"] == daily_requests
+    return ok, report
+
+def check_quota(workdir, quota=5, retry_after=60):
+    scheduler = use_scheduler(workdir, "quota")
+    errors = []
+    with serve(quota=quota, quota_retry_after=retry_after) as server:
+        outcomes = [fetch(45.0 + i * 1e-3, -100.0, INTERACTIVE)[0] for i in range(quota + 3)]
+        try:
+            image_fetcher.fetch_satellite_image(46.0, -100.0, 20, "64x64")
+        except ImageryDeferred as e:
+            errors.append(e.to_dict())
+    expected = ["tile"] * quota + ["deferred:rate_limited"] * 3
+    report = {"outcomes": outcomes, "provider_requests": server.request_count,
+              "deferred": errors[0] if errors else None, "usage": scheduler.budget.usage()["day"]["requests"]}
+    # One request hits the exhausted quota; the rest are deferred without reaching the provider
+    ok = (outcomes == expected and server.request_count == quota + 1
+          and bool(errors) and errors[0]["retry_after_s"] >= retry_after - 1 and report["usage"] == quota)
+    return ok, report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bulk", type=int, default=120, help="Bulk tile requests in the rate limit check")
+    parser.add_argument("--interactive", type=int, default=12, help="Interactive requests made meanwhile")
+    parser.add_argument("--provider-qps", type=float, default=20, help="Requests per second the stand-in accepts")
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    image_fetcher.GOOGLE_API_KEY = "check"
+    image_fetcher.FETCH_RETRIES = 3
+    image_fetcher.FETCH_BACKOFF = 0.05
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        checks = {
+            "dedupe": lambda: check_dedupe(workdir),
+            "rate_limit": lambda: check_rate_limit(workdir, args.bulk, args.interactive, args.provider_qps),
+            "budget": lambda: check_budget(workdir),
+            "quota": lambda: check_quota(workdir),
+        }
+        for name, check in checks.items():
+            ok, report = check()
+            results[name] = {"ok": ok, **report}
+            print(f"{name:<11} {'OK' if ok else 'FAILED'}  {json.dumps(report)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["ok"] for r in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Output equivalence of the ONNX Runtime engine against the torch model it was exported from.
+
+    python benchmarks/check_onnx_parity.py --images ../../test/images --limit 10
+
+For every image, detections above the serving confidence threshold must match:
+same count, scores within --score-atol, boxes within --box-atol pixels, and
+union-mask IoU of at least --min-mask-iou. Exits non-zero on any mismatch.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import numpy as np
+import torch
+from PIL import Image
+
+from engines import TorchEngine, OnnxEngine, ONNX_MODEL_PATH
+from inference import CONFIDENCE_THRESHOLD
+from model_loader import load_model
+from postprocess import filter_detections
+from utils.image_fetcher import generate_mock_satellite_image
+
+def compare(torch_out, onnx_out, args):
+    a = filter_detections(torch_out, CONFIDENCE_THRESHOLD)
+    b = filter_detections(onnx_out, CONFIDENCE_THRESHOLD)
+    problems = []
+    if len(a["scores"]) != len(b["scores"]):
+        return [f"detection count {len(a['scores'])} vs {len(b['scores'])}"]
+    if len(a["scores"]):
+        score_diff = np.abs(a["scores"] - b["scores"]).max()
+        box_diff = np.abs(a["boxes"] - b["boxes"]).max()
+        if score_diff > args.score_atol:
+            problems.append(f"score diff {score_diff:.5f}")
+        if box_diff > args.box_atol:
+            problems.append(f"box diff {box_diff:.2f}px")
+    union = np.logical_or(a["union_mask"], b["union_mask"]).sum()
+    iou = np.logical_and(a["union_mask"], b["union_mask"]).sum() / union if union else 1.0
+    if iou < args.min_mask_iou:
+        problems.append(f"mask IoU {iou:.4f}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--onnx", default=ONNX_MODEL_PATH)
+    parser.add_argument("--images", default=None, help="Directory of tiles (default: one mock tile)")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--score-atol", type=float, default=1e-3)
+    parser.add_argument("--box-atol", type=float, default=1.0)
+    parser.add_argument("--min-mask-iou", type=float, default=0.99)
+    args = parser.parse_args()
+
+    if args.images:
+        names = sorted(f for f in os.listdir(args.images) if f.lower().endswith((".png", ".jpg", ".jpeg")))[:args.limit]
+        images = [(n, Image.open(os.path.join(args.images, n)).convert("RGB")) for n in names]
+    else:
+        images = [("mock", generate_mock_satellite_image("640x640"))]
+
+    device = torch.device("cpu")
+    torch_engine = TorchEngine(load_model(args.model, device, variant="eager"), device)
+    onnx_engine = OnnxEngine(args.onnx)
+
+    failures = 0
+    for name, image in images:
+        problems = compare(torch_engine.predict([image])[0], onnx_engine.predict([image])[0], args)
+        print(f"{'FAIL' if problems else 'ok  '} {name} {'; '.join(problems)}")
+        failures += bool(problems)
+
+    print(f"{len(images) - failures}/{len(images)} images match")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Accuracy parity of an optimized model variant against the eager model on the
+validation set, using training/evaluation.evaluate_iou.
+
+    python benchmarks/check_variant_parity.py --variant dynamic_quant --data ../dataset_valid
+Exits non-zero when the IoU drop exceeds --tolerance.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "training"))
+import torch
+import torchvision.transforms as T
+
+from model_loader import load_model, MODEL_VARIANTS
+from dataset_preprocess import SolarDataset
+from evaluation import evaluate_iou
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "models", "antigravity_model.pt"))
+    parser.add_argument("--variant", required=True, choices=[v for v in MODEL_VARIANTS if v != "eager"])
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "..", "..", "dataset_valid"))
+    parser.add_argument("--limit", type=int, default=None, help="Only evaluate the first N images")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Allowed absolute mean IoU drop")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    dataset = SolarDataset(args.data, T.Compose([T.ToTensor()]))
+    if args.limit:
+        dataset = torch.utils.data.Subset(dataset, range(min(args.limit, len(dataset))))
+    data_loader = torch.utils.data.DataLoader(
+        dataset, batch_size=1, shuffle=False, collate_fn=lambda x: tuple(zip(*x)))
+
+    print("Evaluating eager model...")
+    eager_iou = evaluate_iou(load_model(args.model, device, variant="eager"), data_loader, device)
+    print(f"Evaluating '{args.variant}' model...")
+    variant_iou = evaluate_iou(load_model(args.model, device, variant=args.variant), data_loader, device)
+
+    drop = eager_iou - variant_iou
+    print(f"eager IoU: {eager_iou:.4f}  {args.variant} IoU: {variant_iou:.4f}  drop: {drop:.4f}")
+    if drop > args.tolerance:
+        print(f"FAILED: IoU drop {drop:.4f} exceeds tolerance {args.tolerance}")
+        sys.exit(1)
+    print("OK: variant is within tolerance.")
+
+if __name__ == "__main__":
+    main()
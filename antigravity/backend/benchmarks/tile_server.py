@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Google Static Maps API.
+
+Serves recorded tiles (any .png/.jpg in --tiles-dir, picked by hashing the request center)
+or generated mock tiles, with optional artificial latency and failure rate so the fetch
+stage can be exercised without an API key or network. --rate-limit and --quota make it
+answer 429 like a provider whose per-second rate or daily quota is used up:
+
+    python benchmarks/tile_server.py --port 8765 --latency 0.15 --fail-rate 0.1
+    python benchmarks/tile_server.py --port 8765 --rate-limit 20 --burst 5 --quota 1000
+    STATIC_MAPS_URL=http://127.0.0.1:8765/staticmap SOLAR_API_KEY=local uvicorn app:app
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils.image_fetcher import generate_mock_satellite_image
+
+class TileServer:
+    """
+    Threaded HTTP server answering GET /staticmap?center=lat,lon&zoom=..&size=WxH.
+    Can be used as a context manager from scripts: `with TileServer(port=0) as srv: srv.url`.
+    """
+    def __init__(self, host="127.0.0.1", port=8765, tiles_dir=None, latency=0.0, fail_rate=0.0,
+                 rate_limit=0.0, burst=1, quota=0, quota_retry_after=3600):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit    # requests per second answered, 0 = unlimited
+        self.burst = max(1, burst)
+        self.quota = quota              # tiles served before every request gets 429, 0 = unlimited
+        self.quota_retry_after = quota_retry_after
+        self.tiles = []
+        if tiles_dir and os.path.isdir(tiles_dir):
+            self.tiles = sorted(
+                os.path.join(tiles_dir, f) for f in os.listdir(tiles_dir)
+                if f.lower().endswith((".png", ".jpg", ".jpeg"))
+            )
+        self.request_count = 0
+        self.served_count = 0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._mock_cache = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/staticmap"
+
+    def tile_bytes(self, center: str, size: str):
+        if self.tiles:
+            digest = int(hashlib.md5(center.encode()).hexdigest(), 16)
+            path = self.tiles[digest % len(self.tiles)]
+            with open(path, "rb") as f:
+                return f.read(), "image/jpeg" if path.lower().endswith((".jpg", ".jpeg")) else "image/png"
+        if size not in self._mock_cache:
+            buf = BytesIO()
+            generate_mock_satellite_image(size).save(buf, format="PNG")
+            self._mock_cache[size] = buf.getvalue()
+        return self._mock_cache[size], "image/png"
+
+    def admit(self):
+        """
+        Seconds the client should wait before retrying (429), or 0 if the request is served.
+        """
+        with self._lock:
+            if self.quota and self.served_count >= self.quota:
+                return self.quota_retry_after
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_limit)
+                self._updated = now
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate_limit
+                self._tokens -= 1
+            self.served_count += 1
+            return 0
+
+    def handle_get(self, handler):
+        """
+        Hook for subclasses; returns (status, content_type, body) or (status, content_type, body, headers).
+        """
+        query = parse_qs(urlparse(handler.path).query)
+        retry_after = self.admit()
+        if retry_after:
+            with self._lock:
+                self.throttled_count += 1
+            return 429, "text/plain", b"Simulated quota exceeded", {"Retry-After": f"{retry_after:.2f}"}
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            return 503, "text/plain", b"Simulated upstream failure"
+        center = query.get("center", ["0,0"])[0]
+        size = query.get("size", ["640x640"])[0]
+        body, content_type = self.tile_bytes(center, size)
+        return 200, content_type, body
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                status, content_type, body, *headers = server.handle_get(self)
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Static Maps stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tiles-dir", default=None, help="Directory of recorded tiles to serve")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second served; the rest get 429")
+    parser.add_argument("--burst", type=int, default=1, help="Requests served back to back under --rate-limit")
+    parser.add_argument("--quota", type=int, default=0, help="Tiles served before every request gets 429")
+    parser.add_argument("--quota-retry-after", type=float, default=3600, help="Retry-After sent once the quota is used up")
+    args = parser.parse_args()
+
+    server = TileServer(args.host, args.port, args.tiles_dir, args.latency, args.fail_rate,
+                        args.rate_limit, args.burst, args.quota, args.quota_retry_after)
+    print(f"Serving tiles on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""
+Streaming bulk scorer for large coordinate files:
+
+    python bulk_score.py ../../batch_test.csv --output results.ndjson
+    python bulk_score.py claims.parquet --output results.parquet --batch-size 16
+
+Input is a CSV or Parquet file with latitude/longitude columns (lat/lon also work)
+and an optional id column; rows without an id are numbered. Rows stream through
+    fetch (fetch pool) -> batched predict -> post-process + write
+connected by bounded queues, with at most --max-in-flight rows anywhere in the pipeline,
+so memory stays flat whatever the input size. Results are appended as they finish
+(NDJSON lines, or Parquet part files in an --output directory) and progress is
+checkpointed next to the output; rerunning the same command after a crash or kill
+resumes where it stopped without duplicating rows (--restart starts over).
+Tiles are requested in the imagery scheduler's bulk lane (utils/imagery_scheduler.py);
+rows it defers (rate limit or budget used up) wait and are fetched again, never scored
+on a placeholder tile.
+"""
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+
+import torch
+
+import inference
+import metrics
+from inference import fetch_for_buffer, predict_batch, build_result, build_two_buffer_result
+from batch_inference import BATCH_SIZE, _error_result
+from engines import create_engine
+from utils.tile_prefetcher import FETCH_PREFETCH, get_fetch_pool
+from utils.imagery_scheduler import BULK, ImageryDeferred
+
+# Configuration
+BULK_QUEUE_SIZE = int(os.getenv("BULK_QUEUE_SIZE", "4"))              # batches waiting between stages
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "256"))       # rows admitted but not yet written
+BULK_CHECKPOINT_EVERY = int(os.getenv("BULK_CHECKPOINT_EVERY", "500"))  # rows between checkpoints
+BULK_CHECKPOINT_SECONDS = float(os.getenv("BULK_CHECKPOINT_SECONDS", "30"))
+
+LAT_COLUMNS = ("latitude", "lat")
+LON_COLUMNS = ("longitude", "lon")
+
+# Parquet output has a fixed schema so that every part file lines up
+PARQUET_COLUMNS = [
+    ("row", "int64"), ("user_id", "string"), ("latitude", "float64"), ("longitude", "float64"),
+    ("solar_present", "bool"), ("solar_area_m2", "float64"), ("confidence", "float64"),
+    ("qc_status", "string"), ("is_mock_data", "bool"), ("buffer_size_sqft", "int64"),
+    ("model_version", "string"), ("timestamp", "string"), ("sample_id", "string"),
+    ("overlay_path", "string"), ("detections", "string"), ("error", "string"),
+]
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet input/output requires the pyarrow package") from e
+    return pyarrow
+
+# Input
+
+def _pick_column(columns, candidates, path):
+    for name in candidates:
+        if name in columns:
+            return name
+    raise ValueError(f"{path} has no {' / '.join(candidates)} column (columns: {', '.join(columns)})")
+
+def _parse_coordinates(lat, lon):
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid coordinates: latitude={lat!r}, longitude={lon!r}")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Coordinates out of range: latitude={lat}, longitude={lon}")
+    return lat, lon
+
+def _parsed_row(row, user_id, lat, lon):
+    try:
+        return (row, str(user_id), *_parse_coordinates(lat, lon), None)
+    except ValueError as e:
+        return row, str(user_id), None, None, e
+
+def read_locations(path: str, id_column: str = "id", skip_before: int = 0):
+    """
+    Yields (row, user_id, lat, lon, error) one row at a time, starting at row skip_before.
+    error is a ValueError (and lat, lon None) for a row with blank or invalid coordinates,
+    so one bad row fails on its own instead of stopping the run.
+    """
+    if path.lower().endswith(".parquet"):
+        pa = _import_pyarrow()
+        parquet = pa.parquet.ParquetFile(path)
+        columns = parquet.schema_arrow.names
+        lat_col, lon_col = _pick_column(columns, LAT_COLUMNS, path), _pick_column(columns, LON_COLUMNS, path)
+        wanted = [lat_col, lon_col] + ([id_column] if id_column in columns else [])
+        row = 0
+        for batch in parquet.iter_batches(batch_size=4096, columns=wanted):
+            if row + batch.num_rows <= skip_before:
+                row += batch.num_rows
+                continue
+            data = batch.to_pydict()
+            for i in range(batch.num_rows):
+                if row >= skip_before:
+                    user_id = data[id_column][i] if id_column in data else row
+                    yield _parsed_row(row, user_id, data[lat_col][i], data[lon_col][i])
+                row += 1
+        return
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        lat_col = _pick_column(reader.fieldnames, LAT_COLUMNS, path)
+        lon_col = _pick_column(reader.fieldnames, LON_COLUMNS, path)
+        for row, record in enumerate(reader):
+            if row < skip_before:
+                continue
+            user_id = record[id_column] if record.get(id_column) else row
+            yield _parsed_row(row, user_id, record[lat_col], record[lon_col])
+
+# Output
+
+class NdjsonWriter:
+    """
+    One JSON result per line. The checkpointed state is the file size at the last
+    checkpoint; resuming truncates anything written after it. A missing or shorter
+    file can't be resumed (truncating would pad it with NUL bytes).
+    """
+    def __init__(self, path: str, state=None):
+        if state is not None:
+            size = os.path.getsize(path) if os.path.exists(path) else None
+            if size is None or size < state:
+                found = "is missing" if size is None else f"has {size} bytes"
+                raise ValueError(f"{path} {found}, but the checkpoint expects {state}; use --restart to start over")
+            self.file = open(path, "r+b")
+            self.file.truncate(state)
+            self.file.seek(state)
+        else:
+            self.file = open(path, "wb")
+
+    def write(self, record: dict):
+        self.file.write((json.dumps(record) + "\n").encode())
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """
+    A directory of part-NNNNN.parquet files, one per checkpoint. Parts past the
+    checkpointed count are incomplete runs and are deleted on resume.
+    """
+    def __init__(self, path: str, state=None):
+        self.pa = _import_pyarrow()
+        self.schema = self.pa.schema([(name, getattr(self.pa, kind)()) for name, kind in PARQUET_COLUMNS])
+        self.path = path
+        self.parts = state or 0
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith("part-") and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self.rows = []
+
+    def write(self, record: dict):
+        row = {name: record.get(name) for name, _ in PARQUET_COLUMNS}
+        row["overlay_path"] = (record.get("artifact_paths") or {}).get("overlay")
+        # Nested per-detection masks/geometry as a JSON string column
+        row["detections"] = json.dumps(record["detections"]) if "detections" in record else None
+        self.rows.append(row)
+
+    def commit(self):
+        if self.rows:
+            table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+            self.pa.parquet.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+            self.parts += 1
+            self.rows = []
+        return self.parts
+
+    def close(self):
+        pass
+
+# Checkpoint
+
+class Checkpoint:
+    """
+    Progress that survives a kill: every row before `mark` is written, plus the rows in
+    `done` (finished out of order, at most --max-in-flight of them), and the writer
+    state matching exactly those rows.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.mark = 0
+        self.done = set()
+        self.writer_state = None
+        self.counts = {"completed": 0, "failed": 0}
+
+    def load(self, input_path: str):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        if data["input"] != os.path.abspath(input_path):
+            raise ValueError(f"{self.path} belongs to {data['input']}; use --restart to start over")
+        self.mark, self.done = data["mark"], set(data["done"])
+        self.writer_state, self.counts = data["writer_state"], data["counts"]
+        return True
+
+    def finish_row(self, row: int):
+        if row == self.mark:
+            self.mark += 1
+            while self.mark in self.done:
+                self.done.remove(self.mark)
+                self.mark += 1
+        else:
+            self.done.add(row)
+
+    def save(self, input_path: str, writer_state):
+        self.writer_state = writer_state
+        data = {"input": os.path.abspath(input_path), "mark": self.mark, "done": sorted(self.done),
+                "writer_state": writer_state, "counts": self.counts, "updated_at": time.time()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+# Pipeline
+
+class BulkScorer:
+    """
+    Three stages on their own threads:
+    - feeder:    admits input rows (and 2400 sqft retries, first) onto the fetch pool;
+    - predictor: groups fetched tiles into batches for predict_batch;
+    - writer:    builds results, sends 1200 sqft negatives back for the 2400 sqft pass,
+                 writes everything else and checkpoints; rows deferred by the imagery
+                 quota go back to the feeder once their retry_after has passed.
+    """
+    def __init__(self, model, device, input_path: str, writer, checkpoint: Checkpoint, id_column: str = "id",
+                 buffer_sqft: int = 1200, batch_size: int = BATCH_SIZE, queue_size: int = BULK_QUEUE_SIZE,
+                 max_in_flight: int = BULK_MAX_IN_FLIGHT, save_artifacts: bool = False):
+        self.model = model
+        self.device = device
+        self.input_path = input_path
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.id_column = id_column
+        self.batch_size = max(1, batch_size)
+        self.save_artifacts = save_artifacts
+
+        self.first_buffer = buffer_sqft
+        self.retry_buffer = 2400 if buffer_sqft == 1200 else None
+        self.two_buffers = inference.SINGLE_FETCH_BUFFERS and buffer_sqft == 1200
+        if self.two_buffers:
+            # One zoom-19 tile per location covers both buffers, so there is no retry pass
+            self.first_buffer, self.retry_buffer = 2400, None
+
+        self.admission = threading.Semaphore(max(1, max_in_flight))
+        self.fetch_slots = threading.Semaphore(max(1, FETCH_PREFETCH))
+        self.retries = queue.Queue()
+        self.fetched = queue.Queue(maxsize=max(1, queue_size) * self.batch_size)
+        self.predicted = queue.Queue(maxsize=max(1, queue_size))
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.input_done = False
+        self.pending_since_checkpoint = 0
+        self.last_checkpoint = time.perf_counter()
+
+    def run(self):
+        start = time.perf_counter()
+        completed_before = self.checkpoint.counts["completed"]
+        threads = [threading.Thread(target=self._guard(fn), name=f"bulk-{fn.__name__.strip('_')}", daemon=True)
+                   for fn in (self._feed, self._predict, self._write)]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("Interrupted, stopping (progress up to the last checkpoint is kept)...")
+            self.stop_event.set()
+            raise
+        if self.errors:
+            raise self.errors[0]
+
+        elapsed = time.perf_counter() - start
+        done = self.checkpoint.counts["completed"] - completed_before
+        print(f"Scored {done} locations in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.2f}/s), "
+              f"{self.checkpoint.counts['failed']} failed")
+        return self.checkpoint.counts
+
+    def _guard(self, fn):
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                print(f"Bulk scoring stage {fn.__name__} failed: {e}")
+                self.errors.append(e)
+                self.stop_event.set()
+        return run
+
+    def _put(self, q, item):
+        # Bounded put that gives up when another stage failed
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Stage 1: admission + fetch
+
+    def _feed(self):
+        rows = read_locations(self.input_path, self.id_column, skip_before=self.checkpoint.mark)
+        pool = get_fetch_pool()
+        while not self.stop_event.is_set():
+            # Retries are already admitted, so they go first and never wait for a slot
+            try:
+                item = self.retries.get_nowait()
+            except queue.Empty:
+                item = None
+            if item is None and not self.input_done:
+                if not self.admission.acquire(timeout=0.05):
+                    continue
+                item, error = self._next_row(rows)
+                if item is None:
+                    self.admission.release()
+                    self.input_done = True
+                    continue
+                with self.in_flight_lock:
+                    self.in_flight += 1
+                if error is not None:
+                    # Nothing to fetch: the writer records the row as failed
+                    self._put(self.fetched, (item, None, error))
+                    continue
+            if item is None:
+                with self.in_flight_lock:
+                    if self.in_flight == 0:
+                        break
+                try:
+                    item = self.retries.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+            while not self.fetch_slots.acquire(timeout=0.5):
+                if self.stop_event.is_set():
+                    return
+            pool.submit(self._fetch, item)
+        self._put(self.fetched, None)
+
+    def _next_row(self, rows):
+        for row, user_id, lat, lon, error in rows:
+            if row in self.checkpoint.done:
+                continue
+            return (row, user_id, lat, lon, self.first_buffer), error
+        return None, None
+
+    def _fetch(self, item):
+        try:
+            row, user_id, lat, lon, buffer_sqft = item
+            try:
+                tile, error = fetch_for_buffer(lat, lon, buffer_sqft, BULK), None
+            except Exception as e:
+                tile, error = None, e
+            self._put(self.fetched, (item, tile, error))
+        finally:
+            self.fetch_slots.release()
+
+    # Stage 2: batched predict
+
+    def _predict(self):
+        finished = False
+        while not finished and not self.stop_event.is_set():
+            batch = []
+            try:
+                entry = self.fetched.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            while entry is not None:
+                batch.append(entry)
+                if len(batch) == self.batch_size:
+                    break
+                try:
+                    # Don't hold a partial batch back while the feeder is waiting on slow fetches
+                    entry = self.fetched.get(timeout=0.05)
+                except queue.Empty:
+                    break
+            finished = entry is None
+
+            ok = [(item, tile) for item, tile, error in batch if error is None]
+            failed = [(item, error) for item, tile, error in batch if error is not None]
+            predictions, batch_error = [], None
+            if ok:
+                try:
+                    predictions = predict_batch(self.model, [image for _, (image, _, _) in ok], self.device)
+                except Exception as e:
+                    print(f"Batch prediction failed: {e}")
+                    batch_error = e
+            if batch_error is not None:
+                failed += [(item, batch_error) for item, _ in ok]
+                ok, predictions = [], []
+            self._put(self.predicted, (list(zip(ok, predictions)), failed))
+        self._put(self.predicted, None)
+
+    # Stage 3: post-process, retry, write, checkpoint
+
+    def _write(self):
+        while not self.stop_event.is_set():
+            try:
+                entry = self.predicted.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if entry is None:
+                break
+            scored, failed = entry
+            for (item, (image_pil, is_mock, zoom_level)), prediction in scored:
+                row, user_id, lat, lon, buffer_sqft = item
+                try:
+                    if self.two_buffers:
+                        result = build_two_buffer_result(prediction, image_pil, is_mock, lat, lon, zoom_level,
+                                                         save_artifacts=self.save_artifacts)
+                    else:
+                        result = build_result(prediction, image_pil, is_mock, lat, lon, buffer_sqft, zoom_level,
+                                              save_artifacts=self.save_artifacts)
+                except Exception as e:
+                    print(f"Error processing {user_id}: {e}")
+                    self._finish(item, _error_result(user_id, e))
+                    continue
+                if not result["solar_present"] and buffer_sqft == 1200 and self.retry_buffer:
+                    # Two-step buffer logic: expand to 2400 sqft if nothing was found at 1200 sqft
+                    metrics.BUFFER_FALLBACKS.inc()
+                    self.retries.put((row, user_id, lat, lon, self.retry_buffer))
+                    continue
+                result["user_id"] = user_id
+                self._finish(item, result)
+            for item, error in failed:
+                if isinstance(error, ImageryDeferred):
+                    self._retry_later(item, error.retry_after)
+                    continue
+                print(f"Error processing {item[1]}: {error}")
+                self._finish(item, _error_result(item[1], error))
+            self._maybe_checkpoint()
+        if not self.stop_event.is_set():
+            self._save_checkpoint()
+
+    def _retry_later(self, item, delay):
+        # The row stays admitted (and unfinished in the checkpoint) until it is fetched again
+        print(f"Row {item[0]} deferred by the imagery quota, retrying in {delay}s")
+        timer = threading.Timer(delay, self.retries.put, args=(item,))
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self, item, result):
+        row = item[0]
+        result["row"] = row
+        self.writer.write(result)
+        self.checkpoint.finish_row(row)
+        self.checkpoint.counts["completed"] += 1
+        if "error" in result:
+            self.checkpoint.counts["failed"] += 1
+        self.pending_since_checkpoint += 1
+        with self.in_flight_lock:
+            self.in_flight -= 1
+        self.admission.release()
+
+    def _maybe_checkpoint(self):
+        if (self.pending_since_checkpoint >= BULK_CHECKPOINT_EVERY
+                or time.perf_counter() - self.last_checkpoint >= BULK_CHECKPOINT_SECONDS):
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        if self.pending_since_checkpoint == 0 and self.checkpoint.writer_state is not None:
+            return
+        self.checkpoint.save(self.input_path, self.writer.commit())
+        self.pending_since_checkpoint = 0
+        self.last_checkpoint = time.perf_counter()
+        print(f"Checkpoint: {self.checkpoint.counts['completed']} rows done "
+              f"({self.checkpoint.counts['failed']} failed), all rows before {self.checkpoint.mark} complete")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or Parquet file with latitude/longitude columns")
+    parser.add_argument("--output", required=True, help="NDJSON file, or a directory for Parquet parts")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default=None,
+                        help="Output format (default: from the --output extension)")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--buffer-sqft", type=int, default=1200)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=BULK_QUEUE_SIZE, help="Batches buffered between stages")
+    parser.add_argument("--max-in-flight", type=int, default=BULK_MAX_IN_FLIGHT)
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), "models", "antigravity_model.pt")))
+    parser.add_argument("--artifacts", action="store_true", help="Also render and save overlay images")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if args.output.lower().endswith(".parquet") else "ndjson")
+    checkpoint = Checkpoint(f"{args.output.rstrip(os.sep)}.checkpoint.json")
+    if not args.restart and checkpoint.load(args.input):
+        print(f"Resuming: {checkpoint.counts['completed']} rows already done")
+    else:
+        checkpoint = Checkpoint(checkpoint.path)
+    writer = (ParquetWriter if fmt == "parquet" else NdjsonWriter)(args.output, checkpoint.writer_state)
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    model = create_engine(args.model, device)
+    scorer = BulkScorer(model, device, args.input, writer, checkpoint, id_column=args.id_column,
+                        buffer_sqft=args.buffer_sqft, batch_size=args.batch_size, queue_size=args.queue_size,
+                        max_in_flight=args.max_in_flight, save_artifacts=args.artifacts)
+    try:
+        scorer.run()
+    finally:
+        writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import copy
+import time
+import numpy as np
+import torch
+
+import metrics
+
+# Configuration
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "torch")  # torch | onnx
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(MODELS_DIR, "antigravity_model.onnx"))
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))  # 0 = let ORT decide
+# Forward passes run on a blank tile before the engine is reported ready (first calls pay for allocator/kernel setup)
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "1"))
+
+def image_to_array(image) -> np.ndarray:
+    """
+    PIL RGB image -> float32 CHW array in [0, 1] (same as torchvision's ToTensor),
+    without importing torchvision.
+    """
+    return np.ascontiguousarray(np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0)
+
+class TorchEngine:
+    """
+    Eager (or optimized, see model_loader.optimize_model) PyTorch Mask R-CNN.
+    The whole list of images goes through one model() call.
+    """
+    name = "torch"
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def predict(self, images):
+        with metrics.timed("preprocess"):
+            tensors = [torch.from_numpy(image_to_array(img)).to(self.device) for img in images]
+        with metrics.timed("forward"), torch.no_grad():
+            return self.model(tensors)
+
+    def screen(self, images, size: int):
+        """
+        Cheap presence check: the same detector run at size x size instead of the full
+        resolution, boxes and scores only. Returns the max detection score per image, or
+        None when the model variant doesn't expose its transform (TorchScript).
+        """
+        screen_model = self._screen_model(size)
+        if screen_model is None:
+            return None
+        with metrics.timed("screen"), torch.no_grad():
+            tensors = [torch.from_numpy(image_to_array(img)).to(self.device) for img in images]
+            outputs = screen_model(tensors)
+        return [float(o["scores"].max()) if len(o["scores"]) else 0.0 for o in outputs]
+
+    def _screen_model(self, size: int):
+        cached = getattr(self, "_screen", None)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        if not hasattr(self.model, "transform"):
+            return None
+        from torchvision.models.detection.transform import GeneralizedRCNNTransform
+
+        # Shallow copies sharing every submodule (and weights) except the resize transform
+        # and the mask head: only the scores are needed, so no masks are predicted
+        screen_model = copy.copy(self.model)
+        screen_model._modules = dict(self.model._modules)
+        t = self.model.transform
+        screen_model.transform = GeneralizedRCNNTransform(size, size, t.image_mean, t.image_std)
+        roi_heads = copy.copy(self.model.roi_heads)
+        roi_heads._modules = dict(self.model.roi_heads._modules)
+        roi_heads.mask_roi_pool = None
+        screen_model.roi_heads = roi_heads
+        self._screen = (size, screen_model)
+        return screen_model
+
+class OnnxEngine:
+    """
+    ONNX Runtime (CPU execution provider) engine for a model exported with export_onnx.py.
+    Outputs have the same keys as the torch model, as NumPy arrays.
+    The exported graph takes one image, so batches run image by image inside one session.
+    """
+    name = "onnx"
+
+    def __init__(self, model_path: str = ONNX_MODEL_PATH, intra_op_threads: int = ORT_INTRA_OP_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("INFERENCE_ENGINE=onnx requires the onnxruntime package") from e
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"ONNX model not found at {model_path}. Run export_onnx.py first.")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        print(f"Loaded ONNX model from {model_path}")
+
+    def screen(self, images, size: int):
+        # The exported graph has its resize size baked in, so there is no cheap pass
+        return None
+
+    def predict(self, images):
+        with metrics.timed("preprocess"):
+            arrays = [image_to_array(img) for img in images]
+        outputs = []
+        with metrics.timed("forward"):
+            for array in arrays:
+                values = self.session.run(self.output_names, {self.input_name: array})
+                outputs.append(dict(zip(self.output_names, values)))
+        return outputs
+
+def create_engine(model_path: str, device, engine: str = None):
+    """
+    Builds the configured inference engine (INFERENCE_ENGINE by default).
+    torchvision is only imported for the torch engine.
+    """
+    engine = engine or INFERENCE_ENGINE
+    if engine == "onnx":
+        return OnnxEngine()
+    if engine == "torch":
+        from model_loader import load_model
+        return TorchEngine(load_model(model_path, device), device)
+    raise ValueError(f"Unknown INFERENCE_ENGINE '{engine}', expected 'torch' or 'onnx'")
+
+def warm_up(engine, runs: int = WARMUP_RUNS):
+    """
+    Runs the engine on a blank 640x640 tile so the first real request doesn't pay
+    for lazy initialisation. Returns the seconds spent.
+    """
+    from PIL import Image
+
+    start = time.perf_counter()
+    tile = Image.new("RGB", (640, 640), color=(120, 110, 100))
+    for _ in range(runs):
+        engine.predict([tile])
+    return time.perf_counter() - start
+
+def as_engine(model, device):
+    """
+    Accepts an engine or a bare torch model (scripts and older callers pass the model).
+    """
+    if hasattr(model, "predict"):
+        return model
+    return TorchEngine(model, device)
@@ -0,0 +1,60 @@
+"""
+Exports the trained Mask R-CNN to ONNX for the onnxruntime engine (INFERENCE_ENGINE=onnx).
+
+    python export_onnx.py --model models/antigravity_model.pt --output models/antigravity_model.onnx
+
+The exported graph takes one float32 CHW image in [0, 1] of any size and returns
+boxes, labels, scores and masks, with the same score/NMS thresholds as load_model.
+Check equivalence with benchmarks/check_onnx_parity.py.
+"""
+import os
+import inspect
+import argparse
+
+import torch
+
+from model_loader import load_model
+
+OUTPUT_NAMES = ["boxes", "labels", "scores", "masks"]
+
+def export(model_path: str, output_path: str, opset: int = 11, image_size: int = 640):
+    device = torch.device("cpu")
+    model = load_model(model_path, device, variant="eager")
+
+    dummy = torch.rand(3, image_size, image_size)
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch defaults to the dynamo exporter; the TorchScript one handles torchvision detection models
+        kwargs["dynamo"] = False
+
+    print(f"Exporting to {output_path} (opset {opset})...")
+    torch.onnx.export(
+        model,
+        ([dummy],),
+        output_path,
+        opset_version=opset,
+        do_constant_folding=True,
+        input_names=["image"],
+        output_names=OUTPUT_NAMES,
+        dynamic_axes={
+            "image": {1: "height", 2: "width"},
+            "boxes": {0: "detections"},
+            "labels": {0: "detections"},
+            "scores": {0: "detections"},
+            "masks": {0: "detections", 2: "height", 3: "width"},
+        },
+        **kwargs,
+    )
+    print(f"Saved ONNX model ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+
+def main():
+    here = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(here, "models", "antigravity_model.pt"))
+    parser.add_argument("--output", default=os.path.join(here, "models", "antigravity_model.onnx"))
+    parser.add_argument("--opset", type=int, default=11)
+    args = parser.parse_args()
+    export(args.model, args.output, args.opset)
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,48 @@
 import os
+import time
 import uuid
 import datetime
-import torch
+import threading
 import numpy as np
-import cv2
-from PIL import Image
-from torchvision import transforms as T
-from utils.image_fetcher import fetch_satellite_image
-from utils.geo_utils import get_meters_per_pixel, get_zoom_level_for_box
+import metrics
+from utils.image_fetcher import fetch_satellite_image, tile_center
+from utils.imagery_scheduler import INTERACTIVE
+from artifact_writer import get_artifact_writer
+from postprocess import filter_detections, render_overlay
+from mask_encoding import MASK_ENCODING, describe_detections
+from engines import as_engine
+from utils.geo_utils import get_zoom_level_for_box, get_buffer_footprint_pixels, mask_area_m2
 
 # Configuration
 CONFIDENCE_THRESHOLD = 0.40
-ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), "artifacts")
+# Fetch one zoom-19 tile and judge both the 1200 and 2400 sqft buffers from a single forward pass
+SINGLE_FETCH_BUFFERS = os.getenv("SINGLE_FETCH_BUFFERS", "0") == "1"
+# Two-stage pipeline: a low-resolution pass screens out clear negatives before full segmentation.
+# Runs on the torch engine directly or through the in-process scheduler (SCHEDULER_WORKERS=0,
+# the default); not with SCHEDULER_WORKERS > 0, the ONNX engine or TorchScript
+SCREEN_ENABLED = os.getenv("SCREEN_ENABLED", "0") == "1"
+SCREEN_SIZE = int(os.getenv("SCREEN_SIZE", "320"))
+SCREEN_NEGATIVE_THRESHOLD = float(os.getenv("SCREEN_NEGATIVE_THRESHOLD", "0.15"))
 
-def get_transform():
-    return T.Compose([T.ToTensor()])
+# How many tiles each stage handled (reported on /health)
+STAGE_COUNTS = {"screened": 0, "screened_out": 0, "full_segmentation": 0, "screen_unavailable": 0}
+_stage_lock = threading.Lock()
 
 def run_inference(model, lat: float, lon: float, buffer_sqft: int, device):
     """
     Main pipeline: Fetch -> Predict -> Quantify -> visualize
     Two-step buffer logic: Try 1200 sqft first, expand to 2400 if no detection
     """
+    if SINGLE_FETCH_BUFFERS and buffer_sqft == 1200:
+        return _run_inference_two_buffers(model, lat, lon, device)
+
     # Try initial buffer
     result = _run_inference_single_buffer(model, lat, lon, buffer_sqft, device)
     
     # If no solar found and we're at 1200 sqft, try 2400 sqft
     if not result["solar_present"] and buffer_sqft == 1200:
         print(f"No solar found in 1200 sqft buffer, expanding to 2400 sqft...")
+        metrics.BUFFER_FALLBACKS.inc()
         result = _run_inference_single_buffer(model, lat, lon, 2400, device)
     
     return result
@@ -35,91 +51,180 @@ def _run_inference_single_buffer(model, lat: float, lon: float, buffer_sqft: int
     """
     Run inference for a single buffer size
     """
-    # 1. Fetch Image
+    with metrics.timed("total"):
+        # 1. Fetch Image
+        image_pil, is_mock, zoom_level = fetch_for_buffer(lat, lon, buffer_sqft)
+        
+        # 2-3. Preprocess + Predict
+        print(f"Running prediction...")
+        prediction = predict_batch(model, [image_pil], device)[0]
+        
+        # 4-7. Filter, quantify, save artifacts
+        return build_result(prediction, image_pil, is_mock, lat, lon, buffer_sqft, zoom_level)
+
+def _run_inference_two_buffers(model, lat: float, lon: float, device):
+    """
+    Single-fetch variant of the two-step buffer logic: one tile wide enough for the
+    2400 sqft buffer, one forward pass, and both verdicts from geometric filtering.
+    """
+    with metrics.timed("total"):
+        image_pil, is_mock, zoom_level = fetch_for_buffer(lat, lon, 2400)
+        print(f"Running prediction...")
+        prediction = predict_batch(model, [image_pil], device)[0]
+        return build_two_buffer_result(prediction, image_pil, is_mock, lat, lon, zoom_level)
+
+def build_two_buffer_result(prediction, image_pil, is_mock, lat: float, lon: float, zoom_level: int,
+                            save_artifacts: bool = True, center=None):
+    """
+    Keeps only detections whose mask reaches into the 1200 sqft footprint; if there are
+    none, falls back to the 2400 sqft footprint. Same result shape as build_result.
+    center: (lat, lon) of the tile when it is shared with other locations (see batch_planner.py).
+    """
+    image_size = image_pil.size[0]
+    # Footprints in the tile as fetched, i.e. around the snapped center
+    tile = tile_center(*(center or (lat, lon)))
+    result = build_result(prediction, image_pil, is_mock, lat, lon, 1200, zoom_level,
+                          footprint=get_buffer_footprint_pixels(lat, lon, 1200, zoom_level, image_size, tile),
+                          save_artifacts=save_artifacts, center=center)
+    if not result["solar_present"]:
+        print(f"No solar found in 1200 sqft buffer, checking 2400 sqft footprint of the same tile...")
+        metrics.BUFFER_FALLBACKS.inc()
+        result = build_result(prediction, image_pil, is_mock, lat, lon, 2400, zoom_level,
+                              footprint=get_buffer_footprint_pixels(lat, lon, 2400, zoom_level, image_size, tile),
+                              save_artifacts=save_artifacts, center=center)
+    return result
+
+def fetch_for_buffer(lat: float, lon: float, buffer_sqft: int, lane: str = INTERACTIVE):
+    """
+    Fetches the satellite tile at the zoom level matching the buffer size.
+    Returns (image_pil, is_mock, zoom_level).
+    """
     zoom_level = get_zoom_level_for_box(lat, buffer_sqft)
-    image_pil, is_mock = fetch_satellite_image(lat, lon, zoom=zoom_level)
-    
-    # 2. Preprocess
-    img_tensor = get_transform()(image_pil).to(device)
-    
-    # 3. Predict
-    print(f"Running prediction...")
-    with torch.no_grad():
-        prediction = model([img_tensor])[0]
-    
-    # 4. Filter Results
-    scores = prediction['scores'].cpu().numpy()
-    masks = prediction['masks'].cpu().numpy()
-    boxes = prediction['boxes'].cpu().numpy()
+    image_pil, is_mock = fetch_tile(lat, lon, zoom_level, lane)
+    return image_pil, is_mock, zoom_level
+
+def fetch_tile(lat: float, lon: float, zoom: int, lane: str = INTERACTIVE):
+    """
+    Fetches the satellite tile centered at (lat, lon) at a given zoom level.
+    lane: imagery scheduler priority, "interactive" (/infer) or "bulk" (batches, scans).
+    Returns (image_pil, is_mock); raises ImageryDeferred when the imagery quota is used up.
+    """
+    with metrics.timed("fetch"):
+        image_pil, is_mock = fetch_satellite_image(lat, lon, zoom=zoom, lane=lane)
+    metrics.FETCHES.inc(source="mock" if is_mock else "real")
+    return image_pil, is_mock
+
+def predict_batch(model, images, device):
+    """
+    Runs a list of PIL images through the inference engine (see engines.py).
+    model may be an engine or a bare torch model.
+    With SCREEN_ENABLED, tiles whose low-resolution presence score is below
+    SCREEN_NEGATIVE_THRESHOLD get an empty prediction instead of the full pass.
+    """
+    engine = as_engine(model, device)
+    presence = engine.screen(images, SCREEN_SIZE) if SCREEN_ENABLED else None
+    if presence is None:
+        if SCREEN_ENABLED:
+            # Worker processes, ONNX and TorchScript have no screening pass
+            if not STAGE_COUNTS["screen_unavailable"]:
+                print(f"Screening unavailable with this engine ({type(engine).__name__}), running full segmentation")
+            _count_stages(screen_unavailable=len(images))
+        _count_stages(full_segmentation=len(images))
+        return engine.predict(images)
+
+    ambiguous = [i for i, p in enumerate(presence) if p >= SCREEN_NEGATIVE_THRESHOLD]
+    print(f"Screening: {len(images) - len(ambiguous)}/{len(images)} tiles ruled out at {SCREEN_SIZE}px")
+    _count_stages(screened=len(images), screened_out=len(images) - len(ambiguous), full_segmentation=len(ambiguous))
+
+    predictions = [_empty_prediction(img) for img in images]
+    if ambiguous:
+        for i, prediction in zip(ambiguous, engine.predict([images[i] for i in ambiguous])):
+            predictions[i] = prediction
+    return predictions
+
+def _empty_prediction(image_pil):
+    width, height = image_pil.size
+    return {
+        "boxes": np.zeros((0, 4), dtype=np.float32),
+        "labels": np.zeros((0,), dtype=np.int64),
+        "scores": np.zeros((0,), dtype=np.float32),
+        "masks": np.zeros((0, 1, height, width), dtype=np.float32),
+    }
+
+def _count_stages(**counts):
+    with _stage_lock:
+        for key, value in counts.items():
+            STAGE_COUNTS[key] += value
+
+def build_result(prediction, image_pil, is_mock, lat: float, lon: float, buffer_sqft: int, zoom_level: int,
+                 footprint=None, save_artifacts: bool = True, center=None):
+    """
+    Post-processes one model output into the API result dict (filter, quantify, save artifacts).
+    footprint: optional (x_min, y_min, x_max, y_max) pixel rectangle; when given, only
+    detections whose mask overlaps it are counted. In a shared tile (center given) it
+    defaults to the buffer of (lat, lon), so neighbours' panels are not counted; a tile
+    of its own counts every detection.
+    save_artifacts=False skips rendering and saving the images (artifact_paths are None),
+    for bulk scoring where only the numbers are kept.
+    center: (lat, lon) the tile was requested at, if not (lat, lon); used to georeference
+    the per-detection geometry (see mask_encoding.py).
+    """
+    postprocess_start = time.perf_counter()
+    tile_lat, tile_lon = tile_center(*(center or (lat, lon)))
+    if footprint is None and center is not None:
+        footprint = get_buffer_footprint_pixels(lat, lon, buffer_sqft, zoom_level, image_pil.size[0], (tile_lat, tile_lon))
+    # 4. Filter Results (vectorized, see postprocess.py)
+    detections = filter_detections(prediction, CONFIDENCE_THRESHOLD, footprint,
+                                   instance_masks=MASK_ENCODING != "none")
     
     # Debug: Show max score
-    if len(scores) > 0:
-        print(f"Max confidence score: {np.max(scores):.4f}, Total predictions: {len(scores)}")
+    if detections["num_predictions"] > 0:
+        print(f"Max confidence score: {detections['max_score']:.4f}, Total predictions: {detections['num_predictions']}")
     else:
         print("No predictions generated by model")
     
-    valid_indices = np.where(scores > CONFIDENCE_THRESHOLD)[0]
+    kept_scores = detections["scores"]
+    print(f"Found {len(kept_scores)} detections above threshold {CONFIDENCE_THRESHOLD}")
     
-    print(f"Found {len(valid_indices)} detections above threshold {CONFIDENCE_THRESHOLD}")
-    
-    solar_present = len(valid_indices) > 0
-    total_area_pixels = 0
+    solar_present = len(kept_scores) > 0
+    total_area_pixels = detections["area_pixels"]
     
     # Create valid mask overlay
-    img_np = np.array(image_pil)
-    overlay_img = img_np.copy()
-    
-    # Color for mask (Green with transparency)
-    mask_color = np.array([0, 255, 0]) 
-    
-    for idx in valid_indices:
-        mask = masks[idx, 0]
-        # Binarize mask
-        mask_binary = mask > 0.5
-        total_area_pixels += np.sum(mask_binary)
-        
-        # Draw overlay
-        # Simple color blending
-        overlay_img[mask_binary] = (overlay_img[mask_binary] * 0.5 + mask_color * 0.5).astype(np.uint8)
-        
-        # Draw bounding box
-        box = boxes[idx].astype(int)
-        cv2.rectangle(overlay_img, (box[0], box[1]), (box[2], box[3]), (0, 255, 0), 2)
+    if save_artifacts:
+        overlay_img = render_overlay(np.array(image_pil), detections["union_mask"], detections["boxes"])
 
     # 5. Quantify Area
-    meters_per_pixel = get_meters_per_pixel(lat, zoom_level)
-    area_sq_meters = total_area_pixels * (meters_per_pixel ** 2)
-    
-    # 6. Save Artifacts
-    if not os.path.exists(ARTIFACTS_DIR):
-        os.makedirs(ARTIFACTS_DIR)
-        
+    # Each pixel row at its own latitude's scale (see utils/geo_utils.py)
+    area_sq_meters = mask_area_m2(detections["union_mask"], tile_lat, zoom_level) if total_area_pixels else 0.0
+    if MASK_ENCODING != "none":
+        # Masks as RLE/polygons plus lon/lat outlines: kilobytes instead of overlay images
+        described = describe_detections(detections["masks"], kept_scores, detections["boxes"],
+                                        (tile_lat, tile_lon), zoom_level)
+    metrics.record("postprocess", time.perf_counter() - postprocess_start)
+    
+    # 6. Save Artifacts (encoded and written in the background, paths are valid immediately)
     sample_id = str(uuid.uuid4())
-    
-    # Save original
-    original_path = os.path.join(ARTIFACTS_DIR, f"original_{sample_id}.png")
-    image_pil.save(original_path)
-    
-    # Save overlay
-    overlay_pil = Image.fromarray(overlay_img)
-    overlay_path = os.path.join(ARTIFACTS_DIR, f"overlay_{sample_id}.png")
-    overlay_pil.save(overlay_path)
+    if save_artifacts:
+        with metrics.timed("artifact_save"):
+            artifact_paths = get_artifact_writer().submit(sample_id, image_pil, overlay_img)
+    else:
+        artifact_paths = {"original": None, "overlay": None}
     
     # 7. Construct Result
-    return {
+    result = {
         "sample_id": sample_id,
         "latitude": lat,
         "longitude": lon,
         "solar_present": bool(solar_present),
         "solar_area_m2": float(round(area_sq_meters, 2)),
-        "confidence": float(round(scores[valid_indices[0]], 2)) if len(valid_indices) > 0 else 0.0,
+        "confidence": float(round(kept_scores[0], 2)) if solar_present else 0.0,
         "qc_status": "VERIFIABLE" if solar_present else "NOT_VERIFIABLE",
         "is_mock_data": is_mock,
         "buffer_size_sqft": buffer_sqft,
         "model_version": "v1.0",
         "timestamp": datetime.datetime.utcnow().isoformat(),
-        "artifact_paths": {
-            "original": f"/static/original_{sample_id}.png",
-            "overlay": f"/static/overlay_{sample_id}.png"
-        }
+        "artifact_paths": artifact_paths
     }
+    if MASK_ENCODING != "none":
+        result["detections"] = described
+    return result
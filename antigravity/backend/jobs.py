@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import datetime
+import threading
+
+# Configuration
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(__file__), "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "16"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_results_by_job ON job_results (job_id, seq);
+"""
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+class JobStore:
+    """
+    SQLite persistence for batch jobs. Every location is a row in job_items, and every
+    finished location appends its result to job_results, so a restart loses at most
+    the chunks that were in flight.
+    """
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create_job(self, locations) -> str:
+        job_id = str(uuid.uuid4())
+        now = _now()
+        with self._lock, self._connect() as conn:
+            status = "queued" if locations else "completed"
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?)", (job_id, status, len(locations), now, now))
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, user_id, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, i, str(user_id), lat, lon) for i, (user_id, lat, lon) in enumerate(locations)],
+            )
+        return job_id
+
+    def pending_items(self, job_id: str):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT idx, user_id, lat, lon FROM job_items WHERE job_id = ? AND done = 0 ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        return rows
+
+    def unfinished_jobs(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at")]
+
+    def save_results(self, job_id: str, items, results):
+        with self._lock, self._connect() as conn:
+            for (idx, _, _, _), result in zip(items, results):
+                conn.execute("INSERT INTO job_results (job_id, idx, result) VALUES (?, ?, ?)",
+                             (job_id, idx, json.dumps(result)))
+                conn.execute("UPDATE job_items SET done = 1, failed = ? WHERE job_id = ? AND idx = ?",
+                             (1 if "error" in result else 0, job_id, idx))
+            remaining = conn.execute("SELECT COUNT(*) FROM job_items WHERE job_id = ? AND done = 0",
+                                     (job_id,)).fetchone()[0]
+            status = "completed" if remaining == 0 else "running"
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, _now(), job_id))
+
+    def progress(self, job_id: str):
+        with self._connect() as conn:
+            job = conn.execute("SELECT status, total, created_at, updated_at FROM jobs WHERE job_id = ?",
+                               (job_id,)).fetchone()
+            if job is None:
+                return None
+            done, failed = conn.execute(
+                "SELECT COALESCE(SUM(done), 0), COALESCE(SUM(failed), 0) FROM job_items WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        status, total, created_at, updated_at = job
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "completed": done,
+            "failed": failed,
+            "progress": round(done / total, 4) if total else 1.0,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def results_after(self, job_id: str, after_seq: int, limit: int = 500):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT seq, result FROM job_results WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after_seq, limit),
+            ).fetchall()
+
+class JobManager:
+    """
+    Background worker pool for batch jobs.
+    Jobs are split into chunks of JOB_CHUNK_SIZE locations; workers pick up chunks from a
+    shared queue and run them through process_fn (list of (user_id, lat, lon) -> results),
+    so several workers can share one large job.
+    Locations deferred by the imagery quota ({"status": "deferred"} results) stay pending
+    and are queued again once their retry_after_s has passed.
+    """
+    def __init__(self, process_fn, store: JobStore = None, workers: int = JOB_WORKERS,
+                 chunk_size: int = JOB_CHUNK_SIZE):
+        self.process_fn = process_fn
+        self.store = store or JobStore()
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self._queue = queue.Queue()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        """
+        Starts the workers and re-queues whatever was left unfinished by a previous run.
+        """
+        for n in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        for job_id in self.store.unfinished_jobs():
+            print(f"Resuming job {job_id}")
+            self._enqueue(job_id)
+
+    def stop(self):
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def submit(self, locations) -> str:
+        job_id = self.store.create_job(locations)
+        self._enqueue(job_id)
+        return job_id
+
+    def _enqueue(self, job_id):
+        items = self.store.pending_items(job_id)
+        for start in range(0, len(items), self.chunk_size):
+            self._queue.put((job_id, items[start:start + self.chunk_size]))
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            task = self._queue.get()
+            if task is None:
+                break
+            job_id, items = task
+            try:
+                results = self.process_fn([(user_id, lat, lon) for _, user_id, lat, lon in items])
+            except Exception as e:
+                print(f"Job {job_id} chunk failed: {e}")
+                results = [{"user_id": user_id, "error": str(e), "solar_present": False, "solar_area_m2": 0.0}
+                           for _, user_id, _, _ in items]
+            if self._stopping.is_set():
+                # Leave the chunk pending; it is picked up again on the next start()
+                break
+            # Deferred locations are not done: keep them pending and try again later
+            deferred = [r.get("status") == "deferred" for r in results]
+            if any(deferred):
+                delay = max(r["retry_after_s"] for r, d in zip(results, deferred) if d)
+                self._retry_later(job_id, [item for item, d in zip(items, deferred) if d], delay)
+                items = [item for item, d in zip(items, deferred) if not d]
+                results = [r for r, d in zip(results, deferred) if not d]
+            self.store.save_results(job_id, items, results)
+
+    def _retry_later(self, job_id, items, delay):
+        print(f"Job {job_id}: {len(items)} locations deferred by the imagery quota, retrying in {delay}s")
+        timer = threading.Timer(delay, self._queue.put, args=((job_id, items),))
+        timer.daemon = True
+        timer.start()
+
+    def stream_results(self, job_id: str, fmt: str = "ndjson", after_seq: int = 0):
+        """
+        Yields results as they complete, NDJSON lines or Server-Sent Events,
+        until the job is finished and every stored result has been sent.
+        after_seq skips results a reconnecting client already has (SSE Last-Event-ID).
+        """
+        last_seq = after_seq
+        while True:
+            # Status before rows: rows saved before the job completed are then always read
+            progress = self.store.progress(job_id)
+            rows = self.store.results_after(job_id, last_seq)
+            for seq, result in rows:
+                last_seq = seq
+                if fmt == "sse":
+                    yield f"id: {seq}\nevent: result\ndata: {result}\n\n"
+                else:
+                    yield result + "\n"
+            if rows:
+                continue
+
+            if progress is None or progress["status"] == "completed":
+                if fmt == "sse":
+                    yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+                break
+            time.sleep(JOB_POLL_INTERVAL)
@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+
+from utils.geo_utils import latlon_to_world, world_to_latlon_array, mask_area_m2
+
+# Configuration
+# Per-detection geometry added to results: rle (COCO RLE mask), polygon (simplified COCO polygon) or none.
+# Opt-in: encoding every mask costs more than the rest of post-processing
+MASK_ENCODING = os.getenv("MASK_ENCODING", "none").lower()
+MASK_ENCODINGS = ("rle", "polygon", "none")
+if MASK_ENCODING not in MASK_ENCODINGS:
+    # Fail at startup rather than on every request
+    raise ValueError(f"Unsupported MASK_ENCODING '{MASK_ENCODING}', expected rle, polygon or none")
+# Pixels a simplified outline may deviate from the mask (polygon masks and GeoJSON geometries)
+MASK_SIMPLIFY_TOLERANCE = float(os.getenv("MASK_SIMPLIFY_TOLERANCE", "1.0"))
+GEOJSON_PRECISION = 7  # decimals of lon/lat (~1 cm)
+
+# COCO run-length encoding
+
+def encode_rle(mask: np.ndarray) -> dict:
+    """
+    COCO compressed RLE of an HxW binary mask: {"size": [h, w], "counts": str}, readable
+    by pycocotools.mask.decode. Runs are taken in column-major order, starting with zeros.
+    """
+    height, width = mask.shape
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return {"size": [int(height), int(width)], "counts": _counts_to_string(runs.tolist())}
+
+def decode_rle(rle: dict) -> np.ndarray:
+    """
+    Inverse of encode_rle: HxW bool mask.
+    """
+    height, width = rle["size"]
+    runs = _string_to_counts(rle["counts"])
+    values = np.zeros(len(runs), dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, runs)
+    return flat.reshape((width, height)).T
+
+def _counts_to_string(counts) -> str:
+    # Same as rleToString in the COCO API: each count (minus the one two back, after the
+    # first two) as a little-endian signed varint of 5-bit groups, offset into printable ASCII
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+def _string_to_counts(s: str):
+    counts = []
+    p = 0
+    while p < len(s):
+        x = k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+# Polygons
+
+def pixel_shape(contour, x: float = 0, y: float = 0):
+    """
+    Shapely outline of a cv2 contour (pixel indices, offset by (x, y)) covering whole
+    pixels: pixel i spans [i, i + 1], so areas and seams line up with the mask.
+    """
+    from shapely import make_valid
+    from shapely.geometry import LineString, Point, Polygon
+
+    points = contour.reshape(-1, 2) + (x + 0.5, y + 0.5)
+    if len(points) == 1:
+        return Point(points[0]).buffer(0.5, cap_style="square")
+    ring = np.vstack([points, points[:1]]) if len(points) > 2 else points
+    outline = LineString(ring).buffer(0.5, cap_style="square", join_style="mitre")
+    if len(points) < 3:
+        return outline
+    return make_valid(Polygon(points)).union(outline)
+
+def mask_shape(mask: np.ndarray, x: float = 0, y: float = 0):
+    """
+    Shapely (Multi)Polygon of the outer outlines of a binary mask, offset by (x, y).
+    """
+    import cv2  # deferred to keep it off the startup path
+    from shapely.ops import unary_union
+
+    contours, _ = cv2.findContours(np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return unary_union([pixel_shape(c, x, y) for c in contours])
+
+def encode_polygon(mask: np.ndarray, tolerance: float = MASK_SIMPLIFY_TOLERANCE):
+    """
+    Simplified outlines of a binary mask in COCO polygon format: [[x1, y1, x2, y2, ...], ...]
+    in pixel coordinates, one flat list per outer ring.
+    """
+    shape = mask_shape(mask).simplify(tolerance)
+    polygons = getattr(shape, "geoms", [shape])
+    return [[round(v, 1) for point in polygon.exterior.coords[:-1] for v in point]
+            for polygon in polygons if not polygon.is_empty and polygon.geom_type == "Polygon"]
+
+# GeoJSON
+
+def world_to_geojson(shape, zoom: int) -> dict:
+    """
+    GeoJSON geometry (lon/lat) of a shapely geometry in Web Mercator world pixels at zoom.
+    """
+    from shapely.geometry import mapping
+    from shapely.ops import transform
+
+    to_lonlat = lambda x, y: tuple(np.round(v, GEOJSON_PRECISION) for v in world_to_latlon_array(x, y, zoom)[::-1])
+    return mapping(transform(to_lonlat, shape))
+
+def tile_to_geojson(shape, center_lat: float, center_lon: float, zoom: int, image_size: int = 640) -> dict:
+    """
+    GeoJSON geometry (lon/lat) of a shapely geometry in pixel coordinates of a tile
+    centered at (center_lat, center_lon).
+    """
+    from shapely.affinity import translate
+
+    cx, cy = latlon_to_world(center_lat, center_lon, zoom)
+    return world_to_geojson(translate(shape, cx - image_size / 2, cy - image_size / 2), zoom)
+
+def describe_detections(masks, scores, boxes, center, zoom: int,
+                        encoding: str = MASK_ENCODING, tolerance: float = MASK_SIMPLIFY_TOLERANCE):
+    """
+    One entry per kept detection: confidence, pixel bbox, area, the mask (RLE or polygon,
+    in tile pixels) and its simplified outline as a lon/lat GeoJSON geometry.
+    masks: (K, H, W) bool; center: (lat, lon) the tile was fetched at.
+    """
+    if encoding not in ("rle", "polygon"):
+        raise ValueError(f"Unsupported MASK_ENCODING '{encoding}', expected rle, polygon or none")
+    detections = []
+    for mask, score, box in zip(masks, scores, boxes):
+        shape = mask_shape(mask)
+        entry = {
+            "confidence": round(float(score), 2),
+            "bbox_px": [int(v) for v in np.round(box)],
+            "area_m2": round(mask_area_m2(mask, center[0], zoom), 2),
+            "mask": encode_rle(mask) if encoding == "rle" else encode_polygon(mask, tolerance),
+            "geometry": tile_to_geojson(shape.simplify(tolerance), center[0], center[1], zoom, mask.shape[1]),
+        }
+        detections.append(entry)
+    return detections
+
+def result_to_geojson(result: dict) -> dict:
+    """
+    FeatureCollection for one /infer result: a Point feature for the queried location with
+    the verdict as properties, then one Polygon feature per detection.
+    """
+    properties = {k: v for k, v in result.items() if k not in ("detections", "artifact_paths")}
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [result.get("longitude"), result.get("latitude")]},
+        "properties": dict(properties, feature="location"),
+    }]
+    for i, detection in enumerate(result.get("detections") or []):
+        features.append({
+            "type": "Feature",
+            "geometry": detection["geometry"],
+            "properties": {"feature": "panel", "sample_id": result.get("sample_id"), "detection": i,
+                           "confidence": detection["confidence"], "area_m2": detection["area_m2"]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+def panels_to_geojson(panels, summary: dict = None) -> dict:
+    """
+    FeatureCollection of region scan panels (see region_scan.py); the summary, if
+    given, is kept as a top-level "summary" member.
+    """
+    collection = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": panel["geometry"],
+         "properties": {k: v for k, v in panel.items() if k != "geometry"}}
+        for panel in panels
+    ]}
+    if summary is not None:
+        collection["summary"] = summary
+    return collection
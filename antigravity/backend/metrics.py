@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Configuration
+# Adds a per-stage "timings_ms" breakdown to every /infer response (also available per request with ?debug=true)
+DEBUG_TIMINGS = os.getenv("DEBUG_TIMINGS", "0") == "1"
+
+# Seconds; covers a cache hit (~1 ms) up to a slow CPU forward pass with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_local = threading.local()
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels: COUNTER.inc(source="mock").
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in items]
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus sense (_bucket / _sum / _count).
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        out = []
+        for key, entry in items:
+            for bound, count in zip(self.buckets, entry):
+                out.append((f"{self.name}_bucket", _format_labels(self.labels, key, [("le", _format_value(bound))]), count))
+            out.append((f"{self.name}_sum", _format_labels(self.labels, key), entry[-2]))
+            out.append((f"{self.name}_count", _format_labels(self.labels, key), entry[-1]))
+        return out
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format (served on /metrics).
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# Pipeline metrics
+
+STAGE_SECONDS = Histogram(
+    "inference_stage_seconds",
+    "Time spent per pipeline stage (fetch, queue, preprocess, forward, postprocess, artifact_save, total).",
+    labels=("stage",),
+)
+FETCHES = Counter("tile_fetches_total", "Satellite tiles obtained, by source (real or mock).", labels=("source",))
+TILE_CACHE_LOOKUPS = Counter("tile_cache_lookups_total", "Tile cache lookups, by result (hit or miss).", labels=("result",))
+TILE_FETCH_FAILURES = Counter("tile_fetch_failures_total", "Tile downloads that failed after all retries.")
+BUFFER_FALLBACKS = Counter("buffer_fallbacks_total", "Locations re-checked with the 2400 sqft buffer after 1200 sqft found nothing.")
+RESULT_CACHE_LOOKUPS = Counter("result_cache_lookups_total", "Stored-verdict lookups by location, buffer and model, by result (hit or miss).", labels=("result",))
+PLANNER_TILES_SAVED = Counter("batch_planner_tiles_saved_total", "Tile fetches and forward passes avoided by sharing tiles between nearby batch locations.")
+REGION_SCAN_TILES = Counter("region_scan_tiles_total", "Tiles run through the model by region scans.")
+IMAGERY_REQUESTS = Counter("imagery_requests_total", "Requests sent to the imagery provider, by lane (interactive or bulk).", labels=("lane",))
+IMAGERY_THROTTLED = Counter("imagery_throttled_total", "429 responses from the imagery provider.")
+IMAGERY_DEFERRED = Counter("imagery_deferred_total", "Tile requests deferred instead of sent, by reason (rate_limited, daily_budget, monthly_budget).", labels=("reason",))
+IMAGERY_DEDUPLICATED = Counter("imagery_deduplicated_total", "Tile requests that shared an identical request already in flight.")
+ERRORS = Counter("inference_errors_total", "Failed requests or batch items, by kind.", labels=("kind",))
+
+# Per-request timings
+
+@contextmanager
+def trace():
+    """
+    Collects the stage timings recorded on this thread while the block runs:
+        with metrics.trace() as timings: ...
+    timings maps stage -> seconds, summed over repeated stages (e.g. both buffer passes).
+    """
+    previous = getattr(_local, "timings", None)
+    timings = {}
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+def record(stage: str, seconds: float, observe: bool = True):
+    """
+    Adds a stage duration to the histogram and to the active trace, if any.
+    observe=False only adds to the trace (for time already observed elsewhere).
+    """
+    if observe:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def timings_ms(timings: dict) -> dict:
+    return {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
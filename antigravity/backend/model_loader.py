@@ -1,41 +1,97 @@
 import torch
-import torchvision
-from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
-from torchvision.models.detection.mask_rcnn import MaskRCNNPredictor
 import os
+import pickle
+import hashlib
+
+# Configuration
+# eager | dynamic_quant | torchscript | compile  (see optimize_model)
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "eager")
+MODEL_VARIANTS = ("eager", "dynamic_quant", "torchscript", "compile")
+# Resolution the model's internal transform resizes tiles to. torchvision defaults to 800 px,
+# which upsamples our 640x640 tiles; 0 keeps the torchvision default.
+INFERENCE_MIN_SIZE = int(os.getenv("INFERENCE_MIN_SIZE", "0"))
+INFERENCE_MAX_SIZE = int(os.getenv("INFERENCE_MAX_SIZE", "0"))
+# Memory-map the checkpoint and use the mapped tensors as the model's weights (see build_model),
+# so every process serving the same file shares one copy of the weights through the page cache
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1") == "1"
+# Built TorchScript variants are saved here and reused while the checkpoint is unchanged ("" disables)
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.path.dirname(__file__), "models", "cache"))
 
 def get_model_instance_segmentation(num_classes):
-    # load an instance segmentation model pre-trained on COCO
-    model = torchvision.models.detection.maskrcnn_resnet50_fpn(weights="DEFAULT")
-
-    # get number of input features for the classifier
-    in_features = model.roi_heads.box_predictor.cls_score.in_features
-    # replace the pre-trained head with a new one
-    model.roi_heads.box_predictor = FastRCNNPredictor(in_features, num_classes)
-
-    # now get the number of input features for the mask classifier
-    in_features_mask = model.roi_heads.mask_predictor.conv5_mask.in_channels
-    hidden_layer = 256
-    # and replace the mask predictor with a new one
-    model.roi_heads.mask_predictor = MaskRCNNPredictor(in_features_mask,
-                                                       hidden_layer,
-                                                       num_classes)
+    """
+    Mask R-CNN ResNet-50-FPN with the heads sized for num_classes, built without any
+    pretrained weights: load_model overwrites every parameter with the checkpoint, so
+    downloading the COCO weights at boot would be wasted (and fails offline).
+    The backbone uses FrozenBatchNorm2d like the COCO-initialised model we trained,
+    so the checkpoint's state dict matches key for key.
+    """
+    from torchvision.models.resnet import resnet50
+    from torchvision.models.detection.mask_rcnn import MaskRCNN
+    from torchvision.models.detection.backbone_utils import _resnet_fpn_extractor
+    from torchvision.ops.misc import FrozenBatchNorm2d
+
+    backbone = _resnet_fpn_extractor(resnet50(weights=None, norm_layer=FrozenBatchNorm2d), trainable_layers=3)
+    return MaskRCNN(backbone, num_classes=num_classes)
+
+def load_state_dict(model_path: str, device: torch.device):
+    """
+    Reads the checkpoint, memory-mapped when MODEL_MMAP is on (tensors are paged in
+    from the file on first use instead of being read into memory up front).
+    """
+    if MODEL_MMAP:
+        try:
+            return torch.load(model_path, map_location=device, mmap=True, weights_only=True)
+        except (RuntimeError, pickle.UnpicklingError) as e:
+            # Only zipfile-format, plain state-dict checkpoints can be mmap'd with weights_only
+            print(f"Could not mmap {model_path} ({e}), loading it into memory instead")
+    return torch.load(model_path, map_location=device)
+
+def build_model(model_path: str, device: torch.device, num_classes: int = 2):
+    """
+    Mask R-CNN with the checkpoint's weights.
+    With MODEL_MMAP the architecture is built on the meta device (no allocation, no random
+    init) and load_state_dict(assign=True) makes the memory-mapped checkpoint tensors the
+    parameters themselves. Inference never writes to them, so they stay clean file-backed
+    pages that all workers loading the same file (or forked from one that did) share,
+    instead of each holding a private ~170 MB copy.
+    """
+    state_dict = load_state_dict(model_path, device)
+    if not MODEL_MMAP:
+        model = get_model_instance_segmentation(num_classes)
+        model.load_state_dict(state_dict)
+        return model
+
+    with torch.device("meta"):
+        model = get_model_instance_segmentation(num_classes)
+    model.load_state_dict(state_dict, assign=True)
+    # Anchor templates are plain tensors rather than buffers, so the checkpoint can't restore them
+    anchors = model.rpn.anchor_generator
+    anchors.cell_anchors = [anchors.generate_anchors(size, ratios)
+                            for size, ratios in zip(anchors.sizes, anchors.aspect_ratios)]
     return model
 
-def load_model(model_path: str, device: torch.device):
+def load_model(model_path: str, device: torch.device, variant: str = None):
     """
     Loads the trained model weights. 
-    If weights are not found, returns a model with random weights (or initialized COCO weights) 
+    If weights are not found, returns a model with random weights 
     so the app doesn't crash, but warns heavily.
+    variant selects an optimized CPU variant (defaults to the MODEL_VARIANT env var).
     """
+    variant = variant or MODEL_VARIANT
+    cache_path = _cache_path(model_path, variant, device)
+    if cache_path and os.path.exists(cache_path):
+        print(f"Loading cached '{variant}' model from {cache_path}")
+        import torchvision  # noqa: F401 (registers the nms / roi_align ops the scripted model calls)
+        return ScriptedDetectionModel(torch.jit.load(cache_path, map_location=device)).eval()
+
     num_classes = 2 # Background + Solar Panel
-    model = get_model_instance_segmentation(num_classes)
     
     if os.path.exists(model_path):
         print(f"Loading model weights from {model_path}")
-        model.load_state_dict(torch.load(model_path, map_location=device))
+        model = build_model(model_path, device, num_classes)
     else:
-        print(f"WARNING: Model weights not found at {model_path}. Using base COCO weights (predictions will be nonsense).")
+        print(f"WARNING: Model weights not found at {model_path}. Using random weights (predictions will be nonsense).")
+        model = get_model_instance_segmentation(num_classes)
     
     model.to(device)
     model.eval()
@@ -46,4 +102,73 @@ def load_model(model_path: str, device: torch.device):
     model.roi_heads.score_thresh = 0.01  # Lower from default 0.05
     model.roi_heads.nms_thresh = 0.5     # Keep NMS threshold reasonable
     
+    if INFERENCE_MIN_SIZE:
+        model.transform.min_size = (INFERENCE_MIN_SIZE,)
+        model.transform.max_size = INFERENCE_MAX_SIZE or max(INFERENCE_MIN_SIZE, model.transform.max_size)
+        print(f"Inference resolution: min_size={INFERENCE_MIN_SIZE}, max_size={model.transform.max_size}")
+    
+    # Optimize last, so scripted/compiled variants pick up the thresholds above
+    model = optimize_model(model, variant, device)
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        torch.jit.save(model.scripted, f"{cache_path}.tmp")
+        os.replace(f"{cache_path}.tmp", cache_path)
+        print(f"Saved '{variant}' model to {cache_path}")
+    return model
+
+def _cache_path(model_path: str, variant: str, device: torch.device):
+    """
+    Where the built variant is cached, or None when it isn't cacheable. Only TorchScript
+    is: quantization is quick to redo and torch.compile output can't be serialized.
+    The name encodes everything the built model depends on, so a new checkpoint,
+    resolution or torch version never picks up a stale file.
+    """
+    if variant != "torchscript" or not MODEL_CACHE_DIR or not os.path.exists(model_path):
+        return None
+    stat = os.stat(model_path)
+    source = (f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{torch.__version__}:"
+              f"{INFERENCE_MIN_SIZE}:{INFERENCE_MAX_SIZE}:{device.type}")
+    digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(MODEL_CACHE_DIR, f"{name}.{variant}-{digest}.pt")
+
+class ScriptedDetectionModel(torch.nn.Module):
+    """
+    Scripted torchvision detection models return (losses, detections);
+    this unwraps them so callers keep the eager model(images) -> detections contract.
+    """
+    def __init__(self, scripted):
+        super().__init__()
+        self.scripted = scripted
+
+    def forward(self, images):
+        _, detections = self.scripted(images)
+        return detections
+
+def optimize_model(model, variant: str, device: torch.device):
+    """
+    Returns an inference-optimized version of an eval-mode Mask R-CNN.
+    - eager:         unchanged.
+    - dynamic_quant: int8 dynamic quantization of the Linear layers (the 12544->1024
+                     box head MLP dominates the parameter count). CPU only.
+    - torchscript:   torch.jit.script of the whole detector (no Python overhead per op).
+    - compile:       torch.compile of the backbone+FPN, where most of the FLOPs are;
+                     the data-dependent RPN/ROI stages stay eager.
+    Static quantization is not offered: the convolutional backbone would need
+    QuantStub/DeQuantStub surgery that torchvision's detection models don't support.
+    """
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown MODEL_VARIANT '{variant}', expected one of {MODEL_VARIANTS}")
+    if variant == "eager":
+        return model
+
+    print(f"Building '{variant}' model variant...")
+    if variant == "dynamic_quant":
+        if device.type != "cpu":
+            print("WARNING: dynamic quantization is CPU-only, keeping the eager model.")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if variant == "torchscript":
+        return ScriptedDetectionModel(torch.jit.script(model)).eval()
+    model.backbone = torch.compile(model.backbone, dynamic=True)
     return model
@@ -0,0 +1,80 @@
+import os
+import torch
+import numpy as np
+
+# Configuration
+MASK_THRESHOLD = 0.5
+MASK_COLOR = np.array([0, 255, 0])  # Green with transparency
+# Threshold and merge masks where the model ran and only copy the final union mask to host memory
+POSTPROCESS_ON_DEVICE = os.getenv("POSTPROCESS_ON_DEVICE", "1") == "1"
+
+def filter_detections(prediction, confidence_threshold: float, footprint=None, on_device: bool = POSTPROCESS_ON_DEVICE,
+                      instance_masks: bool = False):
+    """
+    Vectorized replacement for the per-detection loop over a Mask R-CNN output.
+    - Keeps detections above confidence_threshold (and overlapping footprint, if given).
+    - Merges all kept masks into a single binary union mask in one reduction,
+      so overlapping detections are counted once.
+    Returns a dict of NumPy arrays: scores / boxes of the kept detections, the HxW
+    union mask, its pixel count and the raw max score.
+    instance_masks=True also returns the kept (K, H, W) binary masks as "masks".
+    """
+    scores = torch.as_tensor(prediction["scores"])
+    boxes = torch.as_tensor(prediction["boxes"])
+    masks = torch.as_tensor(prediction["masks"])
+    if not on_device:
+        scores, boxes, masks = scores.cpu(), boxes.cpu(), masks.cpu()
+
+    keep = torch.nonzero(scores > confidence_threshold).flatten()
+    if footprint is not None and len(keep) > 0:
+        x0, y0, x1, y1 = footprint
+        if x1 <= x0 or y1 <= y0:
+            # Empty footprint (e.g. clipped away at the tile edge): nothing can overlap it
+            keep = keep[:0]
+        else:
+            inside = masks[keep, 0, y0:y1, x0:x1].flatten(1).amax(dim=1) > MASK_THRESHOLD
+            keep = keep[inside]
+
+    # Scores come sorted, so the kept masks are usually a prefix: slice (a view) instead of gathering
+    if len(keep) > 0 and int(keep[-1]) == len(keep) - 1:
+        kept_masks = masks[:len(keep), 0]
+    else:
+        kept_masks = masks[keep, 0]
+
+    # Union of binarized masks == binarized per-pixel max, without a (K, H, W) bool intermediate
+    height, width = masks.shape[-2:]
+    if len(keep) > 0:
+        union = kept_masks.amax(dim=0) > MASK_THRESHOLD
+    else:
+        union = torch.zeros((height, width), dtype=torch.bool, device=masks.device)
+
+    result = {
+        "num_predictions": int(scores.numel()),
+        "max_score": float(scores.max()) if scores.numel() > 0 else None,
+        "scores": scores[keep].cpu().numpy(),
+        "boxes": boxes[keep].cpu().numpy(),
+        "union_mask": union.cpu().numpy(),
+        "area_pixels": int(union.sum()),
+    }
+    if instance_masks:
+        result["masks"] = (kept_masks > MASK_THRESHOLD).cpu().numpy()
+    return result
+
+def render_overlay(image_np: np.ndarray, union_mask: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Blends the union mask into the image once and draws every box in a single call.
+    """
+    overlay_img = image_np.copy()
+    overlay_img[union_mask] = (overlay_img[union_mask] * 0.5 + MASK_COLOR * 0.5).astype(np.uint8)
+
+    if len(boxes) > 0:
+        import cv2  # deferred to keep it off the startup path
+        b = boxes.astype(np.int32)
+        rects = np.stack([
+            np.stack([b[:, 0], b[:, 1]], axis=1),
+            np.stack([b[:, 2], b[:, 1]], axis=1),
+            np.stack([b[:, 2], b[:, 3]], axis=1),
+            np.stack([b[:, 0], b[:, 3]], axis=1),
+        ], axis=1)  # (K, 4 corners, xy)
+        cv2.polylines(overlay_img, list(rects), True, (0, 255, 0), 2)
+    return overlay_img
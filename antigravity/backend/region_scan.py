@@ -0,0 +1,383 @@
+"""
+Region scan: every solar panel inside a bounding box or polygon, as georeferenced
+polygons with their area, instead of one /infer call per point:
+
+    python region_scan.py --bbox -118.470 34.160 -118.466 34.163 --output panels.ndjson
+    python region_scan.py --polygon village.geojson --output panels.ndjson
+
+The region is covered by a grid of zoom-20 tiles that overlap by REGION_SCAN_OVERLAP
+pixels. Each tile owns the core of its footprint (the grid cell, up to the middle of the
+overlap), so no pixel is counted twice. Tiles stream through fetch -> batched predict
+-> merge in row order: detections are clipped to their tile's core, split into
+connected pieces, and pieces that touch across a seam are unioned into one panel.
+A panel is written out as soon as no later tile can reach it, so memory depends on the
+width of the region, not its size.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+
+import inference
+import metrics
+from inference import fetch_tile, predict_batch
+from batch_inference import BATCH_SIZE
+from postprocess import filter_detections
+from mask_encoding import pixel_shape, world_to_geojson
+from utils.geo_utils import (latlon_to_world, world_to_latlon, latlon_to_world_array, world_to_latlon_array,
+                             meters_per_pixel_array)
+from utils.image_fetcher import tile_center
+from utils.tile_prefetcher import prefetch_map
+from utils.imagery_scheduler import BULK, ImageryDeferred
+
+# Configuration
+REGION_SCAN_ZOOM = int(os.getenv("REGION_SCAN_ZOOM", "20"))
+REGION_SCAN_OVERLAP = int(os.getenv("REGION_SCAN_OVERLAP", "64"))        # pixels shared by neighbouring tiles
+REGION_SCAN_MAX_TILES = int(os.getenv("REGION_SCAN_MAX_TILES", "400"))   # per API request; the CLI has no limit
+
+def region_polygon(bbox=None, polygon=None):
+    """
+    The region to scan as a shapely Polygon in (lon, lat). Give exactly one of
+    bbox: (min_lon, min_lat, max_lon, max_lat), same order as get_bounding_box_for_area;
+    polygon: ring of (lon, lat) points (GeoJSON order).
+    Raises ValueError for a missing, empty or out-of-range region.
+    """
+    from shapely.geometry import Polygon, box
+
+    if (bbox is None) == (polygon is None):
+        raise ValueError("Give either a bbox or a polygon")
+    if bbox is not None:
+        if len(bbox) != 4:
+            raise ValueError("bbox must be [min_lon, min_lat, max_lon, max_lat]")
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if not (min_lon < max_lon and min_lat < max_lat):
+            raise ValueError("bbox must be [min_lon, min_lat, max_lon, max_lat] with min < max")
+        shape = box(min_lon, min_lat, max_lon, max_lat)
+    else:
+        if len(polygon) < 3 or any(len(point) != 2 for point in polygon):
+            raise ValueError("polygon must be a list of at least 3 [lon, lat] points")
+        shape = Polygon(polygon)
+        if not shape.is_valid:
+            # Self-intersecting rings (e.g. drawn by hand) are repaired rather than rejected
+            shape = shape.buffer(0)
+    if shape.is_empty or shape.area == 0:
+        raise ValueError("Region is empty")
+    min_lon, min_lat, max_lon, max_lat = shape.bounds
+    if min_lat < -85 or max_lat > 85 or min_lon < -180 or max_lon > 180:
+        raise ValueError("Region is outside the Web Mercator range (|lat| <= 85, |lon| <= 180)")
+    return shape
+
+def _to_world(region, zoom: int):
+    from shapely.ops import transform
+    return transform(lambda lon, lat: latlon_to_world_array(lat, lon, zoom), region)
+
+class RegionTile:
+    """
+    One fetch of the region grid. core: (x0, y0, x1, y1) world pixels at zoom that this
+    tile is responsible for; the image extends (image_size - core size) / 2 past it.
+    origin: world pixel of the image's top-left corner, from the center actually fetched.
+    """
+    def __init__(self, row: int, col: int, core, zoom: int, image_size: int = 640):
+        self.row = row
+        self.col = col
+        self.core = core
+        self.zoom = zoom
+        # fetch_satellite_image snaps centers to the cache grid (a few pixels at zoom 20),
+        # so fetch at the snapped center and georeference from it
+        self.lat, self.lon = tile_center(*world_to_latlon((core[0] + core[2]) / 2, (core[1] + core[3]) / 2, zoom))
+        x, y = latlon_to_world(self.lat, self.lon, zoom)
+        self.origin = (round(x - image_size / 2), round(y - image_size / 2))
+
+def _grid(region, zoom: int, image_size: int, overlap: int):
+    """
+    (row, col, core) for every grid cell that intersects the region, in row-major order.
+    Cells are image_size - overlap pixels wide and the grid is centered on the region.
+    """
+    from shapely.geometry import box
+    from shapely.prepared import prep
+
+    stride = image_size - overlap
+    world = _to_world(region, zoom)
+    min_x, min_y, max_x, max_y = world.bounds
+    cols = max(1, math.ceil((max_x - min_x) / stride))
+    rows = max(1, math.ceil((max_y - min_y) / stride))
+    x_start = math.floor((min_x + max_x - cols * stride) / 2)
+    y_start = math.floor((min_y + max_y - rows * stride) / 2)
+    prepared = prep(world)
+    for row in range(rows):
+        for col in range(cols):
+            core = (x_start + col * stride, y_start + row * stride,
+                    x_start + (col + 1) * stride, y_start + (row + 1) * stride)
+            if prepared.intersects(box(*core)):
+                yield row, col, core
+
+def plan_region(region, zoom: int = REGION_SCAN_ZOOM, image_size: int = 640, overlap: int = REGION_SCAN_OVERLAP):
+    """
+    Lazily yields the RegionTiles covering a region_polygon, row by row.
+    """
+    for row, col, core in _grid(region, zoom, image_size, overlap):
+        yield RegionTile(row, col, core, zoom, image_size)
+
+def count_region_tiles(region, zoom: int = REGION_SCAN_ZOOM, image_size: int = 640, overlap: int = REGION_SCAN_OVERLAP,
+                       limit: int = None) -> int:
+    """
+    Number of tiles plan_region yields; with a limit, stops counting at limit + 1.
+    """
+    count = 0
+    for _ in _grid(region, zoom, image_size, overlap):
+        count += 1
+        if limit is not None and count > limit:
+            break
+    return count
+
+class RegionScan:
+    """
+    Scans one region with a model; iterate it for the panels, then read summary().
+    Panels are dicts with panel_id, latitude/longitude (centroid), area_m2, confidence,
+    tiles (how many tiles it was assembled from) and a GeoJSON geometry in lon/lat.
+    Only panels whose centroid lies inside the region are returned.
+    """
+    def __init__(self, model, region, device, zoom: int = REGION_SCAN_ZOOM, overlap: int = REGION_SCAN_OVERLAP,
+                 batch_size: int = BATCH_SIZE, image_size: int = 640):
+        self.model = model
+        self.region = region
+        self.device = device
+        self.zoom = zoom
+        self.overlap = overlap
+        self.batch_size = max(1, batch_size)
+        self.image_size = image_size
+        self.tile_count = count_region_tiles(region, zoom, image_size, overlap)
+        self.stats = {"tiles_scanned": 0, "mock_tiles": 0, "failed_tiles": 0, "deferred_tiles": 0, "retry_after_s": 0, "batches": 0,
+                      "panels": 0, "total_area_m2": 0.0, "model_seconds": 0.0, "seconds": 0.0}
+        self._open = []     # merged pieces a later tile may still extend
+        self._row = None
+
+    def __iter__(self):
+        from shapely.prepared import prep
+
+        start = time.perf_counter()
+        self._world_region = prep(_to_world(self.region, self.zoom))
+        print(f"Region scan: {self.tile_count} tiles at zoom {self.zoom} ({self.overlap} px overlap)")
+        fetch = lambda tile: fetch_tile(tile.lat, tile.lon, tile.zoom, BULK)
+        batch = []
+        try:
+            for tile, fetched, error in prefetch_map(fetch, plan_region(self.region, self.zoom, self.image_size, self.overlap)):
+                if isinstance(error, ImageryDeferred):
+                    # Panels on this tile are missing; the summary says so rather than guessing
+                    self.stats["deferred_tiles"] += 1
+                    self.stats["retry_after_s"] = max(self.stats["retry_after_s"], error.retry_after)
+                    continue
+                if error is not None:
+                    print(f"Region scan: tile {tile.row},{tile.col} failed: {error}")
+                    self.stats["failed_tiles"] += 1
+                    continue
+                batch.append((tile, fetched))
+                if len(batch) == self.batch_size:
+                    yield from self._run_batch(batch)
+                    batch = []
+            if batch:
+                yield from self._run_batch(batch)
+            yield from self._finalize(None)
+        finally:
+            self.stats["seconds"] += time.perf_counter() - start
+
+    def summary(self) -> dict:
+        min_lon, min_lat, max_lon, max_lat = self.region.bounds
+        return {
+            "bbox": [min_lon, min_lat, max_lon, max_lat],
+            "zoom": self.zoom,
+            "overlap_px": self.overlap,
+            "tiles": self.tile_count,
+            "tiles_scanned": self.stats["tiles_scanned"],
+            "failed_tiles": self.stats["failed_tiles"],
+            "deferred_tiles": self.stats["deferred_tiles"],
+            "retry_after_s": self.stats["retry_after_s"] or None,
+            "mock_tiles": self.stats["mock_tiles"],
+            "is_mock_data": self.stats["mock_tiles"] > 0,
+            "panel_count": self.stats["panels"],
+            "total_area_m2": round(self.stats["total_area_m2"], 2),
+            "model_version": "v1.0",
+            "seconds": round(self.stats["seconds"], 2),
+        }
+
+    def ndjson(self):
+        """
+        One JSON line per panel, then a final {"summary": ...} line.
+        """
+        for panel in self:
+            yield json.dumps(panel) + "\n"
+        yield json.dumps({"summary": self.summary()}) + "\n"
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            predictions = predict_batch(self.model, [image for _, (image, _) in batch], self.device)
+        except Exception as e:
+            print(f"Region scan: batch prediction failed: {e}")
+            self.stats["failed_tiles"] += len(batch)
+            return
+        elapsed = time.perf_counter() - start
+        self.stats["batches"] += 1
+        self.stats["model_seconds"] += elapsed
+        self.stats["tiles_scanned"] += len(batch)
+        metrics.REGION_SCAN_TILES.inc(len(batch))
+        print(f"Region scan: {self.stats['tiles_scanned']}/{self.tile_count} tiles "
+              f"({len(batch) / elapsed:.2f} tiles/s), {len(self._open)} panels open")
+
+        for (tile, (image, is_mock)), prediction in zip(batch, predictions):
+            if tile.row != self._row:
+                # Nothing in this row or later can touch pieces that end two pixel rows above it
+                yield from self._finalize(tile.core[1])
+                self._row = tile.row
+            self.stats["mock_tiles"] += int(is_mock)
+            for piece in self._pieces(tile, prediction):
+                self._merge(piece)
+
+    def _pieces(self, tile, prediction):
+        """
+        Connected pieces of the tile's detections, clipped to its core.
+        """
+        import cv2  # deferred to keep it off the startup path
+        from shapely.ops import unary_union
+
+        detections = filter_detections(prediction, inference.CONFIDENCE_THRESHOLD)
+        union = detections["union_mask"]
+        if not union.any():
+            return []
+        ox, oy = tile.origin
+        height, width = union.shape
+        x0, y0 = max(0, tile.core[0] - ox), max(0, tile.core[1] - oy)
+        x1, y1 = min(width, tile.core[2] - ox), min(height, tile.core[3] - oy)
+        core = np.zeros((height, width), dtype=np.uint8)
+        core[y0:y1, x0:x1] = union[y0:y1, x0:x1]
+
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(core, connectivity=8)
+        boxes, scores = detections["boxes"], detections["scores"]
+        pieces = []
+        for label in range(1, count):
+            x, y, w, h, pixels = (int(v) for v in stats[label])
+            component = (labels[y:y + h, x:x + w] == label).astype(np.uint8)
+            contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            # Confidence of the best detection whose box reaches the piece
+            overlapping = (boxes[:, 0] <= x + w) & (boxes[:, 2] >= x) & (boxes[:, 1] <= y + h) & (boxes[:, 3] >= y)
+            cx, cy = centroids[label][0] + ox, centroids[label][1] + oy
+            # Scale of every pixel row at its own latitude
+            row_lat, _ = world_to_latlon_array(0.0, np.arange(y, y + h) + oy + 0.5, tile.zoom)
+            pieces.append({
+                "geometry": unary_union([pixel_shape(c, x + ox, y + oy) for c in contours]),
+                "bounds": (x + ox, y + oy, x + ox + w - 1, y + oy + h - 1),  # inclusive pixel indices
+                "pixels": pixels,
+                "centroid_sum": (cx * pixels, cy * pixels),
+                "area_m2": float(np.dot(component.sum(axis=1), meters_per_pixel_array(row_lat, tile.zoom) ** 2)),
+                "confidence": float(scores[overlapping].max()) if overlapping.any() else 0.0,
+                "tiles": {(tile.row, tile.col)},
+            })
+        return pieces
+
+    def _merge(self, piece):
+        """
+        Unions the piece with every open piece it touches (8-connected across a seam).
+        """
+        from shapely.ops import unary_union
+
+        bx0, by0, bx1, by1 = piece["bounds"]
+        touching = [other for other in self._open
+                    if other["bounds"][0] <= bx1 + 1 and bx0 <= other["bounds"][2] + 1
+                    and other["bounds"][1] <= by1 + 1 and by0 <= other["bounds"][3] + 1
+                    and other["geometry"].distance(piece["geometry"]) < 0.5]
+        if not touching:
+            self._open.append(piece)
+            return
+        group = touching + [piece]
+        merged = {
+            "geometry": unary_union([p["geometry"] for p in group]),
+            "bounds": (min(p["bounds"][0] for p in group), min(p["bounds"][1] for p in group),
+                       max(p["bounds"][2] for p in group), max(p["bounds"][3] for p in group)),
+            "pixels": sum(p["pixels"] for p in group),
+            "centroid_sum": (sum(p["centroid_sum"][0] for p in group), sum(p["centroid_sum"][1] for p in group)),
+            "area_m2": sum(p["area_m2"] for p in group),
+            "confidence": max(p["confidence"] for p in group),
+            "tiles": set().union(*(p["tiles"] for p in group)),
+        }
+        self._open = [p for p in self._open if not any(p is t for t in touching)]
+        self._open.append(merged)
+
+    def _finalize(self, before_row):
+        """
+        Yields the open pieces that can't touch world pixel row before_row or anything
+        below it (all of them when None).
+        """
+        from shapely.geometry import Point
+
+        done = [p for p in self._open if before_row is None or p["bounds"][3] < before_row - 1]
+        if not done:
+            return
+        self._open = [p for p in self._open if not any(p is d for d in done)]
+        for piece in done:
+            cx, cy = (v / piece["pixels"] + 0.5 for v in piece["centroid_sum"])
+            if not self._world_region.contains(Point(cx, cy)):
+                continue
+            lat, lon = world_to_latlon(cx, cy, self.zoom)
+            self.stats["panels"] += 1
+            self.stats["total_area_m2"] += piece["area_m2"]
+            yield {
+                "panel_id": self.stats["panels"],
+                "latitude": round(lat, 7),
+                "longitude": round(lon, 7),
+                "area_m2": round(piece["area_m2"], 2),
+                "confidence": round(piece["confidence"], 2),
+                "tiles": len(piece["tiles"]),
+                "geometry": world_to_geojson(piece["geometry"].simplify(0.5), self.zoom),
+            }
+
+def _load_polygon(path: str):
+    """
+    Outer ring of the first polygon in a GeoJSON file (geometry, Feature or FeatureCollection).
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        data = data["features"][0]
+    if data.get("type") == "Feature":
+        data = data["geometry"]
+    if data.get("type") == "MultiPolygon":
+        return data["coordinates"][0][0]
+    if data.get("type") != "Polygon":
+        raise ValueError(f"{path}: expected a GeoJSON Polygon, got {data.get('type')}")
+    return data["coordinates"][0]
+
+def main():
+    import torch
+    from engines import create_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    region = parser.add_mutually_exclusive_group(required=True)
+    region.add_argument("--bbox", type=float, nargs=4, metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"))
+    region.add_argument("--polygon", help="GeoJSON file with the region polygon")
+    parser.add_argument("--output", required=True, help="NDJSON file: one panel per line, then a summary line")
+    parser.add_argument("--zoom", type=int, default=REGION_SCAN_ZOOM)
+    parser.add_argument("--overlap", type=int, default=REGION_SCAN_OVERLAP)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), "models", "antigravity_model.pt")))
+    args = parser.parse_args()
+
+    try:
+        shape = region_polygon(bbox=args.bbox, polygon=_load_polygon(args.polygon) if args.polygon else None)
+    except ValueError as e:
+        parser.error(str(e))
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    scan = RegionScan(create_engine(args.model, device), shape, device, zoom=args.zoom,
+                      overlap=args.overlap, batch_size=args.batch_size)
+    with open(args.output, "w") as f:
+        for line in scan.ndjson():
+            f.write(line)
+            f.flush()
+    print(json.dumps(scan.summary(), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import metrics
+
+# Configuration
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(os.path.dirname(__file__), "results.db"))
+RESULT_CACHE_TTL_HOURS = float(os.getenv("RESULT_CACHE_TTL_HOURS", "168"))  # 7 days, 0 disables expiry
+RESULT_CACHE_PRECISION = int(os.getenv("RESULT_CACHE_PRECISION", "5"))      # decimals kept from lat/lon (5 ~= 1.1 m)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    lat TEXT NOT NULL,
+    lon TEXT NOT NULL,
+    buffer_sqft INTEGER NOT NULL,
+    model_version TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (lat, lon, buffer_sqft, model_version)
+);
+"""
+
+# Per-request fields that don't belong to the stored verdict
+_REQUEST_FIELDS = ("user_id", "timings_ms", "cached")
+
+def model_fingerprint(model_path: str) -> str:
+    """
+    Short hash of the model file in use (path, size, mtime) and of every setting that
+    changes verdicts. A new checkpoint or setting gives a new fingerprint, so results
+    stored for the old one are never served.
+    """
+    import inference
+    import batch_planner
+    import mask_encoding
+    import model_loader
+    from engines import INFERENCE_ENGINE, ONNX_MODEL_PATH
+
+    path = ONNX_MODEL_PATH if INFERENCE_ENGINE == "onnx" else model_path
+    stat = os.stat(path) if os.path.exists(path) else None
+    source = {
+        "model": os.path.abspath(path),
+        "size": stat.st_size if stat else None,
+        "mtime": stat.st_mtime_ns if stat else None,
+        "engine": INFERENCE_ENGINE,
+        "variant": model_loader.MODEL_VARIANT,
+        "resolution": [model_loader.INFERENCE_MIN_SIZE, model_loader.INFERENCE_MAX_SIZE],
+        "confidence": inference.CONFIDENCE_THRESHOLD,
+        "single_fetch": inference.SINGLE_FETCH_BUFFERS,
+        "screen": [inference.SCREEN_ENABLED, inference.SCREEN_SIZE, inference.SCREEN_NEGATIVE_THRESHOLD],
+        "mask_encoding": [inference.MASK_ENCODING, mask_encoding.MASK_SIMPLIFY_TOLERANCE],
+        # Shared tiles are centered elsewhere and count only each location's footprint
+        "planner": [batch_planner.BATCH_PLANNER_ENABLED, batch_planner.PLANNER_EDGE_MARGIN],
+    }
+    return hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()[:16]
+
+class ResultCache:
+    """
+    SQLite store of finished verdicts keyed by (snapped lat, snapped lon, requested buffer,
+    model fingerprint), so repeating a query skips fetch, model and post-processing.
+    - Entries older than the TTL are dropped on read.
+    - Opening the store with a new fingerprint deletes everything stored for older ones.
+    - Mock-tile results, errors and deferred locations are never stored.
+    """
+    def __init__(self, model_version: str, path: str = RESULT_CACHE_PATH,
+                 ttl_seconds: float = RESULT_CACHE_TTL_HOURS * 3600, precision: int = RESULT_CACHE_PRECISION):
+        self.model_version = model_version
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.precision = precision
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "invalidated": 0}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            removed = conn.execute("DELETE FROM results WHERE model_version != ?", (model_version,)).rowcount
+        if removed:
+            print(f"Result cache: dropped {removed} results of previous models")
+            self.counters["invalidated"] = removed
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self, lat: float, lon: float, buffer_sqft: int):
+        return f"{lat:.{self.precision}f}", f"{lon:.{self.precision}f}", int(buffer_sqft), self.model_version
+
+    def get(self, lat: float, lon: float, buffer_sqft: int):
+        return self.get_many([(lat, lon)], buffer_sqft)[0]
+
+    def get_many(self, points, buffer_sqft: int):
+        """
+        Stored results for a list of (lat, lon), None where there is none (or it expired).
+        Hits come back with "cached": true and their original timestamp.
+        """
+        found = []
+        expired = []
+        now = time.time()
+        with self._connect() as conn:
+            for lat, lon in points:
+                key = self._key(lat, lon, buffer_sqft)
+                row = conn.execute(
+                    "SELECT result, created_at FROM results WHERE lat = ? AND lon = ? AND buffer_sqft = ? AND model_version = ?",
+                    key,
+                ).fetchone()
+                if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                    expired.append(key)
+                    row = None
+                found.append(None if row is None else dict(json.loads(row[0]), cached=True))
+            if expired:
+                with self._lock:
+                    conn.executemany(
+                        "DELETE FROM results WHERE lat = ? AND lon = ? AND buffer_sqft = ? AND model_version = ?", expired)
+
+        hits = sum(r is not None for r in found)
+        with self._lock:
+            self.counters["hits"] += hits
+            self.counters["misses"] += len(found) - hits
+            self.counters["expired"] += len(expired)
+        metrics.RESULT_CACHE_LOOKUPS.inc(hits, result="hit")
+        metrics.RESULT_CACHE_LOOKUPS.inc(len(found) - hits, result="miss")
+        return found
+
+    def put(self, lat: float, lon: float, buffer_sqft: int, result: dict):
+        self.put_many([(lat, lon, result)], buffer_sqft)
+
+    def put_many(self, entries, buffer_sqft: int):
+        """
+        Stores (lat, lon, result) entries, skipping errors, deferred and mock-tile results.
+        """
+        rows = []
+        now = time.time()
+        for lat, lon, result in entries:
+            if result is None or "error" in result or result.get("is_mock_data") or result.get("status") == "deferred":
+                continue
+            verdict = {k: v for k, v in result.items() if k not in _REQUEST_FIELDS}
+            rows.append(self._key(lat, lon, buffer_sqft) + (json.dumps(verdict), now))
+        if not rows:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.counters["stored"] += len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "model_version": self.model_version,
+        }
@@ -0,0 +1,423 @@
+import os
+import time
+import queue
+import threading
+import itertools
+import multiprocessing as mp
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+import torch
+from PIL import Image
+
+import metrics
+
+# Configuration
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_MAX_BATCH = int(os.getenv("SCHEDULER_MAX_BATCH", "8"))
+SCHEDULER_MAX_WAIT_MS = float(os.getenv("SCHEDULER_MAX_WAIT_MS", "10"))
+SCHEDULER_QUEUE_SIZE = int(os.getenv("SCHEDULER_QUEUE_SIZE", "64"))
+# 0 = run coalesced batches in this process on the app's engine; N > 0 = N model worker processes
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "0"))
+# torch intra-op threads per model worker (0 = split the machine's cores between workers)
+SCHEDULER_THREADS_PER_WORKER = int(os.getenv("SCHEDULER_THREADS_PER_WORKER", "0"))
+# Seconds a request waits for its batch before giving up (0 = no limit)
+SCHEDULER_RESULT_TIMEOUT = float(os.getenv("SCHEDULER_RESULT_TIMEOUT", "300"))
+# How often worker processes are checked for crashes
+SCHEDULER_WATCHDOG_INTERVAL = float(os.getenv("SCHEDULER_WATCHDOG_INTERVAL", "1.0"))
+# Seconds to wait for every worker's model to load at startup
+SCHEDULER_START_TIMEOUT = float(os.getenv("SCHEDULER_START_TIMEOUT", "600"))
+# A worker that dies this many times in a row before loading its model is not restarted again;
+# restarts in between wait SCHEDULER_RESTART_BACKOFF seconds, doubling each time (up to 60 s)
+SCHEDULER_MAX_RESTARTS = int(os.getenv("SCHEDULER_MAX_RESTARTS", "5"))
+SCHEDULER_RESTART_BACKOFF = float(os.getenv("SCHEDULER_RESTART_BACKOFF", "2"))
+
+MASK_THRESHOLD = 0.5
+
+class QueueFullError(Exception):
+    """
+    Raised when the scheduler queue is full; the API turns this into a 429.
+    """
+
+class InferenceScheduler:
+    """
+    Dynamic batching in front of the model.
+
+    Every image submitted through predict() becomes one queue item. A dispatcher thread
+    takes the first waiting item, keeps collecting until SCHEDULER_MAX_BATCH items or
+    SCHEDULER_MAX_WAIT_MS have passed, and runs the whole group as one forward pass,
+    either in-process (engine) or on one of the model worker processes, each pinned
+    to its own torch.set_num_threads so concurrent requests don't oversubscribe cores.
+    A worker process that dies fails the batch it was running and is restarted.
+    """
+    def __init__(self, engine=None, model_path: str = None, device=None, workers: int = SCHEDULER_WORKERS,
+                 max_batch: int = SCHEDULER_MAX_BATCH, max_wait_ms: float = SCHEDULER_MAX_WAIT_MS,
+                 queue_size: int = SCHEDULER_QUEUE_SIZE, threads_per_worker: int = SCHEDULER_THREADS_PER_WORKER,
+                 result_timeout: float = SCHEDULER_RESULT_TIMEOUT):
+        if workers == 0 and engine is None:
+            raise ValueError("In-process scheduling needs an engine")
+        self.engine = engine
+        self.model_path = model_path
+        self.device = device or torch.device("cpu")
+        self.workers = workers
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.result_timeout = result_timeout or None
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, workers))
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._processes = []     # worker index -> process, process mode only
+        self._task_queues = []   # worker index -> its task queue
+        self._batch_ids = itertools.count()
+        self._in_flight = {}     # batch_id -> (worker index, futures)
+        self._idle_workers = set()
+        self._worker_idle = threading.Condition(self._lock)
+        self._ready = [False] * workers         # worker index -> model loaded
+        self._load_failures = [0] * workers     # deaths in a row before loading the model
+        self._restart_at = [None] * workers     # worker index -> when to restart it after a death
+        self._given_up = set()                  # workers no longer restarted
+        self.healthy = True
+
+        self.metrics = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "batch_sizes": {},       # batch size -> count
+            "queue_wait_seconds": 0.0,
+            "worker_restarts": 0,
+        }
+
+    # Lifecycle
+
+    def start(self):
+        if self.workers == 0 and SCHEDULER_THREADS_PER_WORKER:
+            torch.set_num_threads(SCHEDULER_THREADS_PER_WORKER)
+        if self.workers > 0:
+            self._ctx = mp.get_context("spawn")
+            self._results = self._ctx.Queue()
+            for n in range(self.workers):
+                self._processes.append(None)
+                self._task_queues.append(None)
+                self._start_worker(n)
+            deadline = time.perf_counter() + SCHEDULER_START_TIMEOUT
+            while len(self._idle_workers) < self.workers:
+                try:
+                    kind, n, error, _ = self._results.get(timeout=1.0)
+                except queue.Empty:
+                    # A worker killed while loading (e.g. out of memory) never reports back
+                    dead = [n for n, p in enumerate(self._processes) if not self._ready[n] and not p.is_alive()]
+                    if dead or time.perf_counter() > deadline:
+                        self._terminate_workers()
+                        reason = (f"exited with code {self._processes[dead[0]].exitcode}" if dead
+                                  else f"not ready after {SCHEDULER_START_TIMEOUT:g}s")
+                        raise RuntimeError(f"Model worker failed to start: {reason}")
+                    continue
+                if kind != "ready":
+                    self._terminate_workers()
+                    raise RuntimeError(f"Model worker failed to start: {error}")
+                self._ready[n] = True
+                self._idle_workers.add(n)
+            print(f"Started {self.workers} model workers with {self.threads_per_worker} torch threads each")
+            self._spawn_thread(self._collect_results, "scheduler-results")
+            self._spawn_thread(self._watch_workers, "scheduler-watchdog")
+        self._spawn_thread(self._dispatch_loop, "scheduler-dispatch")
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        with self._lock:
+            self._worker_idle.notify_all()
+        for tasks in self._task_queues:
+            tasks.put(None)
+        for p in self._processes:
+            p.join(timeout=10)
+        if self._processes:
+            self._results.put(("stop", None, None, None))
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def _terminate_workers(self):
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()
+            p.join(timeout=5)
+
+    def _spawn_thread(self, target, name):
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _start_worker(self, n: int):
+        # Each worker gets its own task queue, so a batch is always known to be on one worker
+        tasks = self._ctx.Queue()
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(n, self.model_path, str(self.device), self.threads_per_worker, tasks, self._results),
+            name=f"model-worker-{n}",
+            daemon=True,
+        )
+        p.start()
+        self._processes[n] = p
+        self._task_queues[n] = tasks
+
+    # Client API
+
+    def view(self, block: bool):
+        """
+        Engine-compatible facade. Interactive callers use block=False (429 when full),
+        bulk callers block=True (wait for room in the queue).
+        """
+        return SchedulerView(self, block)
+
+    def predict(self, images, block: bool = False):
+        futures = []
+        enqueued_at = time.perf_counter()
+        for image in images:
+            future = Future()
+            try:
+                self._queue.put((image, future, enqueued_at), block=block)
+            except queue.Full:
+                with self._lock:
+                    self.metrics["rejected"] += 1
+                for f in futures:
+                    f.cancel()
+                raise QueueFullError("Inference queue is full, retry later")
+            futures.append(future)
+        with self._lock:
+            self.metrics["requests"] += len(images)
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self._queue.qsize())
+        try:
+            outputs = [f.result(timeout=self.result_timeout) for f in futures]
+        except FutureTimeoutError:
+            # Batches not started yet are dropped by the dispatcher
+            for f in futures:
+                f.cancel()
+            raise RuntimeError(f"Inference timed out after {self.result_timeout:g}s") from None
+
+        # The batch ran on another thread (or process): copy its stage timings into the caller's trace
+        batch_timings = {id(f.timings): f.timings for f in futures if getattr(f, "timings", None)}
+        for timings in batch_timings.values():
+            for stage, seconds in timings.items():
+                metrics.record(stage, seconds, observe=False)
+        return outputs
+
+    def screen(self, images, size: int):
+        # Screening passes are small: in-process (workers == 0) they go straight to the engine,
+        # bypassing the queue; worker processes have no screening pass
+        if self.engine is None:
+            return None
+        return self.engine.screen(images, size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics["batch_sizes"] = dict(sorted(self.metrics["batch_sizes"].items()))
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["avg_batch_size"] = round(metrics["requests"] / metrics["batches"], 2) if metrics["batches"] else 0.0
+        metrics["avg_queue_wait_ms"] = round(
+            1000 * metrics.pop("queue_wait_seconds") / metrics["requests"], 2) if metrics["requests"] else 0.0
+        metrics["workers"] = self.workers
+        metrics["workers_given_up"] = len(self._given_up)
+        metrics["healthy"] = self.healthy
+        return metrics
+
+    # Dispatcher
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = max(0.0, deadline - time.perf_counter())
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            # Marking the futures running means a caller can no longer cancel them under us
+            batch = [item for item in self._next_batch() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            now = time.perf_counter()
+            with self._lock:
+                self.metrics["batches"] += 1
+                self.metrics["batch_sizes"][len(batch)] = self.metrics["batch_sizes"].get(len(batch), 0) + 1
+                self.metrics["queue_wait_seconds"] += sum(now - enqueued_at for _, _, enqueued_at in batch)
+            for _, future, enqueued_at in batch:
+                metrics.STAGE_SECONDS.observe(now - enqueued_at, stage="queue")
+                future.timings = {"queue": now - enqueued_at}
+
+            images = [image for image, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+            if self.workers == 0:
+                try:
+                    with metrics.trace() as timings:
+                        outputs = self.engine.predict(images)
+                except Exception as e:
+                    for f in futures:
+                        f.set_exception(e)
+                    continue
+                for f, output in zip(futures, outputs):
+                    f.timings.update(timings)
+                    f.set_result(output)
+            else:
+                # Only hand out as many batches as there are idle workers, so requests keep
+                # coalescing in our queue instead of piling up in the process queue
+                arrays = [np.asarray(img) for img in images]
+                batch_id = next(self._batch_ids)
+                with self._lock:
+                    while not self._idle_workers and not self._stopping.is_set() and self.healthy:
+                        self._worker_idle.wait(0.5)
+                    if not self._idle_workers:
+                        reason = "Scheduler stopped" if self._stopping.is_set() else "No model workers available"
+                        for f in futures:
+                            f.set_exception(RuntimeError(reason))
+                        if self._stopping.is_set():
+                            break
+                        continue
+                    n = self._idle_workers.pop()
+                    self._in_flight[batch_id] = (n, futures)
+                    self._task_queues[n].put((batch_id, arrays))
+
+    def _collect_results(self):
+        while True:
+            batch_id, outputs, error, timings = self._results.get()
+            if batch_id == "stop":
+                break
+            if batch_id in ("ready", "error"):
+                # A restarted worker: outputs carries its index
+                if batch_id == "ready":
+                    with self._lock:
+                        self._ready[outputs] = True
+                        self._idle_workers.add(outputs)
+                        self._worker_idle.notify()
+                else:
+                    print(f"Model worker {outputs} failed to restart: {error}")
+                continue
+            with self._lock:
+                n, futures = self._in_flight.pop(batch_id, (None, []))
+                if n is not None:
+                    self._idle_workers.add(n)
+                    self._worker_idle.notify()
+            # Stage histograms of the worker processes are reported from here
+            for stage, seconds in (timings or {}).items():
+                metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+            if error is not None:
+                for f in futures:
+                    f.set_exception(RuntimeError(error))
+                continue
+            for f, output in zip(futures, outputs):
+                f.timings.update(timings)
+                f.set_result(_unpack_output(output))
+
+    def _watch_workers(self):
+        """
+        Fails the batch of a crashed worker process (killed, out of memory) and starts a new one
+        in its place, so its requests don't hang and the pool keeps its size.
+        A worker that keeps dying before its model loads is restarted with exponential backoff
+        and given up after SCHEDULER_MAX_RESTARTS; with every worker given up the scheduler
+        is unhealthy and fails requests instead of queueing them.
+        """
+        while not self._stopping.wait(SCHEDULER_WATCHDOG_INTERVAL):
+            for n, p in enumerate(self._processes):
+                if n in self._given_up or p.is_alive():
+                    continue
+                futures = []
+                with self._lock:
+                    if self._stopping.is_set():
+                        return
+                    if self._restart_at[n] is None:
+                        # First look at this death
+                        self._idle_workers.discard(n)
+                        lost = [batch_id for batch_id, (worker, _) in self._in_flight.items() if worker == n]
+                        futures = [f for batch_id in lost for f in self._in_flight.pop(batch_id)[1]]
+                        self._load_failures[n] = 0 if self._ready[n] else self._load_failures[n] + 1
+                        self._ready[n] = False
+                        failures = self._load_failures[n]
+                        if failures >= SCHEDULER_MAX_RESTARTS:
+                            self._given_up.add(n)
+                            if len(self._given_up) == self.workers:
+                                self.healthy = False
+                                self._worker_idle.notify_all()
+                            print(f"Model worker {n} failed to load its model {failures} times in a row, not restarting it")
+                        else:
+                            delay = min(60.0, SCHEDULER_RESTART_BACKOFF * 2 ** (failures - 1)) if failures else 0.0
+                            self._restart_at[n] = time.monotonic() + delay
+                            print(f"Model worker {n} exited with code {p.exitcode}; failed {len(futures)} requests, "
+                                  f"restarting it in {delay:g}s")
+                    if self._restart_at[n] is not None and time.monotonic() >= self._restart_at[n]:
+                        self._restart_at[n] = None
+                        self.metrics["worker_restarts"] += 1
+                        # Joins the dead process and replaces its task queue
+                        p.join(timeout=1)
+                        self._start_worker(n)
+                for f in futures:
+                    f.set_exception(RuntimeError(f"Model worker exited with code {p.exitcode}"))
+
+class SchedulerView:
+    def __init__(self, scheduler: InferenceScheduler, block: bool):
+        self.scheduler = scheduler
+        self.block = block
+
+    def predict(self, images):
+        return self.scheduler.predict(images, block=self.block)
+
+    def screen(self, images, size: int):
+        # Forwarded, so SCREEN_ENABLED works behind the default in-process scheduler
+        return self.scheduler.screen(images, size)
+
+def _pack_output(output):
+    """
+    Masks are binarized and bit-packed before crossing the process boundary:
+    100 float masks of 640x640 would otherwise be ~160 MB per image.
+    """
+    masks = np.asarray(output["masks"].cpu() if torch.is_tensor(output["masks"]) else output["masks"])
+    return {
+        "boxes": np.asarray(output["boxes"].cpu() if torch.is_tensor(output["boxes"]) else output["boxes"]),
+        "labels": np.asarray(output["labels"].cpu() if torch.is_tensor(output["labels"]) else output["labels"]),
+        "scores": np.asarray(output["scores"].cpu() if torch.is_tensor(output["scores"]) else output["scores"]),
+        "mask_shape": masks.shape,
+        "masks_packed": np.packbits(masks > MASK_THRESHOLD),
+    }
+
+def _unpack_output(packed):
+    shape = packed["mask_shape"]
+    masks = np.unpackbits(packed["masks_packed"], count=int(np.prod(shape))).reshape(shape).astype(np.float32)
+    return {"boxes": packed["boxes"], "labels": packed["labels"], "scores": packed["scores"], "masks": masks}
+
+def _worker_main(n, model_path, device, num_threads, tasks, results):
+    """
+    Model worker process: loads its own engine with pinned torch threads and serves batches.
+    """
+    torch.set_num_threads(num_threads)
+    try:
+        from engines import create_engine, warm_up
+        engine = create_engine(model_path, torch.device(device))
+        warm_up(engine)
+    except Exception as e:
+        results.put(("error", n, str(e), None))
+        return
+    results.put(("ready", n, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_id, arrays = task
+        try:
+            with metrics.trace() as timings:
+                outputs = engine.predict([Image.fromarray(a) for a in arrays])
+            results.put((batch_id, [_pack_output(o) for o in outputs], None, timings))
+        except Exception as e:
+            results.put((batch_id, None, str(e), None))
@@ -1,15 +1,22 @@
 import math
-from shapely.geometry import Point, box, Polygon
 from typing import Tuple
 
+import numpy as np
+
+EARTH_CIRCUMFERENCE = 40075017.0  # In meters
+SQFT_TO_SQM = 0.092903
+METERS_PER_DEGREE = 111000.0     # Approximation used for buffer boxes
+MAX_ZOOM = 20                     # Closest Static Maps zoom used for buffers
+# Largest buffer judged at zoom 20 in a 640 px tile; scales with the tile's area
+ZOOM_20_MAX_SQFT = 1500
+
 def get_meters_per_pixel(lat: float, zoom: int) -> float:
     """
     Calculate meters per pixel at a given latitude and zoom level.
     Based on Web Mercator projection.
     """
-    earth_circumference = 40075017.0  # In meters
     latitude_radians = math.radians(lat)
-    return earth_circumference * math.cos(latitude_radians) / (2 ** (zoom + 8))
+    return EARTH_CIRCUMFERENCE * math.cos(latitude_radians) / (2 ** (zoom + 8))
 
 def get_bounding_box_for_area(lat: float, lon: float, area_sqft: int) -> Tuple[float, float, float, float]:
     """
@@ -19,14 +26,14 @@ def get_bounding_box_for_area(lat: float, lon: float, area_sqft: int) -> Tuple[f
     1200 sq ft is approx 111.48 sq meters.
     Side length = sqrt(111.48) = 10.55 meters.
     """
-    area_sq_meters = area_sqft * 0.092903
+    area_sq_meters = area_sqft * SQFT_TO_SQM
     side_length_meters = math.sqrt(area_sq_meters)
     
     # Approximation: 1 degree latitude ~= 111,000 meters
     # 1 degree longitude ~= 111,000 * cos(lat) meters
     
-    delta_lat = (side_length_meters / 2) / 111000.0
-    delta_lon = (side_length_meters / 2) / (111000.0 * math.cos(math.radians(lat)))
+    delta_lat = (side_length_meters / 2) / METERS_PER_DEGREE
+    delta_lon = (side_length_meters / 2) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
     
     return (lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat)
 
@@ -35,7 +42,146 @@ def get_zoom_level_for_box(lat: float, area_sqft: int, image_size: int = 640) ->
     Determine appropriate zoom level to fit the specialized area into the image size.
     We want the area to occupy a significant portion of the image but not all of it.
     """
-    # Simply mapping common areas to good zoom levels for 640x640 images
-    if area_sqft <= 1500:
+    # Simply mapping common areas to good zoom levels (1200 sqft -> 20, 2400 sqft -> 19 for 640x640 images)
+    if area_sqft <= ZOOM_20_MAX_SQFT * (image_size / 640) ** 2:
         return 20 # Very zoomed in
     return 19
+
+def latlon_to_world(lat: float, lon: float, zoom: int) -> Tuple[float, float]:
+    """
+    Web Mercator world pixel coordinates (256 px world tile at zoom 0) of (lat, lon).
+    """
+    world_size = 256 * (2 ** zoom)
+    x = (lon + 180.0) / 360.0 * world_size
+    siny = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * world_size
+    return x, y
+
+def world_to_latlon(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    """
+    Inverse of latlon_to_world.
+    """
+    world_size = 256 * (2 ** zoom)
+    lon = x / world_size * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / world_size))))
+    return lat, lon
+
+def latlon_to_pixel(lat: float, lon: float, center_lat: float, center_lon: float, zoom: int, image_size: int = 640) -> Tuple[float, float]:
+    """
+    Projects (lat, lon) to (x, y) pixel coordinates inside a Static Maps tile
+    of image_size pixels centered at (center_lat, center_lon).
+    """
+    x, y = latlon_to_world(lat, lon, zoom)
+    cx, cy = latlon_to_world(center_lat, center_lon, zoom)
+    return x - cx + image_size / 2, y - cy + image_size / 2
+
+def get_buffer_footprint_pixels(lat: float, lon: float, area_sqft: int, zoom: int, image_size: int = 640,
+                                center: Tuple[float, float] = None) -> Tuple[int, int, int, int]:
+    """
+    Pixel rectangle (x_min, y_min, x_max, y_max) covered by the get_bounding_box_for_area
+    buffer of (lat, lon) in a tile centered at center (default: (lat, lon) itself).
+    Clipped to the image.
+    """
+    center_lat, center_lon = center or (lat, lon)
+    min_lon, min_lat, max_lon, max_lat = get_bounding_box_for_area(lat, lon, area_sqft)
+    x0, y0 = latlon_to_pixel(max_lat, min_lon, center_lat, center_lon, zoom, image_size)
+    x1, y1 = latlon_to_pixel(min_lat, max_lon, center_lat, center_lon, zoom, image_size)
+    clip = lambda v: int(min(max(v, 0), image_size))
+    return clip(math.floor(x0)), clip(math.floor(y0)), clip(math.ceil(x1)), clip(math.ceil(y1))
+
+# Vectorized versions for bulk work: NumPy arrays (or scalars, broadcast) in, arrays out.
+# Same formulas as the scalar functions above; benchmarks/bench_geo_utils.py checks them against each other.
+
+def meters_per_pixel_array(lat, zoom):
+    return EARTH_CIRCUMFERENCE * np.cos(np.radians(lat)) / np.exp2(np.asarray(zoom, dtype=np.float64) + 8)
+
+def latlon_to_world_array(lat, lon, zoom):
+    """
+    Vectorized latlon_to_world: returns (x, y) arrays.
+    """
+    world_size = 256.0 * np.exp2(np.asarray(zoom, dtype=np.float64))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * world_size
+    siny = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + siny) / (1 - siny)) / (4 * np.pi)) * world_size
+    return x, y
+
+def world_to_latlon_array(x, y, zoom):
+    """
+    Vectorized world_to_latlon: returns (lat, lon) arrays.
+    """
+    world_size = 256.0 * np.exp2(np.asarray(zoom, dtype=np.float64))
+    lon = np.asarray(x, dtype=np.float64) / world_size * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype=np.float64) / world_size))))
+    return lat, lon
+
+def latlon_to_pixel_array(lat, lon, center_lat, center_lon, zoom, image_size: int = 640):
+    """
+    Vectorized latlon_to_pixel: (x, y) of points in tiles centered at (center_lat, center_lon).
+    """
+    x, y = latlon_to_world_array(lat, lon, zoom)
+    cx, cy = latlon_to_world_array(center_lat, center_lon, zoom)
+    return x - cx + image_size / 2, y - cy + image_size / 2
+
+def pixel_to_latlon_array(x, y, center_lat, center_lon, zoom, image_size: int = 640):
+    """
+    Inverse of latlon_to_pixel_array: (lat, lon) of tile pixel coordinates.
+    """
+    cx, cy = latlon_to_world_array(center_lat, center_lon, zoom)
+    return world_to_latlon_array(np.asarray(x) + cx - image_size / 2, np.asarray(y) + cy - image_size / 2, zoom)
+
+def row_meters_per_pixel(center_lat: float, zoom: int, height: int = 640) -> np.ndarray:
+    """
+    Meters per pixel at the middle of every pixel row of a tile centered at center_lat.
+    """
+    _, cy = latlon_to_world_array(center_lat, 0.0, zoom)
+    lat, _ = world_to_latlon_array(0.0, cy - height / 2 + np.arange(height) + 0.5, zoom)
+    return meters_per_pixel_array(lat, zoom)
+
+def mask_area_m2(mask: np.ndarray, center_lat: float, zoom: int) -> float:
+    """
+    Ground area of an HxW mask in a tile centered at center_lat, using each pixel row's
+    own scale instead of the center's.
+    """
+    mask = np.asarray(mask)
+    return float(np.dot(mask.sum(axis=1), row_meters_per_pixel(center_lat, zoom, mask.shape[0]) ** 2))
+
+def bounding_boxes_for_area(lat, lon, area_sqft):
+    """
+    Vectorized get_bounding_box_for_area: (min_lon, min_lat, max_lon, max_lat) arrays.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    half_side = np.sqrt(np.asarray(area_sqft, dtype=np.float64) * SQFT_TO_SQM) / 2
+    delta_lat = half_side / METERS_PER_DEGREE
+    delta_lon = half_side / (METERS_PER_DEGREE * np.cos(np.radians(lat)))
+    return lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat
+
+def zoom_levels_for_boxes(lat, area_sqft, image_size: int = 640) -> np.ndarray:
+    """
+    Highest zoom level (at most MAX_ZOOM) at which each buffer box side, at its own
+    latitude's scale, fits in image_size (int array, shaped like lat and area_sqft broadcast).
+    For areas and scans of any size; tiles for the 1200/2400 sqft buffers keep using
+    get_zoom_level_for_box.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    side = np.sqrt(np.asarray(area_sqft, dtype=np.float64) * SQFT_TO_SQM)
+    zoom = np.full(np.broadcast(lat, side).shape, MAX_ZOOM, dtype=np.int64)
+    # One zoom level out per step for the boxes that don't fit yet
+    for _ in range(MAX_ZOOM):
+        too_big = (side / meters_per_pixel_array(lat, zoom) > image_size) & (zoom > 0)
+        if not too_big.any():
+            break
+        zoom -= too_big
+    return zoom
+
+def buffer_footprints_pixels(lat, lon, area_sqft, zoom, image_size: int = 640, center_lat=None, center_lon=None):
+    """
+    Vectorized get_buffer_footprint_pixels: (N, 4) int64 array of (x_min, y_min, x_max, y_max)
+    pixel rectangles, each in the tile centered at its center (default: its own point).
+    """
+    center_lat = lat if center_lat is None else center_lat
+    center_lon = lon if center_lon is None else center_lon
+    min_lon, min_lat, max_lon, max_lat = bounding_boxes_for_area(lat, lon, area_sqft)
+    x0, y0 = latlon_to_pixel_array(max_lat, min_lon, center_lat, center_lon, zoom, image_size)
+    x1, y1 = latlon_to_pixel_array(min_lat, max_lon, center_lat, center_lon, zoom, image_size)
+    return np.clip(np.stack([np.floor(x0), np.floor(y0), np.ceil(x1), np.ceil(y1)], axis=-1), 0, image_size).astype(np.int64)
@@ -1,31 +1,134 @@
 import os
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 from PIL import Image, ImageDraw
 import random
 
+import metrics
+from utils.tile_cache import get_tile_cache
+from utils.imagery_scheduler import INTERACTIVE, get_imagery_scheduler
+
 GOOGLE_API_KEY = os.getenv("SOLAR_API_KEY")
+# Point this at a local stand-in server (see benchmarks/tile_server.py) for offline testing
+STATIC_MAPS_URL = os.getenv("STATIC_MAPS_URL", "https://maps.googleapis.com/maps/api/staticmap")
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "10"))      # seconds, per request
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))         # extra attempts after the first
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "0.5"))     # seconds, doubled on every retry
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8")) # pooled connections / fetch workers
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Shared HTTP session so tile requests reuse pooled keep-alive connections.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=FETCH_CONCURRENCY, pool_maxsize=FETCH_CONCURRENCY)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
 
-def fetch_satellite_image(lat: float, lon: float, zoom: int = 20, size: str = "640x640") -> Image.Image:
+def fetch_satellite_image(lat: float, lon: float, zoom: int = 20, size: str = "640x640",
+                          lane: str = INTERACTIVE) -> Image.Image:
     """
     Fetches a satellite image from Google Static Maps API.
     Falls back to a generated placeholder if API key is missing or request fails.
+    Requests go through the imagery scheduler (see utils/imagery_scheduler.py) in the given
+    lane ("interactive" or "bulk"); when its rate limit or budget can't admit them,
+    ImageryDeferred is raised instead of returning a placeholder.
     """
     if GOOGLE_API_KEY:
-        url = f"https://maps.googleapis.com/maps/api/staticmap?center={lat},{lon}&zoom={zoom}&size={size}&maptype=satellite&key={GOOGLE_API_KEY}"
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                print(f"Fetched image for {lat}, {lon}")
-                return Image.open(BytesIO(response.content)).convert("RGB"), False
-            else:
-                print(f"Error fetching image: {response.status_code} - {response.text}")
-        except Exception as e:
-            print(f"Exception fetching image: {e}")
+        cache = get_tile_cache()
+        if cache is not None:
+            # Fetch at the snapped center so the cached tile is exactly what its key describes
+            lat, lon = tile_center(lat, lon)
+            key = cache.key(lat, lon, zoom, size)
+            content = cache.get(key)
+            metrics.TILE_CACHE_LOOKUPS.inc(result="miss" if content is None else "hit")
+            if content is not None:
+                return Image.open(BytesIO(content)).convert("RGB"), False
+
+        def download(flight):
+            content = _fetch_tile_bytes(lat, lon, zoom, size, flight)
+            if content is not None and cache is not None:
+                cache.put(key, content)
+            return content
+
+        # Identical requests already in flight share that download
+        content = get_imagery_scheduler().run((lat, lon, zoom, size), lane, download)
+        if content is not None:
+            print(f"Fetched image for {lat}, {lon}")
+            return Image.open(BytesIO(content)).convert("RGB"), False
     
     print("Using fallback mock image generator.")
     return generate_mock_satellite_image(size), True
 
+def tile_center(lat: float, lon: float):
+    """
+    Center of the tile fetch_satellite_image returns for (lat, lon): snapped to the tile
+    cache grid when the cache is on, so georeferenced output should use this one.
+    """
+    cache = get_tile_cache() if GOOGLE_API_KEY else None
+    return cache.snap(lat, lon) if cache is not None else (lat, lon)
+
+def _fetch_tile_bytes(lat: float, lon: float, zoom: int, size: str, flight):
+    """
+    GETs the tile with a per-request timeout, retrying timeouts, connection errors
+    and 429/5xx responses with exponential backoff. Returns None when all attempts fail.
+    Every attempt is admitted by the imagery scheduler; a 429 holds back all requests for
+    its Retry-After, and raises ImageryDeferred if it is still the answer after the last attempt.
+    """
+    scheduler = get_imagery_scheduler()
+    params = {
+        "center": f"{lat},{lon}",
+        "zoom": zoom,
+        "size": size,
+        "maptype": "satellite",
+        "key": GOOGLE_API_KEY,
+    }
+    for attempt in range(FETCH_RETRIES + 1):
+        response, status = None, None
+        reservation = scheduler.admit(flight)
+        try:
+            response = get_session().get(STATIC_MAPS_URL, params=params, timeout=FETCH_TIMEOUT)
+            status = response.status_code
+        except requests.RequestException as e:
+            print(f"Exception fetching image: {e}")
+        backoff = FETCH_BACKOFF * (2 ** attempt)
+        # 429: the next admit() waits out its Retry-After, along with every other request
+        retry_after = _retry_after(response, backoff) if status == 429 else None
+        scheduler.settle(reservation, status, retry_after)
+        if status == 200:
+            return response.content
+        if status is not None:
+            print(f"Error fetching image: {status} - {response.text[:200]}")
+            if status not in RETRYABLE_STATUS:
+                break
+
+        if status == 429:
+            if attempt == FETCH_RETRIES:
+                raise scheduler.defer("rate_limited", retry_after)
+        elif attempt < FETCH_RETRIES:
+            time.sleep(backoff)
+    metrics.TILE_FETCH_FAILURES.inc()
+    return None
+
+def _retry_after(response, default: float) -> float:
+    # Retry-After in seconds; the HTTP-date form isn't used by the provider
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.replace(".", "", 1).isdigit() else default
+
 def generate_mock_satellite_image(size_str: str) -> Image.Image:
     """
     Generates a 'fake' satellite looking image for testing/judging without API keys.
@@ -0,0 +1,326 @@
+import os
+import math
+import time
+import sqlite3
+import datetime
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+# Configuration
+IMAGERY_QPS = float(os.getenv("IMAGERY_QPS", "50"))                       # provider requests per second, 0 disables the limiter
+IMAGERY_BURST = int(os.getenv("IMAGERY_BURST", "20"))                     # requests that may go out back to back
+IMAGERY_COST_PER_1000 = float(os.getenv("IMAGERY_COST_PER_1000", "2.0"))  # USD per 1000 billed Static Maps requests
+IMAGERY_DAILY_BUDGET = float(os.getenv("IMAGERY_DAILY_BUDGET", "0"))      # USD per UTC day, 0 = no limit
+IMAGERY_MONTHLY_BUDGET = float(os.getenv("IMAGERY_MONTHLY_BUDGET", "0"))  # USD per UTC calendar month, 0 = no limit
+# Bulk work may only spend this share of each budget; the rest is kept for interactive requests
+IMAGERY_BULK_SHARE = float(os.getenv("IMAGERY_BULK_SHARE", "0.9"))
+IMAGERY_INTERACTIVE_WAIT = float(os.getenv("IMAGERY_INTERACTIVE_WAIT", "5"))  # seconds /infer may wait for the rate limiter
+IMAGERY_BULK_WAIT = float(os.getenv("IMAGERY_BULK_WAIT", "120"))              # seconds a batch fetch may wait for it
+IMAGERY_USAGE_DB = os.getenv("IMAGERY_USAGE_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), "imagery_usage.db"))
+
+# Priority lanes: interactive requests (/infer) are always served before bulk ones
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+class ImageryDeferred(Exception):
+    """
+    Raised instead of falling back to a mock tile when the provider quota is used up:
+    reason is rate_limited, daily_budget or monthly_budget, and retry_after the seconds
+    until a new request is likely to be admitted.
+    """
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Imagery request deferred ({reason}), retry in {self.retry_after}s")
+
+    def to_dict(self) -> dict:
+        return {"status": "deferred", "reason": self.reason, "retry_after_s": self.retry_after, "detail": str(self)}
+
+class TokenBucket:
+    """
+    Rate limiter with priority lanes. Tokens refill at `rate` per second up to `burst`;
+    a bulk caller only takes one while no interactive caller is waiting, so interactive
+    requests skip the bulk queue. pause() holds every lane back after a 429 and lowers
+    the rate, which recover() raises again a little per successful request, so the
+    bucket settles just under the provider's actual limit.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = []   # flights waiting for a token; their lane can be raised meanwhile
+
+    def acquire(self, flight, timeout: float) -> float:
+        """
+        Takes a token for flight. Returns 0 once taken, or the expected wait in seconds
+        when it is longer than timeout (nothing is taken then). With rate 0 only pauses apply.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting.append(flight)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._paused_until - now
+                    if self.rate > 0:
+                        # Tokens interactive waiters still need come first
+                        ahead = 0 if flight.lane == INTERACTIVE else \
+                            sum(1 for f in self._waiting if f.lane == INTERACTIVE)
+                        wait = max(wait, (ahead + 1 - self._tokens) / self.rate)
+                    if wait <= 0:
+                        self._tokens -= 1
+                        return 0.0
+                    if now + wait > deadline:
+                        return wait
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(flight)
+                self._cond.notify_all()
+
+    def promote(self, flight):
+        """
+        Moves a waiting flight to the interactive lane (an interactive caller joined it).
+        """
+        with self._cond:
+            flight.lane = INTERACTIVE
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """
+        Sends nothing for the next `seconds`, then restarts from an empty bucket at a lower rate.
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.75)
+            self._cond.notify_all()
+
+    def recover(self):
+        with self._cond:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "qps": round(self.rate, 2),
+                "max_qps": self.max_rate,
+                "burst": self.burst,
+                "tokens": round(max(self._tokens, 0.0), 2),
+                "paused_s": round(max(self._paused_until - now, 0.0), 2),
+                "waiting": {lane: sum(1 for f in self._waiting if f.lane == lane) for lane in LANES},
+            }
+
+    def _refill(self, now):
+        if now > self._paused_until:
+            self._tokens = min(self.burst, self._tokens + (now - max(self._updated, self._paused_until)) * self.rate)
+        self._updated = now
+
+class SpendBudget:
+    """
+    Provider requests per UTC day and month in SQLite, shared by every process using the
+    same file (API server, bulk_score.py, ...). A request reserves its cost before it is
+    sent and is refunded if the provider doesn't bill it (429, 5xx, network error).
+    """
+    def __init__(self, path: str = IMAGERY_USAGE_DB, cost_per_1000: float = IMAGERY_COST_PER_1000,
+                 daily: float = IMAGERY_DAILY_BUDGET, monthly: float = IMAGERY_MONTHLY_BUDGET,
+                 bulk_share: float = IMAGERY_BULK_SHARE):
+        self.path = path
+        self.cost = cost_per_1000 / 1000
+        self.budgets = {"day": daily, "month": monthly}
+        self.bulk_share = bulk_share
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS usage (period TEXT PRIMARY KEY, requests INTEGER NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def reserve(self, lane: str):
+        """
+        Charges one request to the current day and month. Returns the periods charged
+        (for refund), or raises ImageryDeferred when a budget would be exceeded.
+        """
+        periods = _periods()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for scope, (period, ends_in) in periods.items():
+                if self.budgets[scope] <= 0:
+                    continue
+                budget = self.budgets[scope] * (self.bulk_share if lane == BULK else 1.0)
+                row = conn.execute("SELECT requests FROM usage WHERE period = ?", (period,)).fetchone()
+                if ((row[0] if row else 0) + 1) * self.cost > budget + 1e-9:
+                    conn.execute("ROLLBACK")
+                    raise ImageryDeferred("daily_budget" if scope == "day" else "monthly_budget", ends_in)
+            for period, _ in periods.values():
+                conn.execute("INSERT INTO usage VALUES (?, 1) ON CONFLICT(period) DO UPDATE SET requests = requests + 1",
+                             (period,))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return [period for period, _ in periods.values()]
+
+    def refund(self, reservation):
+        with self._connect() as conn:
+            conn.executemany("UPDATE usage SET requests = requests - 1 WHERE period = ?", [(p,) for p in reservation])
+
+    def usage(self) -> dict:
+        periods = _periods()
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT period, requests FROM usage WHERE period IN (?, ?)",
+                                       tuple(p for p, _ in periods.values())).fetchall())
+        report = {}
+        for scope, (period, _) in periods.items():
+            requests = counts.get(period, 0)
+            report[scope] = {
+                "period": period.split(":", 1)[1],
+                "requests": requests,
+                "spend_usd": round(requests * self.cost, 4),
+                "budget_usd": self.budgets[scope] or None,
+            }
+        return report
+
+def _periods():
+    """
+    {"day": ("day:YYYY-MM-DD", seconds left), "month": ("month:YYYY-MM", seconds left)} in UTC.
+    """
+    now = datetime.datetime.utcnow()
+    tomorrow = datetime.datetime(now.year, now.month, now.day) + datetime.timedelta(days=1)
+    next_month = datetime.datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    return {
+        "day": (f"day:{now:%Y-%m-%d}", (tomorrow - now).total_seconds()),
+        "month": (f"month:{now:%Y-%m}", (next_month - now).total_seconds()),
+    }
+
+class _Flight:
+    # One provider download; callers asking for the same tile meanwhile wait on its future
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.future = Future()
+
+class ImageryScheduler:
+    """
+    Gatekeeper for requests to the imagery provider (see utils/image_fetcher.py):
+    - identical requests in flight share one download;
+    - every provider request waits for a token bucket slot, interactive lane first;
+    - every provider request is charged against the daily / monthly budget.
+    A request that can't be admitted within its lane's wait raises ImageryDeferred
+    instead of falling back to a mock tile.
+    """
+    def __init__(self, qps: float = IMAGERY_QPS, burst: int = IMAGERY_BURST, budget: SpendBudget = None,
+                 interactive_wait: float = IMAGERY_INTERACTIVE_WAIT, bulk_wait: float = IMAGERY_BULK_WAIT):
+        self.bucket = TokenBucket(qps, burst)
+        self.budget = budget or SpendBudget()
+        self.waits = {INTERACTIVE: interactive_wait, BULK: bulk_wait}
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.counters = {"requests": {lane: 0 for lane in LANES}, "deduplicated": 0, "throttled": 0, "deferred": 0}
+
+    def run(self, key, lane: str, download):
+        """
+        Returns download(flight) for key, or the outcome of the identical call already
+        in flight. download does the provider requests, each one through admit().
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown imagery lane '{lane}', expected one of {', '.join(LANES)}")
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(lane)
+            else:
+                self.counters["deduplicated"] += 1
+        if not leader:
+            metrics.IMAGERY_DEDUPLICATED.inc()
+            if lane == INTERACTIVE and flight.lane == BULK:
+                self.bucket.promote(flight)
+            return flight.future.result()
+
+        try:
+            result = download(flight)
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def admit(self, flight):
+        """
+        Reserves the budget for one provider request and waits for a rate limiter token.
+        Returns the reservation to pass to settle() with the provider's answer.
+        """
+        try:
+            reservation = self.budget.reserve(flight.lane)
+        except ImageryDeferred as e:
+            self._count_deferred(e)
+            raise
+        wait = self.bucket.acquire(flight, self.waits[flight.lane])
+        if wait:
+            self.budget.refund(reservation)
+            raise self.defer("rate_limited", wait)
+        with self._lock:
+            self.counters["requests"][flight.lane] += 1
+        metrics.IMAGERY_REQUESTS.inc(lane=flight.lane)
+        return reservation
+
+    def settle(self, reservation, status, retry_after: float = None):
+        """
+        Records the provider's answer to an admitted request (status None: no answer).
+        Only 200s are billed, so anything else is refunded; a 429 holds every lane
+        back for retry_after seconds.
+        """
+        if status == 200:
+            self.bucket.recover()
+            return
+        self.budget.refund(reservation)
+        if status == 429:
+            with self._lock:
+                self.counters["throttled"] += 1
+            metrics.IMAGERY_THROTTLED.inc()
+            self.bucket.pause(retry_after or 0.0)
+
+    def defer(self, reason: str, retry_after: float) -> ImageryDeferred:
+        deferred = ImageryDeferred(reason, retry_after)
+        self._count_deferred(deferred)
+        return deferred
+
+    def _count_deferred(self, deferred):
+        with self._lock:
+            self.counters["deferred"] += 1
+        metrics.IMAGERY_DEFERRED.inc(reason=deferred.reason)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {k: dict(v) if isinstance(v, dict) else v for k, v in self.counters.items()}
+            in_flight = len(self._flights)
+        return {**counters, "in_flight": in_flight, "rate_limiter": self.bucket.stats(), "usage": self.budget.usage()}
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_imagery_scheduler() -> ImageryScheduler:
+    """
+    Process-wide ImageryScheduler.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ImageryScheduler()
+    return _scheduler
@@ -0,0 +1,196 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Configuration
+TILE_CACHE_ENABLED = os.getenv("TILE_CACHE_ENABLED", "1") == "1"
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "tile_cache"))
+TILE_CACHE_PRECISION = int(os.getenv("TILE_CACHE_PRECISION", "5"))      # decimals kept from lat/lon (5 ~= 1.1 m)
+TILE_CACHE_MAX_MB = float(os.getenv("TILE_CACHE_MAX_MB", "2048"))        # on-disk budget
+TILE_CACHE_TTL_HOURS = float(os.getenv("TILE_CACHE_TTL_HOURS", "720"))   # 30 days, 0 disables expiry
+TILE_CACHE_MEMORY_ITEMS = int(os.getenv("TILE_CACHE_MEMORY_ITEMS", "128"))
+# Temp files older than this are left over from a crashed writer; younger ones may still be written
+STALE_TMP_SECONDS = 600
+
+class TileCache:
+    """
+    Two-level cache for encoded satellite tiles.
+    - Hot layer: in-memory LRU of the most recently used tiles.
+    - Disk layer: one file per tile, named by the SHA-256 of (lat, lon, zoom, size),
+      holding the provider's PNG/JPEG bytes as received (already compressed).
+    Disk entries are evicted least-recently-used once the size budget is exceeded,
+    and dropped on read (from either layer) once older than the TTL.
+    """
+    def __init__(self, directory: str = TILE_CACHE_DIR, precision: int = TILE_CACHE_PRECISION,
+                 max_bytes: int = int(TILE_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = TILE_CACHE_TTL_HOURS * 3600,
+                 memory_items: int = TILE_CACHE_MEMORY_ITEMS):
+        self.directory = directory
+        self.precision = precision
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_items = memory_items
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> (bytes, time written)
+        self._disk = OrderedDict()     # key -> size in bytes, least recently used first
+        self._disk_bytes = 0
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def snap(self, lat: float, lon: float):
+        """
+        Rounds coordinates so that requests a few centimetres apart share one tile.
+        Callers should fetch at the snapped center so the cached image matches its key.
+        """
+        return round(lat, self.precision), round(lon, self.precision)
+
+    def key(self, lat: float, lon: float, zoom: int, size: str) -> str:
+        lat, lon = self.snap(lat, lon)
+        raw = f"{lat:.{self.precision}f},{lon:.{self.precision}f},{zoom},{size}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                data, written_at = entry
+                if self.ttl_seconds and time.time() - written_at > self.ttl_seconds:
+                    self._remove(key)
+                    self.counters["expired"] += 1
+                    self.counters["misses"] += 1
+                    return None
+                self._memory.move_to_end(key)
+                # Keep the disk layer's LRU order in step, or hot tiles get evicted first
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return data
+
+            if key not in self._disk:
+                self.counters["misses"] += 1
+                return None
+
+            path = self._path(key)
+            try:
+                written_at = os.path.getmtime(path)
+                if self.ttl_seconds and time.time() - written_at > self.ttl_seconds:
+                    self._remove(key)
+                    self.counters["expired"] += 1
+                    self.counters["misses"] += 1
+                    return None
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                self._forget(key)
+                self.counters["misses"] += 1
+                return None
+
+            self._disk.move_to_end(key)
+            self.counters["disk_hits"] += 1
+            self._remember(key, data, written_at)
+            return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial tile
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._remember(key, data, time.time())
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._remove(oldest)
+                self.counters["disk_evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _remember(self, key, data, written_at):
+        self._memory[key] = (data, written_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def _forget(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+        self._memory.pop(key, None)
+
+    def _remove(self, key):
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """
+        Rebuilds the LRU order from file mtimes so the budget survives restarts.
+        Removes temp files abandoned by crashed writers, but not ones another process is writing.
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    if name.endswith(".tmp"):
+                        if now - st.st_mtime > STALE_TMP_SECONDS:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    # Renamed or removed by another process meanwhile
+                    continue
+                entries.append((st.st_mtime, name, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_tile_cache():
+    """
+    Process-wide TileCache, or None when TILE_CACHE_ENABLED=0.
+    """
+    global _cache
+    if not TILE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TileCache()
+    return _cache
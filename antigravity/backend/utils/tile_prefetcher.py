@@ -0,0 +1,56 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.image_fetcher import FETCH_CONCURRENCY
+
+# How many tiles may be requested ahead of the consumer (e.g. while a batch is in the model)
+FETCH_PREFETCH = int(os.getenv("FETCH_PREFETCH", "16"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_fetch_pool() -> ThreadPoolExecutor:
+    """
+    Process-wide bounded worker pool for tile fetches.
+    Shared so that concurrent batches together never exceed FETCH_CONCURRENCY requests.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="tile-fetch")
+    return _pool
+
+def prefetch_map(fetch_fn, items, prefetch: int = FETCH_PREFETCH, pool: ThreadPoolExecutor = None):
+    """
+    Lazily applies fetch_fn to items on the fetch pool, keeping up to `prefetch`
+    calls in flight ahead of the consumer.
+
+    Yields (item, result, error) in input order; exactly one of result/error is None.
+    While the caller is busy with what it already received (running the model),
+    the next tiles keep downloading in the background.
+    """
+    pool = pool or get_fetch_pool()
+    prefetch = max(1, prefetch)
+    items = iter(items)
+    in_flight = deque()
+
+    def _submit_next():
+        for item in items:
+            in_flight.append((item, pool.submit(fetch_fn, item)))
+            return True
+        return False
+
+    for _ in range(prefetch):
+        if not _submit_next():
+            break
+
+    while in_flight:
+        item, future = in_flight.popleft()
+        _submit_next()
+        try:
+            yield item, future.result(), None
+        except Exception as e:
+            yield item, None, e
@@ -1,17 +1,83 @@
 import os
-import torch
-import torch.utils.data
-from PIL import Image
+import sys
 import json
-import numpy as np
-
-import os
+import hashlib
+import argparse
 import torch
 import torch.utils.data
 from PIL import Image, ImageDraw
 import numpy as np
 
+CACHE_DIRNAME = "mask_cache"
+CACHE_VERSION = 1
+
+def load_annotations(label_path, w, h):
+    """
+    Parses a YOLO polygon label file for a w x h image.
+    Returns (boxes, masks): [xmin, ymin, xmax, ymax] pixel boxes and one h x w uint8
+    mask per polygon. Polygons with fewer than 3 points or an empty box are skipped.
+    """
+    boxes = []
+    masks_list = []
+    if not os.path.exists(label_path):
+        return boxes, masks_list
+
+    with open(label_path, 'r') as f:
+        lines = f.readlines()
+
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        # Format: <class_id> <x1> <y1> <x2> <y2> ... (normalized)
+        coords = np.asarray(parts[1:], dtype=np.float64)
+        if len(coords) % 2:
+            coords = coords[:-1]
+        points = coords.reshape(-1, 2) * (w, h)
+        if len(points) < 3:
+            continue
+
+        # Bounding Box
+        xmin, ymin = points.min(axis=0)
+        xmax, ymax = points.max(axis=0)
+
+        # Loose box filtering
+        if xmax <= xmin or ymax <= ymin:
+            continue
+
+        boxes.append([xmin, ymin, xmax, ymax])
+
+        # Create Binary Mask for this object
+        mask_img = Image.new('L', (w, h), 0)
+        ImageDraw.Draw(mask_img).polygon([tuple(p) for p in points.tolist()], outline=1, fill=1)
+        masks_list.append(np.array(mask_img))
+    return boxes, masks_list
+
+def make_target(idx, boxes, masks, h, w):
+    """
+    Mask R-CNN target dict; boxes is (N, 4) float32 and masks (N, h, w) uint8.
+    """
+    boxes = torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        # Mask R-CNN expects empty tensors with the correct shapes for images without objects
+        masks = torch.zeros((0, h, w), dtype=torch.uint8)
+    else:
+        masks = torch.as_tensor(masks, dtype=torch.uint8)
+
+    target = {}
+    target["boxes"] = boxes
+    target["labels"] = torch.ones((len(boxes),), dtype=torch.int64) # Class 1 for Solar
+    target["masks"] = masks
+    target["image_id"] = torch.tensor([idx])
+    target["area"] = (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0])
+    target["iscrowd"] = torch.zeros((len(boxes),), dtype=torch.int64)
+    return target
+
 class SolarDataset(torch.utils.data.Dataset):
+    """
+    Reads images and YOLO polygon labels from root/images and root/labels on every access.
+    See CachedSolarDataset for the preprocessed variant used for training.
+    """
     def __init__(self, root, transforms=None):
         self.root = root
         self.transforms = transforms
@@ -22,83 +88,149 @@ class SolarDataset(torch.utils.data.Dataset):
         # Load Image
         img_path = os.path.join(self.root, "images", self.imgs[idx])
         label_path = os.path.join(self.root, "labels", self.labels[idx])
-        
+
         img = Image.open(img_path).convert("RGB")
         w, h = img.size
-        
-        # Parse YOLO Polygon TXT
-        # Format: <class_id> <x1> <y1> <x2> <y2> ... (normalized)
-        boxes = []
-        masks_list = []
-        
-        if os.path.exists(label_path):
-            with open(label_path, 'r') as f:
-                lines = f.readlines()
-                
-            for line in lines:
-                parts = list(map(float, line.strip().split()))
-                class_id = int(parts[0])
-                coords = parts[1:]
-                
-                # Convert normalized coords to pixel coords
-                # pairs of (x, y)
-                poly_points = []
-                x_coords = []
-                y_coords = []
-                
-                for i in range(0, len(coords), 2):
-                    px = coords[i] * w
-                    py = coords[i+1] * h
-                    poly_points.append((px, py))
-                    x_coords.append(px)
-                    y_coords.append(py)
-                
-                if len(poly_points) < 3:
-                     continue
-
-                # Bounding Box
-                xmin = min(x_coords)
-                xmax = max(x_coords)
-                ymin = min(y_coords)
-                ymax = max(y_coords)
-                
-                # Loose box filtering
-                if xmax <= xmin or ymax <= ymin:
-                    continue
-
-                boxes.append([xmin, ymin, xmax, ymax])
-                
-                # Create Binary Mask for this object
-                mask_img = Image.new('L', (w, h), 0)
-                ImageDraw.Draw(mask_img).polygon(poly_points, outline=1, fill=1)
-                masks_list.append(np.array(mask_img))
-
-        # Handle images with no objects
-        if len(boxes) == 0:
-            # Mask R-CNN expects at least one background box or empty tensors with correct shapes
-            # Correct way for empty:
-            boxes = torch.zeros((0, 4), dtype=torch.float32)
-            labels = torch.zeros((0,), dtype=torch.int64)
-            masks = torch.zeros((0, h, w), dtype=torch.uint8)
-            area = torch.zeros((0,), dtype=torch.float32)
-            iscrowd = torch.zeros((0,), dtype=torch.int64)
-        else:
-            boxes = torch.as_tensor(boxes, dtype=torch.float32)
-            labels = torch.ones((len(boxes),), dtype=torch.int64) # Class 1 for Solar
-            masks = np.stack(masks_list, axis=0)
-            masks = torch.as_tensor(masks, dtype=torch.uint8)
-            area = (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0])
-            iscrowd = torch.zeros((len(boxes),), dtype=torch.int64)
-
-        image_id = torch.tensor([idx])
-
-        target = {}
-        target["boxes"] = boxes
-        target["labels"] = labels
-        target["masks"] = masks
-        target["image_id"] = image_id
-        target["area"] = area
-        target["iscrowd"] = iscrowd
+
+        boxes, masks_list = load_annotations(label_path, w, h)
+        target = make_target(idx, boxes, np.stack(masks_list, axis=0) if masks_list else None, h, w)
+
+        if self.transforms is not None:
+            img = self.transforms(img)
+
+        return img, target
+
+    def __len__(self):
+        return len(self.imgs)
+
+# Pre-rasterized cache
+
+def _source_signature(root):
+    """
+    Hash of every image and label file name, size and mtime: any change makes the cache stale.
+    """
+    digest = hashlib.sha256()
+    for sub in ("images", "labels"):
+        directory = os.path.join(root, sub)
+        for name in sorted(os.listdir(directory)):
+            stat = os.stat(os.path.join(directory, name))
+            digest.update(f"{sub}/{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def cache_is_fresh(root, cache_dir=None):
+    cache_dir = cache_dir or os.path.join(root, CACHE_DIRNAME)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta.get("version") == CACHE_VERSION and meta.get("signature") == _source_signature(root)
+
+def build_cache(root, cache_dir=None):
+    """
+    One-time conversion of root/images + root/labels into a cache directory:
+    - images.u8:  decoded RGB pixels of every image, back to back (read memory-mapped);
+    - masks.bits: every object mask, bit-packed (8x smaller than uint8);
+    - index.npz:  per-image offsets and shapes, per-object boxes and mask offsets;
+    - meta.json:  file list and a signature of the source files.
+    Samples are identical to SolarDataset's (same pairing, parsing and rasterization).
+    """
+    cache_dir = cache_dir or os.path.join(root, CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    source = SolarDataset(root)
+    signature = _source_signature(root)
+
+    img_offset, img_shape, obj_start, obj_count = [], [], [], []
+    boxes_all, mask_offset = [], []
+    pixels = masks_bytes = 0
+    with open(os.path.join(cache_dir, "images.u8"), "wb") as images_f, \
+         open(os.path.join(cache_dir, "masks.bits"), "wb") as masks_f:
+        for idx, (img_name, label_name) in enumerate(zip(source.imgs, source.labels)):
+            img = np.asarray(Image.open(os.path.join(root, "images", img_name)).convert("RGB"))
+            h, w = img.shape[:2]
+            boxes, masks = load_annotations(os.path.join(root, "labels", label_name), w, h)
+
+            img_offset.append(pixels)
+            img_shape.append(img.shape)
+            images_f.write(img.tobytes())
+            pixels += img.size
+
+            obj_start.append(len(boxes_all))
+            obj_count.append(len(boxes))
+            for box, mask in zip(boxes, masks):
+                packed = np.packbits(mask.reshape(-1).astype(bool))
+                boxes_all.append(box)
+                mask_offset.append(masks_bytes)
+                masks_f.write(packed.tobytes())
+                masks_bytes += packed.size
+            if (idx + 1) % 100 == 0:
+                print(f"Cached {idx + 1}/{len(source)} images")
+
+    np.savez(
+        os.path.join(cache_dir, "index.npz"),
+        img_offset=np.asarray(img_offset, dtype=np.int64),
+        img_shape=np.asarray(img_shape, dtype=np.int64).reshape(-1, 3),
+        obj_start=np.asarray(obj_start, dtype=np.int64),
+        obj_count=np.asarray(obj_count, dtype=np.int64),
+        boxes=np.asarray(boxes_all, dtype=np.float32).reshape(-1, 4),
+        mask_offset=np.asarray(mask_offset, dtype=np.int64),
+    )
+    # meta.json goes last: a cache without it is treated as missing
+    with open(meta_path, "w") as f:
+        json.dump({"version": CACHE_VERSION, "root": os.path.abspath(root), "signature": signature,
+                   "images": source.imgs, "labels": source.labels}, f)
+    print(f"Cached {len(source)} images and {len(boxes_all)} objects in {cache_dir} "
+          f"({(pixels + masks_bytes) / 1e6:.1f} MB)")
+    return cache_dir
+
+class CachedSolarDataset(torch.utils.data.Dataset):
+    """
+    SolarDataset read from a build_cache directory: each sample is a slice of the
+    memory-mapped pixel file and an unpackbits of its masks, with no decoding or parsing.
+    The memory maps are opened lazily, so DataLoader workers each map the files
+    themselves instead of receiving a pickled copy.
+    """
+    def __init__(self, cache_dir, transforms=None):
+        self.cache_dir = cache_dir
+        self.transforms = transforms
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            self.imgs = json.load(f)["images"]
+        with np.load(os.path.join(cache_dir, "index.npz")) as index:
+            self.index = {key: index[key] for key in index.files}
+        self._images = None
+        self._masks = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_images"] = None
+        state["_masks"] = None
+        return state
+
+    def _open(self):
+        self._images = np.memmap(os.path.join(self.cache_dir, "images.u8"), dtype=np.uint8, mode="r")
+        masks_path = os.path.join(self.cache_dir, "masks.bits")
+        # np.memmap refuses empty files (a dataset without any object)
+        self._masks = np.memmap(masks_path, dtype=np.uint8, mode="r") if os.path.getsize(masks_path) else np.zeros(0, np.uint8)
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            self._open()
+        index = self.index
+        h, w, c = (int(v) for v in index["img_shape"][idx])
+        offset = int(index["img_offset"][idx])
+        img = Image.fromarray(np.array(self._images[offset:offset + h * w * c]).reshape(h, w, c))
+
+        start, count = int(index["obj_start"][idx]), int(index["obj_count"][idx])
+        masks = None
+        if count:
+            mask_bytes = (h * w + 7) // 8
+            first = int(index["mask_offset"][start])
+            packed = np.asarray(self._masks[first:first + count * mask_bytes]).reshape(count, mask_bytes)
+            masks = np.unpackbits(packed, axis=1, count=h * w).reshape(count, h, w)
+        target = make_target(idx, index["boxes"][start:start + count], masks, h, w)
 
         if self.transforms is not None:
             img = self.transforms(img)
@@ -107,3 +239,30 @@ class SolarDataset(torch.utils.data.Dataset):
 
     def __len__(self):
         return len(self.imgs)
+
+def open_dataset(root, transforms=None, use_cache=True):
+    """
+    CachedSolarDataset when root has an up-to-date cache (see build_cache), else SolarDataset.
+    """
+    cache_dir = os.path.join(root, CACHE_DIRNAME)
+    if use_cache and cache_is_fresh(root, cache_dir):
+        return CachedSolarDataset(cache_dir, transforms)
+    if use_cache:
+        print(f"No up-to-date mask cache for {root}; run `python dataset_preprocess.py {root}` to build one")
+    return SolarDataset(root, transforms)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-rasterize datasets into a mask cache (see build_cache)")
+    parser.add_argument("roots", nargs="+", help="Dataset directories containing images/ and labels/")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cache is up to date")
+    args = parser.parse_args()
+
+    for root in args.roots:
+        if not args.force and cache_is_fresh(root):
+            print(f"Cache for {root} is up to date")
+            continue
+        build_cache(root)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
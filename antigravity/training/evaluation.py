@@ -1,36 +1,214 @@
+import os
+import sys
+import json
+import argparse
 import torch
 import numpy as np
 
-def evaluate_iou(model, data_loader, device):
+MASK_THRESHOLD = 0.5
+SCORE_THRESHOLD = 0.5
+IOU_THRESHOLDS = tuple(np.round(np.arange(0.5, 1.0, 0.05), 2))  # COCO 0.50:0.95
+
+def mask_iou_matrix(pred_masks, gt_masks):
+    """
+    IoU of every predicted mask against every ground-truth mask, as one matrix product.
+    pred_masks: (K, H, W) bool, gt_masks: (G, H, W) bool, on the same device.
+    Returns (iou (K, G), pred_areas (K,), gt_areas (G,)).
+    """
+    pred = pred_masks.flatten(1).float()
+    gt = gt_masks.flatten(1).float()
+    inter = pred @ gt.T
+    pred_areas = pred.sum(dim=1)
+    gt_areas = gt.sum(dim=1)
+    union = pred_areas[:, None] + gt_areas[None, :] - inter
+    return inter / union.clamp(min=1), pred_areas, gt_areas
+
+def match_predictions(iou, iou_thresholds=IOU_THRESHOLDS):
+    """
+    Greedy COCO-style matching (predictions in descending score order). For each IoU threshold,
+    each prediction claims the best still-unmatched ground truth at or above the threshold.
+    Returns (tp (T, K) bool, matched_iou (K,) IoU of the match at the first threshold, 0 if none).
+    """
+    num_pred, num_gt = iou.shape
+    tp = np.zeros((len(iou_thresholds), num_pred), dtype=bool)
+    matched_iou = np.zeros(num_pred, dtype=np.float32)
+    if num_pred == 0 or num_gt == 0:
+        return tp, matched_iou
+    for t, threshold in enumerate(iou_thresholds):
+        taken = np.zeros(num_gt, dtype=bool)
+        for k in range(num_pred):
+            candidates = np.where(taken, -1.0, iou[k])
+            best = int(candidates.argmax())
+            if candidates[best] >= threshold:
+                taken[best] = True
+                tp[t, k] = True
+                if t == 0:
+                    matched_iou[k] = iou[k, best]
+    return tp, matched_iou
+
+def average_precision(scores, tp, num_gt):
+    """
+    101-point interpolated AP (COCO) from the scores and TP flags of all predictions.
+    """
+    if num_gt == 0:
+        return float("nan")
+    if len(scores) == 0:
+        return 0.0
+    order = np.argsort(-scores, kind="stable")
+    tp = tp[order]
+    cum_tp = np.cumsum(tp)
+    cum_fp = np.cumsum(~tp)
+    recall = cum_tp / num_gt
+    precision = cum_tp / np.maximum(cum_tp + cum_fp, 1)
+    # Make precision monotonically decreasing, then sample it at 101 recall levels
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    levels = np.linspace(0, 1, 101)
+    idx = np.searchsorted(recall, levels, side="left")
+    sampled = np.where(idx < len(precision), precision[np.minimum(idx, len(precision) - 1)], 0.0)
+    return float(sampled.mean())
+
+class Evaluator:
+    """
+    Accumulates instance-level metrics one batch at a time. Masks are thresholded and
+    compared where the model ran; only per-prediction scores, IoU matches and per-image
+    areas are kept, so memory doesn't grow with the size of the validation set.
+    """
+    def __init__(self, score_threshold=SCORE_THRESHOLD, iou_thresholds=IOU_THRESHOLDS,
+                 mask_threshold=MASK_THRESHOLD):
+        self.score_threshold = score_threshold
+        self.iou_thresholds = tuple(iou_thresholds)
+        self.mask_threshold = mask_threshold
+        self.scores = []        # per image: (K,) scores
+        self.tp = []            # per image: (T, K) TP flags
+        self.matched_iou = []   # per image: (K,) IoU of the match at the first threshold
+        self.num_gt = 0
+        self.images = 0
+        self.union_ious = []    # per image: IoU of predicted vs ground-truth union masks
+        self.area_errors = []   # per image: (predicted - ground truth) union area in pixels
+        self.gt_areas = []
+        self.presence = []      # per image: (predicted any, ground truth any)
+
+    def update(self, outputs, targets):
+        for output, target in zip(outputs, targets):
+            scores = output["scores"]
+            device = scores.device
+            height, width = target["masks"].shape[-2:]
+            gt = target["masks"].to(device) > 0
+            # Detections come sorted by score, which match_predictions relies on
+            pred = output["masks"][:, 0] > self.mask_threshold if len(scores) else \
+                torch.zeros((0, height, width), dtype=torch.bool, device=device)
+
+            iou, _, _ = mask_iou_matrix(pred, gt)
+            tp, matched_iou = match_predictions(iou.cpu().numpy(), self.iou_thresholds)
+
+            # Image-level view at the operating threshold: union of confident predictions vs union of ground truth
+            empty = torch.zeros((height, width), dtype=torch.bool, device=device)
+            confident = scores >= self.score_threshold
+            pred_union = pred[confident].any(dim=0) if bool(confident.any()) else empty
+            gt_union = gt.any(dim=0) if len(gt) else empty
+            inter = int((pred_union & gt_union).sum())
+            union = int((pred_union | gt_union).sum())
+            pred_area, gt_area = int(pred_union.sum()), int(gt_union.sum())
+            if union > 0:
+                self.union_ious.append(inter / union)
+
+            self.scores.append(scores.detach().float().cpu().numpy())
+            self.tp.append(tp)
+            self.matched_iou.append(matched_iou)
+            self.num_gt += len(gt)
+            self.images += 1
+            self.area_errors.append(pred_area - gt_area)
+            self.gt_areas.append(gt_area)
+            self.presence.append((pred_area > 0, gt_area > 0))
+
+    def summary(self):
+        scores = np.concatenate(self.scores) if self.scores else np.zeros(0, dtype=np.float32)
+        tp = np.concatenate(self.tp, axis=1) if self.tp else np.zeros((len(self.iou_thresholds), 0), dtype=bool)
+        matched_iou = np.concatenate(self.matched_iou) if self.matched_iou else np.zeros(0, dtype=np.float32)
+
+        aps = [average_precision(scores, tp[t], self.num_gt) for t in range(len(self.iou_thresholds))]
+        # Precision / recall of the predictions kept at the operating threshold, matched at the first IoU threshold
+        kept = scores >= self.score_threshold
+        kept_tp = int(tp[0][kept].sum())
+        precision = kept_tp / int(kept.sum()) if kept.any() else 0.0
+        recall = kept_tp / self.num_gt if self.num_gt else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+        area_errors = np.asarray(self.area_errors, dtype=np.float64)
+        gt_areas = np.asarray(self.gt_areas, dtype=np.float64)
+        with_gt = gt_areas > 0
+        presence = np.asarray(self.presence, dtype=bool).reshape(-1, 2)
+        iou_index = {round(float(t), 2): i for i, t in enumerate(self.iou_thresholds)}
+        return {
+            "images": self.images,
+            "ground_truths": self.num_gt,
+            "predictions": int(len(scores)),
+            "score_threshold": self.score_threshold,
+            "mean_iou": float(np.mean(self.union_ious)) if self.union_ious else 0.0,
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "mean_matched_iou": float(matched_iou[kept & tp[0]].mean()) if (kept & tp[0]).any() else 0.0,
+            "map": float(np.nanmean(aps)) if self.num_gt else float("nan"),
+            "ap50": aps[iou_index[0.5]] if 0.5 in iou_index else None,
+            "ap75": aps[iou_index[0.75]] if 0.75 in iou_index else None,
+            "area_mae_pixels": float(np.abs(area_errors).mean()) if len(area_errors) else 0.0,
+            "area_bias_pixels": float(area_errors.mean()) if len(area_errors) else 0.0,
+            "area_mape": float(np.abs(area_errors[with_gt] / gt_areas[with_gt]).mean()) if with_gt.any() else None,
+            "presence_accuracy": float((presence[:, 0] == presence[:, 1]).mean()) if len(presence) else 0.0,
+        }
+
+def evaluate(model, data_loader, device, score_threshold=SCORE_THRESHOLD, iou_thresholds=IOU_THRESHOLDS):
     """
-    Simple IoU evaluation loop.
+    Runs the model over data_loader (one forward pass per batch) and returns the Evaluator summary:
+    mean IoU, precision/recall/F1, AP50/AP75/mAP@[.5:.95] and area errors.
     """
     model.eval()
-    ious = []
-    
+    evaluator = Evaluator(score_threshold, iou_thresholds)
     with torch.no_grad():
         for images, targets in data_loader:
-            images = list(img.to(device) for img in images)
+            images = list(img.to(device, non_blocking=True) for img in images)
             outputs = model(images)
-            
-            for i, output in enumerate(outputs):
-                gt_masks = targets[i]['masks'].cpu().numpy()
-                pred_masks = output['masks'].cpu().numpy()
-                scores = output['scores'].cpu().numpy()
-                
-                # Take top prediction
-                if len(pred_masks) > 0 and scores[0] > 0.5:
-                    pred_mask = pred_masks[0, 0] > 0.5
-                    gt_mask = gt_masks[0] if len(gt_masks) > 0 else np.zeros_like(pred_mask)
-                    
-                    intersection = np.logical_and(pred_mask, gt_mask).sum()
-                    union = np.logical_or(pred_mask, gt_mask).sum()
-                    
-                    if union > 0:
-                        ious.append(intersection / union)
-                    else:
-                        ious.append(0.0)
-    
-    mean_iou = np.mean(ious) if ious else 0.0
-    print(f"Mean IoU: {mean_iou}")
-    return mean_iou
+            evaluator.update(outputs, targets)
+            del outputs
+    return evaluator.summary()
+
+def evaluate_iou(model, data_loader, device):
+    """
+    Mean IoU between the predicted and ground-truth masks per image (see evaluate for the full metrics).
+    """
+    metrics = evaluate(model, data_loader, device)
+    print(f"Mean IoU: {metrics['mean_iou']}")
+    return metrics["mean_iou"]
+
+def main():
+    from model_architecture import get_model_instance_segmentation
+    from dataset_preprocess import open_dataset
+    from train import collate_fn, get_transform
+
+    parser = argparse.ArgumentParser(description="Evaluate a checkpoint on a dataset (precision/recall, mAP, area error)")
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(__file__), "..", "backend", "models", "antigravity_model.pt"))
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "..", "dataset_valid"))
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--score-threshold", type=float, default=SCORE_THRESHOLD)
+    parser.add_argument("--output", default=None, help="Write the metrics as JSON")
+    args = parser.parse_args()
+
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    model = get_model_instance_segmentation(2, pretrained=False)
+    model.load_state_dict(torch.load(args.model, map_location=device))
+    model.to(device)
+    data_loader = torch.utils.data.DataLoader(
+        open_dataset(args.data, get_transform(train=False)), batch_size=args.batch_size, shuffle=False,
+        num_workers=args.workers, collate_fn=collate_fn, pin_memory=device.type == "cuda")
+
+    metrics = evaluate(model, data_loader, device, score_threshold=args.score_threshold)
+    print(json.dumps(metrics, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(metrics, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 import os
+import sys
+import argparse
 import torch
 import json
 import cv2
@@ -7,6 +9,9 @@ from PIL import Image
 from torchvision import transforms as T
 from model_architecture import get_model_instance_segmentation
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from mask_encoding import encode_rle
+
 # Settings
 MODEL_PATH = "/app/backend/models/antigravity_model.pt"
 IMAGE_DIR = "/app/dataset_valid/images"
@@ -16,103 +21,117 @@ CONFIDENCE_THRESHOLD = 0.40
 def get_transform():
     return T.Compose([T.ToTensor()])
 
+def load_model(model_path, device):
+    num_classes = 2
+    model = get_model_instance_segmentation(num_classes, pretrained=False)  # weights come from the checkpoint
+    print(f"Loading model from {model_path}")
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+def predict_image(model, img_path, device):
+    """
+    Runs one dataset image through the model and returns its deliverable record.
+    """
+    img_name = os.path.basename(img_path)
+    img = Image.open(img_path).convert("RGB")
+    img_tensor = get_transform()(img).to(device)
+
+    with torch.no_grad():
+        prediction = model([img_tensor])[0]
+
+    # 3. Process Output
+    scores = prediction['scores'].cpu().numpy()
+    if len(scores) > 0:
+        print(f"Max score for {img_name}: {np.max(scores):.4f}")
+    masks = prediction['masks'].cpu().numpy()
+    boxes = prediction['boxes'].cpu().numpy()
+
+    valid_indices = np.where(scores > CONFIDENCE_THRESHOLD)[0]
+    
+    has_solar = len(valid_indices) > 0
+    pv_area = 0.0
+    bbox_str = "[]"
+    mask_rles = []
+    confidence = 0.0
+
+    if has_solar:
+        # We take the highest confidence one for the "Main" detection stats
+        idx = valid_indices[0]
+        confidence = float(scores[idx])
+        
+        # Calculate Area (Pixel-based estimation, assuming ~0.1m/pixel for standard sample)
+        # In a real pipeline, we need lat/lon zoom level logic, but for dataset images, we approximate.
+        total_pixels = 0
+        all_boxes = []
+        for i in valid_indices:
+            mask = masks[i, 0] > 0.5
+            total_pixels += np.sum(mask)
+            all_boxes.append(boxes[i].astype(int).tolist())
+            mask_rles.append(encode_rle(mask))
+        
+        # Approx: 0.3m resolution => 0.09 m^2 per pixel
+        pv_area = float(total_pixels * 0.09) 
+        bbox_str = json.dumps(all_boxes, separators=(",", ":"))
+
+    # 4. Format for Hackathon Deliverable
+    # "sample_id" is filename without extension
+    sample_id = os.path.splitext(img_name)[0]
+    
+    # Fake coordinates if not provided in filename (Hackathon requirement filler)
+    # In a real pipeline, we'd parse the filename if it contained lat_lon.
+    lat = 12.9716 
+    lon = 77.5946
+
+    return {
+        "sample_id": sample_id,
+        "lat": lat,
+        "lon": lon,
+        "has_solar": bool(has_solar),
+        "confidence": round(confidence, 2),
+        "pv_area_sqm_est": round(pv_area, 2), # Correct Key Name
+        "buffer_radius_sqft": 1200,
+        "qc_status": "VERIFIABLE" if has_solar else "NOT_VERIFIABLE",
+        "bbox_or_mask": bbox_str, # Correct Key Name
+        "masks_rle": mask_rles, # COCO RLE per detection, same order as bbox_or_mask
+        "image_metadata": {"source": "Satellite", "capture_date": "2024-01-01"}
+    }
+
+def list_images(image_dir):
+    return sorted(f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+
 def main():
+    parser = argparse.ArgumentParser(description="Generate predictions.json for a folder of dataset images")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--images", default=IMAGE_DIR)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
     device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
     print(f"Using device: {device}")
 
     # 1. Load Model
-    num_classes = 2
-    model = get_model_instance_segmentation(num_classes)
-    
-    if os.path.exists(MODEL_PATH):
-        print(f"Loading model from {MODEL_PATH}")
-        model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-    else:
-        print(f"Error: Model not found at {MODEL_PATH}")
+    if not os.path.exists(args.model):
+        print(f"Error: Model not found at {args.model}")
         return
+    model = load_model(args.model, device)
 
-    model.to(device)
-    model.eval()
-
-    results = []
-    
     # 2. Iterate Images
-    if not os.path.exists(IMAGE_DIR):
-        print(f"Error: Dataset not found at {IMAGE_DIR}")
+    if not os.path.exists(args.images):
+        print(f"Error: Dataset not found at {args.images}")
         return
 
-    image_files = [f for f in os.listdir(IMAGE_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    image_files = list_images(args.images)
     print(f"Found {len(image_files)} images to process.")
 
-    for img_name in image_files:
-        img_path = os.path.join(IMAGE_DIR, img_name)
-        img = Image.open(img_path).convert("RGB")
-        img_tensor = get_transform()(img).to(device)
-
-        with torch.no_grad():
-            prediction = model([img_tensor])[0]
-
-        # 3. Process Output
-        scores = prediction['scores'].cpu().numpy()
-        if len(scores) > 0:
-            print(f"Max score for {img_name}: {np.max(scores):.4f}")
-        masks = prediction['masks'].cpu().numpy()
-        boxes = prediction['boxes'].cpu().numpy()
-
-        valid_indices = np.where(scores > CONFIDENCE_THRESHOLD)[0]
-        
-        has_solar = len(valid_indices) > 0
-        pv_area = 0.0
-        bbox_str = "[]"
-        confidence = 0.0
-
-        if has_solar:
-            # We take the highest confidence one for the "Main" detection stats
-            idx = valid_indices[0]
-            confidence = float(scores[idx])
-            
-            # Calculate Area (Pixel-based estimation, assuming ~0.1m/pixel for standard sample)
-            # In a real pipeline, we need lat/lon zoom level logic, but for dataset images, we approximate.
-            total_pixels = 0
-            all_boxes = []
-            for i in valid_indices:
-                mask = masks[i, 0] > 0.5
-                total_pixels += np.sum(mask)
-                b = boxes[i].astype(int)
-                all_boxes.append(f"[{b[0]},{b[1]},{b[2]},{b[3]}]")
-            
-            # Approx: 0.3m resolution => 0.09 m^2 per pixel
-            pv_area = float(total_pixels * 0.09) 
-            bbox_str = "[" + ",".join(all_boxes) + "]"
-
-        # 4. Format for Hackathon Deliverable
-        # "sample_id" is filename without extension
-        sample_id = os.path.splitext(img_name)[0]
-        
-        # Fake coordinates if not provided in filename (Hackathon requirement filler)
-        # In a real pipeline, we'd parse the filename if it contained lat_lon.
-        lat = 12.9716 
-        lon = 77.5946
-
-        record = {
-            "sample_id": sample_id,
-            "lat": lat,
-            "lon": lon,
-            "has_solar": bool(has_solar),
-            "confidence": round(confidence, 2),
-            "pv_area_sqm_est": round(pv_area, 2), # Correct Key Name
-            "buffer_radius_sqft": 1200,
-            "qc_status": "VERIFIABLE" if has_solar else "NOT_VERIFIABLE",
-            "bbox_or_mask": bbox_str, # Correct Key Name
-            "image_metadata": {"source": "Satellite", "capture_date": "2024-01-01"}
-        }
-        results.append(record)
+    results = [predict_image(model, os.path.join(args.images, img_name), device) for img_name in image_files]
 
     # 5. Save JSON
-    with open(OUTPUT_FILE, 'w') as f:
+    with open(args.output, 'w') as f:
         json.dump(results, f, indent=4)
     
-    print(f"Success! Generated {OUTPUT_FILE} with {len(results)} records.")
+    print(f"Success! Generated {args.output} with {len(results)} records.")
 
 if __name__ == "__main__":
     main()
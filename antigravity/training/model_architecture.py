@@ -1,13 +1,22 @@
 import torchvision
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
-from torchvision.models.detection.mask_rcnn import MaskRCNNPredictor
+from torchvision.models.detection.mask_rcnn import MaskRCNN, MaskRCNNPredictor
+from torchvision.models.detection.backbone_utils import _resnet_fpn_extractor
+from torchvision.models.resnet import resnet50
+from torchvision.ops.misc import FrozenBatchNorm2d
 
-def get_model_instance_segmentation(num_classes):
+def get_model_instance_segmentation(num_classes, pretrained=True):
     """
     Returns a Mask R-CNN model with ResNet-50-FPN backbone.
+    pretrained=False starts from random weights (no download), with the same layers as the
+    COCO model (FrozenBatchNorm2d backbone), so checkpoints load into either.
     """
-    # load an instance segmentation model pre-trained on COCO
-    model = torchvision.models.detection.maskrcnn_resnet50_fpn(weights="DEFAULT")
+    if pretrained:
+        # load an instance segmentation model pre-trained on COCO
+        model = torchvision.models.detection.maskrcnn_resnet50_fpn(weights="DEFAULT")
+    else:
+        backbone = _resnet_fpn_extractor(resnet50(weights=None, norm_layer=FrozenBatchNorm2d), trainable_layers=3)
+        model = MaskRCNN(backbone, num_classes=91)
 
     # get number of input features for the classifier
     in_features = model.roi_heads.box_predictor.cls_score.in_features
@@ -1,11 +1,18 @@
 import os
+import sys
+import json
+import time
+import argparse
+import contextlib
 import torch
 import torchvision.transforms as T
 from model_architecture import get_model_instance_segmentation
-from dataset_preprocess import SolarDataset
-from evaluation import evaluate_iou
+from dataset_preprocess import open_dataset
+from evaluation import evaluate
 import datetime
 
+TRAINING_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # Helper for transform
 def get_transform(train):
     transforms = []
@@ -16,100 +23,165 @@ def get_transform(train):
     #     transforms.append(T.RandomHorizontalFlip(0.5))
     return T.Compose(transforms)
 
-def main():
+def collate_fn(batch):
+    # Module-level (not a lambda) so DataLoader worker processes can pickle it
+    return tuple(zip(*batch))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the Mask R-CNN solar panel model")
+    parser.add_argument("--config", default=None,
+                        help="JSON file with any of the options below (as keys, e.g. \"batch_size\"); flags override it")
+    parser.add_argument("--train-dir", default=os.path.join(TRAINING_DIR, "..", "dataset_train"))
+    parser.add_argument("--valid-dir", default=os.path.join(TRAINING_DIR, "..", "dataset_valid"))
+    parser.add_argument("--output", default=os.path.join(TRAINING_DIR, "..", "backend", "models", "antigravity_model.pt"))
+    parser.add_argument("--log-dir", default=os.path.join(TRAINING_DIR, "logs"))
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--accumulate", type=int, default=1,
+                        help="Batches per optimizer step (effective batch = batch size x accumulate)")
+    parser.add_argument("--lr", type=float, default=0.005)
+    parser.add_argument("--momentum", type=float, default=0.9)
+    parser.add_argument("--weight-decay", type=float, default=0.0005)
+    parser.add_argument("--lr-step", type=int, default=3, help="Epochs between learning rate drops")
+    parser.add_argument("--lr-gamma", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="DataLoader worker processes")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "fp16"], default="fp32",
+                        help="Autocast dtype: bf16 works on CPU and GPU, fp16 needs CUDA (uses a gradient scaler)")
+    parser.add_argument("--checkpoint-every", type=int, default=5, help="Save a checkpoint every N epochs (0 disables)")
+    parser.add_argument("--no-cache", action="store_true", help="Read raw images/labels even if a mask cache exists")
+    parser.add_argument("--no-pretrained", action="store_true", help="Start from random weights instead of COCO")
+    parser.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = set(config) - set(vars(args))
+        if unknown:
+            parser.error(f"Unknown keys in {args.config}: {', '.join(sorted(unknown))}")
+        # Config values become the defaults, so flags given on the command line still win
+        parser.set_defaults(**config)
+        args = parser.parse_args(argv)
+    return args
+
+def make_loader(dataset, batch_size, shuffle, workers, device):
+    return torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_fn,
+        num_workers=workers, persistent_workers=workers > 0, pin_memory=device.type == "cuda")
+
+def autocast(device, precision):
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float16
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+def main(argv=None):
+    args = parse_args(argv)
     # settings
     device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
     num_classes = 2 # background + solar
-    num_epochs = 10
-    batch_size = 2
-    learning_rate = 0.005
-    
+    if args.precision == "fp16" and device.type != "cuda":
+        print("fp16 autocast needs CUDA; use --precision bf16 on CPU")
+        return 1
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+
     # Dataset
     # Assuming dataset is extracted to ./antigravity/dataset_train and ./antigravity/dataset_valid
-    train_dir = os.path.join(os.path.dirname(__file__), "..", "dataset_train")
-    valid_dir = os.path.join(os.path.dirname(__file__), "..", "dataset_valid")
-    
-    if not os.path.exists(train_dir):
-        print(f"Training dataset not found at {train_dir}.")
-        return
+    if not os.path.exists(args.train_dir):
+        print(f"Training dataset not found at {args.train_dir}.")
+        return 1
 
-    dataset = SolarDataset(train_dir, get_transform(train=True))
-    dataset_test = SolarDataset(valid_dir, get_transform(train=False))
+    dataset = open_dataset(args.train_dir, get_transform(train=True), use_cache=not args.no_cache)
+    dataset_test = open_dataset(args.valid_dir, get_transform(train=False), use_cache=not args.no_cache)
 
     # Remove manual split since we have folders
-    data_loader = torch.utils.data.DataLoader(
-        dataset, batch_size=batch_size, shuffle=True,  collate_fn=lambda x: tuple(zip(*x)))
-
-    data_loader_test = torch.utils.data.DataLoader(
-        dataset_test, batch_size=1, shuffle=False, collate_fn=lambda x: tuple(zip(*x)))
+    data_loader = make_loader(dataset, args.batch_size, True, args.workers, device)
+    data_loader_test = make_loader(dataset_test, args.batch_size, False, args.workers, device)
 
     # Model
-    model = get_model_instance_segmentation(num_classes)
+    model = get_model_instance_segmentation(num_classes, pretrained=not args.no_pretrained)
     model.to(device)
 
     # Optimizer
     params = [p for p in model.parameters() if p.requires_grad]
-    optimizer = torch.optim.SGD(params, lr=learning_rate,
-                                momentum=0.9, weight_decay=0.0005)
+    optimizer = torch.optim.SGD(params, lr=args.lr,
+                                momentum=args.momentum, weight_decay=args.weight_decay)
     # LR Scheduler
     lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer,
-                                                   step_size=3,
-                                                   gamma=0.1)
+                                                   step_size=args.lr_step,
+                                                   gamma=args.lr_gamma)
+    # fp16 gradients can underflow; the scaler is a no-op for fp32/bf16
+    scaler = torch.cuda.amp.GradScaler(enabled=args.precision == "fp16")
+    accumulate = max(1, args.accumulate)
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        print(f"Creating directory {output_dir}")
+        os.makedirs(output_dir)
 
     # Logging
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
-        
-    log_file = os.path.join("logs", f"training_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    os.makedirs(args.log_dir, exist_ok=True)
+    log_file = os.path.join(args.log_dir, f"training_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
     with open(log_file, 'w') as f:
-        f.write("epoch,loss,iou\n")
+        f.write("epoch,loss,iou,precision,recall,ap50,map,area_mape,samples_per_sec,epoch_seconds\n")
 
-    print("Starting training...")
-    for epoch in range(num_epochs):
+    print(f"Starting training on {device}: {len(dataset)} images, batch {args.batch_size} x {accumulate} "
+          f"accumulated, {args.workers} loader workers, {args.precision}")
+    for epoch in range(args.epochs):
         model.train()
         epoch_loss = 0
         i = 0
+        samples = 0
+        epoch_start = time.perf_counter()
+        optimizer.zero_grad()
         for images, targets in data_loader:
-            images = list(image.to(device) for image in images)
-            targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+            images = list(image.to(device, non_blocking=True) for image in images)
+            targets = [{k: v.to(device, non_blocking=True) for k, v in t.items()} for t in targets]
 
-            loss_dict = model(images, targets)
-            losses = sum(loss for loss in loss_dict.values())
+            with autocast(device, args.precision):
+                loss_dict = model(images, targets)
+                losses = sum(loss for loss in loss_dict.values())
 
-            optimizer.zero_grad()
-            losses.backward()
-            optimizer.step()
-            
-            epoch_loss += losses.item()
+            # Average over the accumulated batches so the step size doesn't depend on --accumulate
+            scaler.scale(losses / accumulate).backward()
             i += 1
+            if i % accumulate == 0 or i == len(data_loader):
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad()
+
+            epoch_loss += losses.item()
+            samples += len(images)
             if i % 10 == 0:
                 print(f"Epoch: {epoch}, Iter: {i}, Loss: {losses.item()}")
 
+        epoch_seconds = time.perf_counter() - epoch_start
+        throughput = samples / epoch_seconds if epoch_seconds > 0 else 0.0
         lr_scheduler.step()
-        
+
         # Evaluate
-        iou = evaluate_iou(model, data_loader_test, device)
-        
+        metrics = evaluate(model, data_loader_test, device)
+        iou = metrics["mean_iou"]
+
         # Log
         avg_loss = epoch_loss / len(data_loader)
         with open(log_file, 'a') as f:
-            f.write(f"{epoch},{avg_loss},{iou}\n")
-            
-        print(f"Epoch {epoch} finished. Loss: {avg_loss}, IoU: {iou}")
+            f.write(f"{epoch},{avg_loss},{iou},{metrics['precision']:.4f},{metrics['recall']:.4f},"
+                    f"{metrics['ap50']:.4f},{metrics['map']:.4f},{metrics['area_mape']},{throughput:.2f},{epoch_seconds:.1f}\n")
+
+        print(f"Epoch {epoch} finished. Loss: {avg_loss}, IoU: {iou}, AP50: {metrics['ap50']:.4f}, "
+              f"mAP: {metrics['map']:.4f}, {throughput:.2f} samples/s")
 
         # Save Checkpoint
-        if (epoch + 1) % 5 == 0:
-            torch.save(model.state_dict(), f"../backend/models/antigravity_model_ep{epoch}.pt")
+        if args.checkpoint_every and (epoch + 1) % args.checkpoint_every == 0:
+            base, ext = os.path.splitext(args.output)
+            torch.save(model.state_dict(), f"{base}_ep{epoch}{ext}")
 
     # Save Final
-    output_path = "../backend/models/antigravity_model.pt"
-    output_dir = os.path.dirname(output_path)
-    if not os.path.exists(output_dir):
-        print(f"Creating directory {output_dir}")
-        os.makedirs(output_dir)
-        
-    torch.save(model.state_dict(), output_path)
-    print(f"Model saved to {output_path}")
+    torch.save(model.state_dict(), args.output)
+    print(f"Model saved to {args.output}")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())